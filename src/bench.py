@@ -0,0 +1,548 @@
+"""热点路径的基准测试，全部离线运行
+
+- 合成数据：N个symbol × M天 × interval的k线文件、exchangeInfo、下载记录
+- 微基准：Klines.append/to_df、calc_incr/calc_kl_incr、merge_his_klines、filter_incr_gt、
+  DownloadLog.should_ignore、Exchange.get_symbols
+- 端到端：重建文件目录和下载记录、一个季度的回测、对本地模拟接口执行一轮executor
+
+每个基准测试重复多次取中位数，除以前后各运行一次的校准循环(纯python + numpy)的平均耗时，
+基线记录的是相对校准循环的倍数，可以在不同机器间比较，也能抵消机器负载的变化。
+结果超过基线(1 + threshold)倍时重新测量确认，最多测量CONFIRM_RUNS次都超过时视为退化，退出码为1；
+更新基线时测量BASELINE_RUNS次取中位数，避免把偶然偏快的结果记为基线。
+
+    python -m src.bench                 # 运行并与基线比较
+    python -m src.bench -k klines       # 只运行名称包含klines的
+    python -m src.bench --update        # 运行并更新基线
+"""
+
+import os
+import io
+import statistics
+import sys
+import json
+import shutil
+import timeit
+import argparse
+import platform
+import tempfile
+import datetime
+import contextlib
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from sqlalchemy import create_engine
+
+from src import sql
+from src.interval import interval_ms
+from src.utils import datetime2timestamp
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"
+)
+
+KLINE_COLUMNS = [
+    "open_time",
+    "open",
+    "high",
+    "low",
+    "close",
+    "volume",
+    "close_time",
+    "quote_volume",
+    "count",
+    "taker_buy_volume",
+    "taker_buy_quote_volume",
+    "ignore",
+]
+
+
+def gen_symbols(n: int) -> List[str]:
+    return [f"S{i:04d}USDT" for i in range(n)]
+
+
+def local_midnight(date: str, days: int = 0) -> int:
+    """date之后days天的本地0点，和下载器按本地日期划分文件一致"""
+    dt = datetime.datetime.fromisoformat(date) + datetime.timedelta(days=days)
+    return datetime2timestamp(dt)
+
+
+def gen_klines(
+    interval: str, start_date: str, days: int, seed: int = 0
+) -> pd.DataFrame:
+    """随机游走的k线，确定性，从start_date本地0点到days天后的本地0点(含)"""
+    step = interval_ms(interval)
+    start, end = local_midnight(start_date), local_midnight(start_date, days)
+    n = (end - start) // step + 1
+    rng = np.random.default_rng(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    open_ = np.concatenate([[10.0], close[:-1]])
+    high = np.maximum(open_, close) * (1 + rng.random(n) * 0.01)
+    low = np.minimum(open_, close) * (1 - rng.random(n) * 0.01)
+    volume = rng.random(n) * 1000
+    open_time = start + np.arange(n, dtype=np.int64) * step
+    return pd.DataFrame({
+        "open_time": open_time,
+        "open": open_,
+        "high": high,
+        "low": low,
+        "close": close,
+        "volume": volume,
+        "close_time": open_time + step - 1,
+        "quote_volume": volume * close,
+        "count": rng.integers(1, 1000, n),
+        "taker_buy_volume": volume / 2,
+        "taker_buy_quote_volume": volume * close / 2,
+        "ignore": 0,
+    })
+
+
+def write_datadir(
+    datadir: str,
+    symbols: List[str],
+    interval: str,
+    start_date: str,
+    days: int,
+) -> None:
+    """按下载器的格式写入按本地日期的文件，每个文件包含次日0点的k线"""
+    dates = pd.date_range(start_date, periods=days, freq="D").strftime("%Y-%m-%d")
+    for seed, symbol in enumerate(symbols):
+        df = gen_klines(interval, start_date, days, seed)
+        open_time = df["open_time"].to_numpy()
+        dir_ = os.path.join(datadir, symbol, interval)
+        os.makedirs(dir_, exist_ok=True)
+        for date in dates:
+            start, end = local_midnight(date), local_midnight(date, 1)
+            df[(open_time >= start) & (open_time <= end)].to_csv(
+                os.path.join(dir_, f"{symbol}-{interval}-{date}.csv"),
+                index=False,
+                float_format="%.8f",
+            )
+
+
+def gen_exchange_info(symbols: List[str]) -> Dict:
+    quotes = ("USDT", "BTC", "ETH", "FDUSD")
+    return {
+        "symbols": [
+            {
+                "symbol": s[:-4] + quotes[i % len(quotes)],
+                "status": "TRADING" if i % 10 else "BREAK",
+                "baseAsset": s[:-4],
+                "quoteAsset": quotes[i % len(quotes)],
+                "filters": [
+                    {"filterType": "PRICE_FILTER", "tickSize": "0.01"},
+                    {"filterType": "LOT_SIZE", "minQty": "0.001", "stepSize": "0.001"},
+                ],
+            }
+            for i, s in enumerate(symbols)
+        ]
+    }
+
+
+def gen_klines_items(symbol: str, interval: str, n: int) -> list:
+    from src.strategy.kline import KlineItem
+
+    step = interval_ms(interval)
+    start = local_midnight("2024-01-01")
+    rng = np.random.default_rng(0)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.01, n)))
+    return [
+        KlineItem(
+            symbol=symbol,
+            interval=interval,
+            open=f"{c * 0.99:.8f}",
+            high=f"{c * 1.01:.8f}",
+            low=f"{c * 0.98:.8f}",
+            close=f"{c:.8f}",
+            open_time=start + i * step,
+        )
+        for i, c in enumerate(close)
+    ]
+
+
+@contextlib.contextmanager
+def bench_db(root: str):
+    """把src.sql.db换成root中的sqlite，结束后恢复"""
+    engine = sql.db.engine
+    sql.db.engine = create_engine(f"sqlite:///{os.path.join(root, 'bench.sql')}")
+    try:
+        sql.db.create_all()
+        yield sql.db
+    finally:
+        sql.db.engine.dispose()
+        sql.db.engine = engine
+
+
+class BenchEnv:
+    """基准测试共用的临时目录，数据按需生成一次，数据库由bench_db提供"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._datadirs: Dict[tuple, str] = {}
+
+    def datadir(self, n_symbols: int, days: int, interval: str) -> str:
+        key = (n_symbols, days, interval)
+        if key not in self._datadirs:
+            path = os.path.join(self.root, f"data-{n_symbols}-{days}-{interval}")
+            write_datadir(path, gen_symbols(n_symbols), interval, "2024-01-01", days)
+            # 读取方通过KlineFile目录规划要读的文件
+            sql.KlineFile.rebuild(path, processes=2)
+            self._datadirs[key] = path
+        return self._datadirs[key]
+
+
+@dataclass
+class Benchmark:
+    name: str
+    kind: str  # micro/macro
+    setup: Callable[[BenchEnv], Callable[[], Any]]
+    # 超过基线(1 + threshold)倍视为退化
+    threshold: float
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+DEFAULT_THRESHOLDS = {"micro": 0.3, "macro": 0.5}
+CONFIRM_RUNS = 3
+BASELINE_RUNS = 3
+
+
+def benchmark(kind: str, threshold: Optional[float] = None):
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLDS[kind]
+
+    def decorator(setup: Callable[[BenchEnv], Callable[[], Any]]):
+        BENCHMARKS[setup.__name__] = Benchmark(setup.__name__, kind, setup, threshold)
+        return setup
+
+    return decorator
+
+
+@benchmark("micro")
+def klines_append(env: BenchEnv) -> Callable[[], Any]:
+    from src.strategy.kline import Klines
+
+    items = gen_klines_items("BTCUSDT", "1m", 1000)
+
+    def run():
+        klines = Klines()
+        for i in items:
+            klines.append(i)
+
+    return run
+
+
+@benchmark("micro")
+def klines_to_df(env: BenchEnv) -> Callable[[], Any]:
+    from src.strategy.kline import Klines
+
+    klines = Klines(gen_klines_items("BTCUSDT", "1m", 1000))
+    return klines.to_df
+
+
+@benchmark("micro")
+def calc_incr(env: BenchEnv) -> Callable[[], Any]:
+    from src.strategy.calc import calc_incr
+
+    kline = gen_klines_items("BTCUSDT", "1m", 1)[0]
+    return lambda: calc_incr(kline)
+
+
+@benchmark("micro")
+def calc_kl_incr(env: BenchEnv) -> Callable[[], Any]:
+    from src.strategy.calc import calc_kl_incr
+    from src.strategy.kline import Klines
+
+    klines = Klines(gen_klines_items("BTCUSDT", "1m", 1000))
+    return lambda: calc_kl_incr(klines)
+
+
+@benchmark("micro")
+def merge_his_klines(env: BenchEnv) -> Callable[[], Any]:
+    from src.etl import merge_his_klines
+
+    datadir = env.datadir(1, 30, "15m")
+    dir_ = os.path.join(datadir, gen_symbols(1)[0], "15m")
+    return lambda: merge_his_klines(dir_)
+
+
+@benchmark("micro")
+def filter_incr_gt(env: BenchEnv) -> Callable[[], Any]:
+    from src.etl import filter_incr_gt
+
+    df = gen_klines("1m", "2024-01-01", 30)
+    return lambda: filter_incr_gt(df, 0.01)
+
+
+@benchmark("micro")
+def download_log_should_ignore(env: BenchEnv) -> Callable[[], Any]:
+    from src.sql import DownloadLog, DLogStatus
+
+    symbols = gen_symbols(100)
+    dates = pd.date_range("2024-01-01", periods=100, freq="D").strftime("%Y-%m-%d")
+    rows = [
+        dict(
+            symbol=s,
+            interval="1m",
+            date=d,
+            status=DLogStatus.success.value,
+            last_timestamp=0,
+        )
+        for s in symbols
+        for d in dates
+    ]
+    conn = sql.db.connect()
+    DownloadLog.bulk_upsert(conn, rows)
+    conn.commit()
+
+    def run():
+        DownloadLog.should_ignore(conn, symbols[50], "1m", dates[50])
+        DownloadLog.should_ignore(conn, symbols[50], "1m", "2025-01-01")
+
+    return run
+
+
+@benchmark("micro")
+def exchange_get_symbols(env: BenchEnv) -> Callable[[], Any]:
+    from src.exchange import Exchange
+
+    exchange = Exchange(gen_exchange_info(gen_symbols(2000)))
+    return lambda: exchange.get_symbols({"quoteAsset": "USDT"})
+
+
+@benchmark("macro")
+def catalog_rebuild(env: BenchEnv) -> Callable[[], Any]:
+    from src.sql import DownloadLog, KlineFile
+
+    datadir = env.datadir(50, 30, "1h")
+
+    def run():
+        KlineFile.rebuild(datadir, processes=2)
+        DownloadLog.rebuild_from_files(datadir, processes=2)
+
+    return run
+
+
+@benchmark("macro")
+def backtest_quarter(env: BenchEnv) -> Callable[[], Any]:
+    from src.etl import calc_cum_return
+
+    datadir = env.datadir(20, 90, "15m")
+
+    def run():
+        # calc_cum_return会打印命中的k线
+        with contextlib.redirect_stdout(io.StringIO()):
+            calc_cum_return(
+                datadir,
+                interval="15m",
+                n=0.02,
+                date_limit=("2024-01-01", "2024-03-30"),
+            )
+
+    return run
+
+
+@benchmark("macro")
+def executor_round(env: BenchEnv) -> Callable[[], Any]:
+    """200个symbol，对本地模拟接口执行一轮(下载k线+策略计算)，每轮每个symbol有一根新k线"""
+    from src.strategy.calc import calc_kl_last_incr
+    from src.strategy.download import BinanceSpotDownloader
+    from src.strategy.executor import Executor, StrategyPipeline
+    from src.strategy.fake_exchange import FakeExchangeServer, FakeMatchingEngine
+
+    step = interval_ms("1h")
+    symbols = gen_symbols(200)
+    history, served = {}, {}
+    for seed, s in enumerate(symbols):
+        df = gen_klines("1h", "2024-01-01", 5, seed)
+        df[KLINE_COLUMNS[1:6]] = df[KLINE_COLUMNS[1:6]].map(lambda x: f"{x:.8f}")
+        history[s] = df[KLINE_COLUMNS].values.tolist()
+        served[s] = history[s][:24]
+    server = FakeExchangeServer(FakeMatchingEngine(klines=served)).start()
+
+    def new_bar() -> None:
+        """模拟接口返回的k线增加一根，价格循环使用生成的k线"""
+        for s, rows in served.items():
+            bar = list(history[s][len(rows) % len(history[s])])
+            bar[0] = rows[-1][0] + step
+            bar[6] = bar[0] + step - 1
+            rows.append(bar)
+
+    evaluated = 0
+
+    def strategy(kl) -> bool:
+        nonlocal evaluated
+        evaluated += 1
+        incr = calc_kl_last_incr(kl)
+        return bool(incr and incr >= 0.05)
+
+    executor = Executor(
+        StrategyPipeline([strategy]),
+        interval="1h",
+        downloader=BinanceSpotDownloader(base_url=server.base_url),
+        symbols=symbols,
+    )
+
+    def run():
+        new_bar()
+        before = evaluated
+        executor.exec_strategy(1)
+        # 没有新k线时执行器跳过策略计算，只测到了下载
+        assert evaluated - before == len(symbols), evaluated - before
+
+    return run
+
+
+def measure(func: Callable[[], Any], kind: str) -> float:
+    """返回单次调用耗时的中位数(秒)
+
+    每次重复调用number次，micro每次重复至少0.2秒，macro至少1秒(最少3次调用)
+    """
+    timer = timeit.Timer(func)
+    func()  # 预热
+    if kind == "micro":
+        number, _ = timer.autorange()
+        repeat = 7
+    else:
+        single = timer.timeit(number=1)
+        number = max(3, int(1 / single) + 1)
+        repeat = 5
+    return statistics.median(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def _calibration_loop() -> None:
+    s = 0
+    for i in range(20000):
+        s += i * i % 7
+    a = np.arange(200_000, dtype=np.float64)
+    np.sort(a[::-1]).sum()
+
+
+def calibrate() -> float:
+    """校准循环的耗时(秒)，用于把结果换算为与机器无关的倍数"""
+    return measure(_calibration_loop, "micro")
+
+
+def measure_ratio(func: Callable[[], Any], kind: str) -> Tuple[float, float]:
+    """返回(单次调用耗时, 校准循环耗时)，校准循环在前后各测一次取平均"""
+    before = calibrate()
+    seconds = measure(func, kind)
+    return seconds, (before + calibrate()) / 2
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Dict[str, float]:
+    """基准测试名称 -> 相对校准循环的倍数"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_baseline(
+    results: Dict[str, float], calibration: float, path: str = BASELINE_PATH
+) -> None:
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "calibration_seconds": calibration,
+            "updated_at": datetime.date.today().isoformat(),
+        },
+        "results": {k: results[k] for k in sorted(results)},
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.3f}{unit}"
+    return f"{seconds / 1e-9:.1f}ns"
+
+
+def run(
+    pattern: Optional[str] = None,
+    update: bool = False,
+    baseline_path: str = BASELINE_PATH,
+) -> List[str]:
+    """运行基准测试，返回退化的名称"""
+    baseline = load_baseline(baseline_path)
+    results: Dict[str, float] = {}
+    regressions = []
+    calibrations = []
+    root = tempfile.mkdtemp(prefix="bench-")
+    try:
+        with bench_db(root):
+            env = BenchEnv(root)
+            for name, bench in BENCHMARKS.items():
+                if pattern and pattern not in name:
+                    continue
+                func = bench.setup(env)
+                base = baseline.get(name)
+                limit = 1 + bench.threshold
+                runs = [measure_ratio(func, bench.kind)]
+                if update:
+                    runs += [
+                        measure_ratio(func, bench.kind) for _ in range(BASELINE_RUNS - 1)
+                    ]
+                    runs.sort(key=lambda r: r[0] / r[1])
+                    seconds, calibration = runs[len(runs) // 2]
+                else:
+                    # 超过阈值时重新测量，偶然的变慢不算退化
+                    while (
+                        base is not None
+                        and min(t / c for t, c in runs) > base * limit
+                        and len(runs) < CONFIRM_RUNS
+                    ):
+                        runs.append(measure_ratio(func, bench.kind))
+                    seconds, calibration = min(runs, key=lambda r: r[0] / r[1])
+                calibrations.append(calibration)
+                results[name] = seconds / calibration
+                if base is None:
+                    status, ratio = "new", ""
+                else:
+                    # 换算为本机的耗时
+                    base *= calibration
+                    r = seconds / base
+                    ratio = f"{r:.2f}x"
+                    status = "REGRESSION" if r > limit else "ok"
+                    if status == "REGRESSION":
+                        regressions.append(name)
+                print(
+                    f"{bench.kind:<6}{name:<30}{format_seconds(seconds):>12}"
+                    f"{format_seconds(base) if base else '-':>12}{ratio:>8}  {status}",
+                    flush=True,
+                )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    if update and results:
+        calibration = statistics.median(calibrations)
+        save_baseline(baseline | results, calibration, baseline_path)
+        print(f"baseline saved to {baseline_path}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.bench")
+    parser.add_argument("-k", dest="pattern", help="只运行名称包含该字符串的基准测试")
+    parser.add_argument("--update", action="store_true", help="用本次结果更新基线")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    print(f"{'kind':<6}{'name':<30}{'time':>12}{'baseline':>12}{'ratio':>8}  status")
+    regressions = run(args.pattern, args.update, args.baseline)
+    if regressions and not args.update:
+        print(f"regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
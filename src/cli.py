@@ -0,0 +1,204 @@
+"""统一的命令行入口
+
+    python -m src [--datadir D] [--db-url URL] [--proxy P] <command> ...
+
+command: download、ingest、catalog、backtest、run-strategy、record、config。
+模块顶层只导入标准库，pandas、binance、sqlalchemy等在子命令中导入，
+全局参数在导入这些模块之前写入src.settings，所有子命令共用。
+"""
+
+import os
+import sys
+import argparse
+import importlib
+from typing import List, Optional, Tuple
+
+from src.settings import settings
+
+
+def _date_limit(args: argparse.Namespace) -> Optional[Tuple[str, str]]:
+    if args.start and args.end:
+        return args.start, args.end
+    if args.start or args.end:
+        raise SystemExit("--start and --end must be used together")
+    return None
+
+
+def cmd_download(args: argparse.Namespace) -> None:
+    from src.utils import log2file
+
+    log2file("download.log")
+    if args.refetch:
+        from src.download import SpotDownloader
+
+        downloader = SpotDownloader(settings.datadir, to_db=args.to_db)
+        try:
+            downloader.refetch_from_report(args.refetch)
+        finally:
+            downloader.close()
+        return
+
+    if not args.start:
+        raise SystemExit("--start is required")
+    if args.agg_trades:
+        from src.download import download_usdt_symbols_agg_trades
+
+        download_usdt_symbols_agg_trades(
+            args.start, symbols=args.symbols, datadir=settings.datadir
+        )
+        return
+
+    from src.download import download_usdt_symbols_klines
+
+    for interval in args.interval:
+        download_usdt_symbols_klines(
+            interval,
+            start_date=args.start,
+            ndays=args.ndays,
+            symbols=args.symbols,
+            datadir=settings.datadir,
+            to_db=args.to_db,
+        )
+
+
+def cmd_ingest(args: argparse.Namespace) -> None:
+    from src.sql import db, Kline
+
+    db.create_all()
+    for interval in args.interval:
+        n = Kline.ingest(settings.datadir, interval, args.symbols, _date_limit(args))
+        print(f"{interval}: {n} rows")
+
+
+def cmd_catalog(args: argparse.Namespace) -> None:
+    if args.action == "rebuild":
+        from src.sql import db, DownloadLog, KlineFile
+
+        db.create_all()
+        KlineFile.rebuild(settings.datadir, processes=args.processes)
+        DownloadLog.rebuild_from_files(settings.datadir, processes=args.processes)
+    elif args.action == "compact":
+        from src.compact import compact
+
+        compact(settings.datadir, intervals=args.interval)
+    elif args.action == "check":
+        from src.integrity import scan, write_report
+
+        report = scan(
+            settings.datadir,
+            intervals=args.interval,
+            processes=args.processes,
+            use_catalog=args.use_catalog,
+        )
+        write_report(report, args.report)
+
+
+def cmd_backtest(args: argparse.Namespace) -> None:
+    from src.etl import calc_cum_return
+
+    ret = calc_cum_return(
+        settings.datadir,
+        interval=args.interval,
+        n=args.n,
+        loss=args.loss,
+        date_limit=_date_limit(args),
+        streaming=args.streaming,
+    )
+    print(f"cum return: {ret}")
+
+
+def cmd_run_strategy(args: argparse.Namespace) -> None:
+    name = args.name if "." in args.name else f"src.strategy.{args.name}"
+    importlib.import_module(name).main()
+
+
+def cmd_record(args: argparse.Namespace) -> None:
+    from src.recorder import record_usdt_symbols
+    from src.utils import log2file
+
+    log2file("recorder.log")
+    record_usdt_symbols(
+        os.path.join(settings.datadir, "stream"),
+        kline_intervals=tuple(args.interval),
+        agg_trade=not args.no_agg_trade,
+        book_ticker=not args.no_book_ticker,
+    )
+
+
+def cmd_config(args: argparse.Namespace) -> None:
+    for k, v in vars(settings).items():
+        print(f"{k}={v}")
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src")
+    parser.add_argument("--datadir", help=f"数据目录，默认{settings.datadir}")
+    parser.add_argument("--db-url", help=f"数据库，默认{settings.db_url}")
+    parser.add_argument("--proxy", help="https代理，传空字符串时不使用代理")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_date_limit(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--start", help="开始日期，例如2024-01-01")
+        p.add_argument("--end", help="结束日期(包含)")
+
+    p = sub.add_parser("download", help="下载k线或aggTrades")
+    p.add_argument("--interval", nargs="+", default=["1h"])
+    p.add_argument("--start", help="开始日期，例如20240101")
+    p.add_argument("--ndays", type=int)
+    p.add_argument("--symbols", nargs="+", help="默认所有USDT交易对")
+    p.add_argument("--to-db", action="store_true", help="同时写入k线表")
+    p.add_argument("--agg-trades", action="store_true", help="下载aggTrades")
+    p.add_argument("--refetch", metavar="REPORT", help="按完整性检查报告重新下载")
+    p.set_defaults(func=cmd_download)
+
+    p = sub.add_parser("ingest", help="把本地k线文件导入k线表")
+    p.add_argument("--interval", nargs="+", default=["1h"])
+    p.add_argument("--symbols", nargs="+")
+    add_date_limit(p)
+    p.set_defaults(func=cmd_ingest)
+
+    p = sub.add_parser("catalog", help="维护本地数据：重建目录、压缩、完整性检查")
+    p.add_argument("action", choices=["rebuild", "compact", "check"])
+    p.add_argument("--interval", nargs="+")
+    p.add_argument("--processes", type=int)
+    p.add_argument("--use-catalog", action="store_true")
+    p.add_argument("--report", default="integrity_report.csv")
+    p.set_defaults(func=cmd_catalog)
+
+    p = sub.add_parser("backtest", help="计算累计收益率")
+    p.add_argument("--interval", default="5m")
+    p.add_argument("--n", type=float, default=0.05, help="买入的涨幅阈值")
+    p.add_argument("--loss", type=float, default=0.002, help="手续费")
+    p.add_argument("--streaming", action="store_true", help="按分区计算，内存占用有上限")
+    add_date_limit(p)
+    p.set_defaults(func=cmd_backtest)
+
+    p = sub.add_parser("run-strategy", help="运行策略")
+    p.add_argument("name", help="src.strategy下的模块名(例如strategy1)或完整模块路径")
+    p.set_defaults(func=cmd_run_strategy)
+
+    p = sub.add_parser("record", help="录制行情流")
+    p.add_argument("--interval", nargs="+", default=["1m"])
+    p.add_argument("--no-agg-trade", action="store_true")
+    p.add_argument("--no-book-ticker", action="store_true")
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser("config", help="打印生效的配置")
+    p.set_defaults(func=cmd_config)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = make_parser().parse_args(argv)
+    if args.datadir:
+        settings.datadir = args.datadir
+    if args.db_url:
+        settings.db_url = args.db_url
+    if args.proxy is not None:
+        settings.proxy = args.proxy
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,166 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from binance.spot import Spot
 
+from src.interval import next_open
+from src.metrics import record_response
+from src.settings import settings
+
+
+DEFAULT_BASE_URL = "https://api3.binance.com"
+
+
+@dataclass
+class ClientConfig:
+    """所有client共享的连接配置，需要在第一次调用make_spot_clint之前修改"""
+
+    pool_size: int = 20
+    timeout: float = 10
+    # 只对GET请求的连接错误和5xx重试，429/418由调用方处理
+    retries: int = 3
+    backoff_factor: float = 0.5
+    proxies: Dict[str, str] = field(default_factory=lambda: settings.proxies)
+    # 响应缓存目录，为空时不缓存
+    cache_dir: Optional[str] = None
+    exchange_info_ttl: float = 24 * 3600
+    # 每分钟已用权重超过该值时，下载器等到下一分钟再请求(binance限制为6000)
+    max_used_weight: int = 5000
+
+
+config = ClientConfig()
+
+_sessions: Dict[Optional[str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def make_session(cfg: ClientConfig) -> requests.Session:
+    session = requests.Session()
+    retry = Retry(
+        total=cfg.retries,
+        backoff_factor=cfg.backoff_factor,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=("GET",),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=cfg.pool_size, pool_maxsize=cfg.pool_size, max_retries=retry
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def get_session(api_key: Optional[str] = None) -> requests.Session:
+    """同一个api_key共享一个带连接池的keep-alive session"""
+    with _sessions_lock:
+        session = _sessions.get(api_key)
+        if session is None:
+            session = _sessions[api_key] = make_session(config)
+        return session
+
+
+class ResponseCache:
+    """磁盘响应缓存，每个请求一个json文件，文件名为请求参数的sha1"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def make_key(method: str, *args: Any, **kwargs: Any) -> str:
+        raw = json.dumps([method, args, sorted(kwargs.items())], default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Optional[Any]:
+        path = self.path(key)
+        try:
+            if ttl is not None and os.path.getmtime(path) + ttl < time.time():
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key: str, data: Any) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+
+
+class CachedSpot(Spot):
+    """缓存已收盘区间的klines和一定时间内的exchangeInfo"""
+
+    def __init__(self, *args, cache: ResponseCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+
+    @property
+    def cacheable(self) -> bool:
+        return not (self.show_limit_usage or self.show_header)
+
+    def klines(self, symbol: str, interval: str, **kwargs):
+        end_time = kwargs.get("endTime")
+        if not self.cacheable or end_time is None:
+            return super().klines(symbol, interval, **kwargs)
+        try:
+            close_time = next_open(end_time, interval)
+        except ValueError:
+            return super().klines(symbol, interval, **kwargs)
+        # 区间内最后一根k线已收盘，结果不会再变化
+        if close_time > time.time() * 1000:
+            return super().klines(symbol, interval, **kwargs)
+
+        key = self.cache.make_key("klines", symbol, interval, **kwargs)
+        data = self.cache.get(key)
+        if data is None:
+            data = super().klines(symbol, interval, **kwargs)
+            self.cache.set(key, data)
+        return data
+
+    def exchange_info(self, *args, **kwargs):
+        if not self.cacheable:
+            return super().exchange_info(*args, **kwargs)
+        key = self.cache.make_key("exchange_info", *args, **kwargs)
+        data = self.cache.get(key, ttl=config.exchange_info_ttl)
+        if data is None:
+            data = super().exchange_info(*args, **kwargs)
+            self.cache.set(key, data)
+        return data
+
+
+def make_spot_clint(
+    base_url: str = DEFAULT_BASE_URL,
+    api_key: Optional[str] = None,
+    api_secret: Optional[str] = None,
+) -> Spot:
+    kwargs = dict(
+        api_key=api_key,
+        api_secret=api_secret,
+        base_url=base_url,
+        timeout=config.timeout,
+        proxies=config.proxies,
+    )
+    if config.cache_dir:
+        client = CachedSpot(cache=ResponseCache(config.cache_dir), **kwargs)
+    else:
+        client = Spot(**kwargs)
 
-def make_spot_clint(base_url: str = "https://api3.binance.com") -> Spot:
-    proxies = {"https": "http://127.0.0.1:7890"}
-    client = Spot(proxies=proxies, base_url=base_url)
+    session = get_session(api_key)
+    session.headers.update(client.session.headers)
+    client.session.close()
+    client.session = session
     return client
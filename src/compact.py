@@ -0,0 +1,160 @@
+"""把已结束月份的按天k线文件合并为按月的文件
+
+1. 合并某月所有按天的文件(以及已有的月度文件)，按open_time排序去重，写临时文件后替换
+2. 在同一个事务中写入月度文件的目录记录、删除按天文件的记录，并写入该月每天的下载记录
+3. 按天的文件保留grace_seconds后才删除；读取方通过KlineFile目录规划要读的文件，
+   提交后只会读到月度文件，提交前读到的按天文件在删除前仍然可读
+
+下载记录(DownloadLog)仍按天保存，按天文件删除后从目录重建下载记录时，
+由月度文件的open_time范围展开为每天一条(src.sql.monthly_download_log_rows)。
+"""
+
+import os
+import time
+import datetime
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import pandas as pd
+from loguru import logger
+from sqlalchemy import and_
+
+from src.sql import db, DownloadLog, KlineFile, monthly_download_log_rows
+from src.utils import extract_symbol_from_file, is_monthly_partition, log2file
+
+
+def monthly_path(dir_: str, symbol: str, interval: str, month: str) -> str:
+    return os.path.join(dir_, f"{symbol}-{interval}-{month}.csv")
+
+
+def group_daily_files(dir_: str, before_month: str) -> Dict[str, List[str]]:
+    """按月分组before_month之前的按天文件"""
+    groups = defaultdict(list)
+    for f in os.listdir(dir_):
+        if not f.endswith(".csv"):
+            continue
+        *_, date = extract_symbol_from_file(f)
+        if is_monthly_partition(date) or date[:7] >= before_month:
+            continue
+        groups[date[:7]].append(os.path.join(dir_, f))
+    return groups
+
+
+def compact_month(
+    datadir: str, symbol: str, interval: str, month: str, paths: List[str]
+) -> str:
+    dir_ = os.path.join(datadir, symbol, interval)
+    target = monthly_path(dir_, symbol, interval, month)
+
+    inputs = sorted(paths)
+    if os.path.exists(target):  # 月度文件生成后又补下载了某天
+        inputs.append(target)
+    df = pd.concat(pd.read_csv(p, dtype=str) for p in inputs)
+    df["_open_time"] = df["open_time"].astype("int64")
+    df = df.sort_values("_open_time", kind="stable").drop_duplicates(
+        subset=["_open_time"], keep="first"
+    )
+    log_rows = monthly_download_log_rows(
+        symbol, interval, month, df["_open_time"].to_numpy()
+    )
+    df = df.drop(columns=["_open_time"])
+
+    tmp = f"{target}.tmp"
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, target)
+
+    with db.connect() as conn:
+        KlineFile.update_file(conn, datadir, target)
+        t = KlineFile.table
+        dates = [extract_symbol_from_file(p)[2] for p in paths]
+        conn.execute(
+            t.delete().where(
+                and_(
+                    t.c.datadir == os.path.abspath(datadir),
+                    t.c.symbol == symbol,
+                    t.c.interval == interval,
+                    t.c.date.in_(dates),
+                )
+            )
+        )
+        DownloadLog.bulk_upsert(conn, log_rows)
+        conn.commit()
+
+    logger.info(f"compact {len(paths)} files to {os.path.basename(target)} done")
+    return target
+
+
+def remove_compacted(dir_: str, grace_seconds: float) -> int:
+    """删除已经合并到月度文件超过grace_seconds的按天文件"""
+    now = time.time()
+    n = 0
+    for f in os.listdir(dir_):
+        if not f.endswith(".csv"):
+            continue
+        symbol, interval, date = extract_symbol_from_file(f)
+        if is_monthly_partition(date):
+            continue
+        target = monthly_path(dir_, symbol, interval, date[:7])
+        try:
+            compacted_at = os.path.getmtime(target)
+        except FileNotFoundError:
+            continue
+        path = os.path.join(dir_, f)
+        # 月度文件之后修改过的按天文件还没有被合并
+        if os.path.getmtime(path) > compacted_at or now - compacted_at < grace_seconds:
+            continue
+        os.remove(path)
+        n += 1
+    return n
+
+
+def compact(
+    datadir: str = "../data",
+    intervals: Optional[List[str]] = None,
+    grace_seconds: float = 3600,
+    before_month: Optional[str] = None,
+) -> None:
+    """合并before_month(默认当月)之前的按天文件"""
+    before_month = before_month or datetime.date.today().strftime("%Y-%m")
+    db.create_all()
+
+    for symbol in sorted(os.listdir(datadir)):
+        symbol_dir = os.path.join(datadir, symbol)
+        if not os.path.isdir(symbol_dir):
+            continue
+        for interval in sorted(os.listdir(symbol_dir)):
+            if intervals and interval not in intervals:
+                continue
+            dir_ = os.path.join(symbol_dir, interval)
+            if not os.path.isdir(dir_):
+                continue
+
+            removed = remove_compacted(dir_, grace_seconds)
+            if removed:
+                logger.info(f"remove {removed} compacted files in {dir_}")
+
+            for month, paths in sorted(group_daily_files(dir_, before_month).items()):
+                target = monthly_path(dir_, symbol, interval, month)
+                if os.path.exists(target):
+                    compacted_at = os.path.getmtime(target)
+                    paths = [p for p in paths if os.path.getmtime(p) > compacted_at]
+                    if not paths:  # 已合并，等待删除
+                        continue
+                try:
+                    compact_month(datadir, symbol, interval, month, paths)
+                except Exception as e:
+                    logger.warning(f"compact {symbol} {interval} {month} failed: {e}")
+
+
+def run_forever(
+    datadir: str = "../data", seconds: int = 6 * 3600, **kwargs
+) -> None:
+    """后台定时压缩"""
+    while 1:
+        compact(datadir, **kwargs)
+        time.sleep(seconds)
+
+
+if __name__ == "__main__":
+    log2file("compact.log")
+    run_forever()
@@ -2,17 +2,43 @@ import os
 import time
 import datetime
 from functools import cached_property
-from typing import Union, Optional
+from typing import Union, Optional, List, Dict
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from loguru import logger
 from binance.spot import Spot
 from sqlalchemy.engine import Connection
 
-from src.client import make_spot_clint
+from src.client import config, make_spot_clint
 from src.exchange import Exchange
-from src.sql import db, DownloadLog, DLogStatus
-from src.utils import datetime2timestamp, datetime2str, date_range, df2csv
+from src.metrics import timer, USED_WEIGHT
+from src.sql import db, DownloadLog, DLogStatus, KlineFile, Kline, AggTradeLog
+from src.utils import (
+    datetime2timestamp,
+    datetime2str,
+    date_range,
+    df2csv,
+    local_days,
+    read_refetch_list,
+)
+
+MAX_KLINES_LIMIT = 1000
+MAX_AGG_TRADES_LIMIT = 1000
+
+
+AGG_TRADES_SCHEMA = pa.schema([
+    ("agg_id", pa.int64()),
+    ("price", pa.float64()),
+    ("qty", pa.float64()),
+    ("first_id", pa.int64()),
+    ("last_id", pa.int64()),
+    ("trade_time", pa.int64()),
+    ("is_buyer_maker", pa.bool_()),
+    ("is_best_match", pa.bool_()),
+])
 
 
 class SymbolDownloadHelper:
@@ -55,29 +81,41 @@ class SymbolDownloadHelper:
     def download_klines(
         self, start_time: datetime.datetime, end_time: datetime.datetime
     ) -> None:
-        data = self.downloader.client.klines(
-            self.symbol,
-            interval=self.interval,
-            startTime=datetime2timestamp(start_time),
-            endTime=datetime2timestamp(end_time),
-        )
-        df = pd.DataFrame(
-            data,
-            columns=[
-                "open_time",
-                "open",
-                "high",
-                "low",
-                "close",
-                "volume",
-                "close_time",
-                "quote_volume",
-                "count",
-                "taker_buy_volume",
-                "taker_buy_quote_volume",
-                "ignore",
-            ],
-        )
+        start, end = datetime2timestamp(start_time), datetime2timestamp(end_time)
+        data = []
+        # 单次最多返回MAX_KLINES_LIMIT根，1m等小周期一天的k线需要分页
+        while start <= end:
+            self.downloader.throttle()
+            with timer("rest"):
+                page = self.downloader.client.klines(
+                    self.symbol,
+                    interval=self.interval,
+                    startTime=start,
+                    endTime=end,
+                    limit=MAX_KLINES_LIMIT,
+                )
+            data.extend(page)
+            if len(page) < MAX_KLINES_LIMIT:
+                break
+            start = page[-1][0] + 1
+        with timer("parse"):
+            df = pd.DataFrame(
+                data,
+                columns=[
+                    "open_time",
+                    "open",
+                    "high",
+                    "low",
+                    "close",
+                    "volume",
+                    "close_time",
+                    "quote_volume",
+                    "count",
+                    "taker_buy_volume",
+                    "taker_buy_quote_volume",
+                    "ignore",
+                ],
+            )
         self._df = df
 
     @property
@@ -101,15 +139,118 @@ class SymbolDownloadHelper:
         if self.df.empty:
             logger.info(f"{self.name} data not found")
         else:
-            df2csv(self.df, self.path)
-        DownloadLog.insert_or_update(
-            conn=self.downloader.conn,
+            with timer("csv_write"):
+                df2csv(self.df, self.path)
+        with timer("db_write"):
+            if not self.df.empty:
+                KlineFile.update_file(
+                    self.downloader.conn, self.downloader.datadir, self.path
+                )
+                if self.downloader.to_db:
+                    Kline.bulk_load(
+                        self.downloader.conn, self.df, self.symbol, self.interval
+                    )
+            DownloadLog.insert_or_update(
+                conn=self.downloader.conn,
+                symbol=self.symbol,
+                interval=self.interval,
+                date=self.date,
+                status=self.status,
+                last_timestamp=self.max_timestamp,
+            )
+
+
+class AggTradesPartWriter:
+    """把aggTrades分页流式写入按天分区的parquet文件，每页一个row group
+
+    {datadir}/aggTrades/{symbol}/date={date}/{first_id}.parquet
+
+    与k线的{datadir}/{symbol}/{interval}分开保存，遍历k线目录时不会读到
+    跨天或单个文件超过part_rows时关闭当前文件(临时文件改名)，并在同一个事务里更新AggTradeLog，
+    中断后从AggTradeLog中的last_id继续，未关闭的临时文件会被覆盖。
+    """
+
+    def __init__(
+        self, downloader: "SpotDownloader", symbol: str, part_rows: int = 1_000_000
+    ):
+        self.downloader = downloader
+        self.symbol = symbol
+        self.part_rows = part_rows
+        self.dir = os.path.join(downloader.datadir, "aggTrades", symbol)
+        self.date: Optional[str] = None
+        self._writer: Optional[pq.ParquetWriter] = None
+        self._tmp = self._path = ""
+        self.first_id = self.last_id = 0
+        self.rows = 0
+
+    def _open(self, date: str, first_id: int) -> None:
+        dir_ = os.path.join(self.dir, f"date={date}")
+        os.makedirs(dir_, exist_ok=True)
+        self.date = date
+        self._path = os.path.join(dir_, f"{first_id}.parquet")
+        # 以.开头，读取分区目录时会被忽略
+        self._tmp = os.path.join(dir_, f".{first_id}.parquet.tmp")
+        self._writer = pq.ParquetWriter(self._tmp, AGG_TRADES_SCHEMA, compression="zstd")
+        self.first_id = first_id
+        self.rows = 0
+
+    def close(self, complete: bool = False) -> None:
+        """complete: 当天的数据已下载完"""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp, self._path)
+        conn = self.downloader.conn
+        AggTradeLog.upsert(
+            conn,
             symbol=self.symbol,
-            interval=self.interval,
             date=self.date,
-            status=self.status,
-            last_timestamp=self.max_timestamp,
+            status=(DLogStatus.success if complete else DLogStatus.fail).value,
+            first_id=self.first_id,
+            last_id=self.last_id,
+            rows=self.rows,
         )
+        conn.commit()
+        logger.info(f"save {self._path} done, {self.rows} rows")
+
+    def write(self, table: pa.Table) -> None:
+        ts = table.column("trade_time").to_numpy()
+        # 与k线文件一致，按本地日期分区
+        days = local_days(ts)
+        # 每天的起始位置
+        bounds = np.flatnonzero(np.diff(days)) + 1
+        for start, end in zip(
+            np.concatenate([[0], bounds]), np.concatenate([bounds, [len(ts)]])
+        ):
+            chunk = table.slice(start, end - start)
+            date = str(np.datetime64(int(days[start]), "D"))
+            if self._writer is not None and date != self.date:
+                self.close(complete=True)
+            if self._writer is None:
+                self._open(date, chunk.column("agg_id")[0].as_py())
+            with timer("parquet_write"):
+                self._writer.write_table(chunk)
+            self.rows += chunk.num_rows
+            self.last_id = chunk.column("agg_id")[-1].as_py()
+            if self.rows >= self.part_rows:
+                self.close()
+
+
+def parse_agg_trades(page: List[Dict]) -> pa.Table:
+    return pa.Table.from_arrays(
+        [
+            pa.array([i["a"] for i in page], pa.int64()),
+            pa.array([float(i["p"]) for i in page], pa.float64()),
+            pa.array([float(i["q"]) for i in page], pa.float64()),
+            pa.array([i["f"] for i in page], pa.int64()),
+            pa.array([i["l"] for i in page], pa.int64()),
+            pa.array([i["T"] for i in page], pa.int64()),
+            pa.array([i["m"] for i in page], pa.bool_()),
+            pa.array([i["M"] for i in page], pa.bool_()),
+        ],
+        schema=AGG_TRADES_SCHEMA,
+    )
 
 
 class IgnoreDict(dict):
@@ -128,9 +269,17 @@ class IgnoreDict(dict):
 class SpotDownloader:
     """现货下载器"""
 
-    def __init__(self, datadir: str = "../data", conn: Optional[Connection] = None):
+    def __init__(
+        self,
+        datadir: str = "../data",
+        conn: Optional[Connection] = None,
+        to_db: bool = False,
+    ):
+        """to_db: 同时把k线写入Kline表"""
         os.makedirs(datadir, exist_ok=True)
         self.datadir = datadir
+        self.to_db = to_db
+        db.create_all()
         self.conn = conn or db.connect()
         self.ignore = IgnoreDict()
 
@@ -186,6 +335,105 @@ class SpotDownloader:
                 ignore_exists=ignore_exists,
             )
 
+    def throttle(self) -> None:
+        """每分钟已用权重超过config.max_used_weight时等到下一分钟，所有请求共用"""
+        if USED_WEIGHT.get(window="1m") < config.max_used_weight:
+            return
+        delay = 60 - time.time() % 60 + 1
+        logger.info(f"used weight exceeds {config.max_used_weight}, sleep {delay:.0f}s")
+        time.sleep(delay)
+        USED_WEIGHT.set(0, window="1m")
+
+    def _request(self, func, *args, **kwargs):
+        """带限速和重试的请求，重试后仍然失败时抛出最后一次的异常"""
+        for i in (2, 4, 8, 16, 0):
+            self.throttle()
+            try:
+                with timer("rest"):
+                    return func(*args, **kwargs)
+            except Exception as e:
+                if not i:
+                    raise
+                logger.warning(f"request {func.__name__} failed: {e}")
+                time.sleep(i)
+
+    def find_first_agg_id(
+        self, symbol: str, start_time: datetime.datetime
+    ) -> Optional[int]:
+        page = self._request(
+            self.client.agg_trades,
+            symbol,
+            startTime=datetime2timestamp(start_time),
+            limit=1,
+        )
+        return page[0]["a"] if page else None
+
+    def download_agg_trades(
+        self,
+        symbol: str,
+        start_time: datetime.datetime,
+        end_time: Optional[datetime.datetime] = None,
+        part_rows: int = 1_000_000,
+    ) -> None:
+        """按fromId分页下载aggTrades，每页直接写入文件，从AggTradeLog记录的位置继续
+
+        start_time: 没有下载记录时的起始时间
+        end_time: 为空时下载到最新
+        """
+        last_id = AggTradeLog.find_last_id(self.conn, symbol)
+        if last_id is not None:
+            from_id = last_id + 1
+        else:
+            from_id = self.find_first_agg_id(symbol, start_time)
+            if from_id is None:
+                logger.info(f"{symbol} agg trades not found")
+                return
+        end = datetime2timestamp(end_time) if end_time else None
+
+        writer = AggTradesPartWriter(self, symbol, part_rows=part_rows)
+        try:
+            while 1:
+                page = self._request(
+                    self.client.agg_trades,
+                    symbol,
+                    fromId=from_id,
+                    limit=MAX_AGG_TRADES_LIMIT,
+                )
+                if not page:
+                    break
+                with timer("parse"):
+                    table = parse_agg_trades(page)
+                done = len(page) < MAX_AGG_TRADES_LIMIT
+                if end is not None and page[-1]["T"] > end:
+                    n = int(np.searchsorted(
+                        table.column("trade_time").to_numpy(), end, "right"
+                    ))
+                    table = table.slice(0, n)
+                    done = True
+                if table.num_rows:
+                    writer.write(table)
+                if done:
+                    break
+                from_id = page[-1]["a"] + 1
+        finally:
+            writer.close()
+        logger.info(f"download {symbol} agg trades done, last id: {writer.last_id}")
+
+    def refetch_from_report(self, path: str) -> None:
+        """根据完整性检查报告(src.integrity)重新下载有问题的日期"""
+        items = read_refetch_list(path)
+        logger.info(f"going to refetch {len(items)} days")
+        for symbol, interval, date in items:
+            start_time = pd.to_datetime(date).to_pydatetime()
+            self.download_his_klines(
+                symbol=symbol,
+                interval=interval,
+                start_time=start_time,
+                end_time=start_time + datetime.timedelta(days=1),
+                ignore_exists=False,
+            )
+            self.conn.commit()
+
     def close(self) -> None:
         self.conn.commit()
         self.conn.close()
@@ -196,12 +444,14 @@ def download_usdt_symbols_klines(
     start_date: Union[str, datetime.datetime],
     ndays: Optional[int] = None,
     symbols: Optional[list[str]] = None,
+    datadir: str = "../data",
+    to_db: bool = False,
 ) -> None:
     if not symbols:
         exchange = Exchange.from_json()
         symbols = exchange.get_symbols({"quoteAsset": "USDT"})
 
-    downloader = SpotDownloader()
+    downloader = SpotDownloader(datadir, to_db=to_db)
     try:
         for s in symbols:
             downloader.download_ndays_klines(
@@ -211,6 +461,27 @@ def download_usdt_symbols_klines(
         downloader.close()
 
 
+def download_usdt_symbols_agg_trades(
+    start_date: Union[str, datetime.datetime],
+    symbols: Optional[list[str]] = None,
+    datadir: str = "../data",
+) -> None:
+    if not symbols:
+        exchange = Exchange.from_json()
+        symbols = exchange.get_symbols({"quoteAsset": "USDT"})
+
+    downloader = SpotDownloader(datadir)
+    start_time = pd.to_datetime(start_date).to_pydatetime()
+    try:
+        for s in symbols:
+            try:
+                downloader.download_agg_trades(s, start_time)
+            except Exception as e:
+                logger.warning(f"download {s} agg trades failed: {e}")
+    finally:
+        downloader.close()
+
+
 if __name__ == "__main__":
     download_usdt_symbols_klines("15m", start_date="20240101")
     download_usdt_symbols_klines("5m", start_date="20240101")
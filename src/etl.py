@@ -1,45 +1,157 @@
 import os
-from typing import Optional, Union
+import datetime
+import itertools
+from typing import Optional, Union, List, Iterator, Tuple
 
+import numpy as np
 import pandas as pd
-from src.utils import extract_symbol_from_file
+from src.interval import ms2datetime64
+from src.sql import db, KlineFile
+from src.utils import (
+    extract_symbol_from_file,
+    is_monthly_partition,
+    date_limit2timestamps,
+    datetime2timestamp,
+)
 
 
 DataLimit = tuple[str, str]
 
 
 def timestamp2dt_ps(ps: pd.Series) -> pd.Series:
-    ps = pd.to_datetime(ps, unit="ms", utc=True).dt.tz_convert("Asia/Shanghai")
-    return ps
+    """毫秒时间戳转为UTC时间，int64直接按datetime64[ms]解释，不做时区换算"""
+    dt = ms2datetime64(ps.to_numpy())
+    return pd.Series(dt, index=ps.index, name=ps.name).dt.tz_localize("UTC")
+
+
+def list_his_klines(datadir: str, date_limit: Optional[DataLimit] = None) -> List[str]:
+    """datadir({root}/{symbol}/{interval})目录下在date_limit范围内的k线文件，按日期排序
+
+    通过KlineFile目录查询，不遍历文件系统；目录中没有root的记录时先重建
+    """
+    dir_ = os.path.abspath(datadir)
+    interval = os.path.basename(dir_)
+    symbol = os.path.basename(os.path.dirname(dir_))
+    root = os.path.dirname(os.path.dirname(dir_))
+    KlineFile.ensure(root)
+    with db.connect() as conn:
+        plan = KlineFile.plan(conn, root, interval, [symbol], date_limit)
+    return plan.get(symbol, [])
 
 
 def merge_his_klines(
-    datadir: str, date_limit: Optional[DataLimit] = None
+    datadir: str,
+    date_limit: Optional[DataLimit] = None,
+    paths: Optional[List[str]] = None,
 ) -> Union[None, pd.DataFrame]:
-    """合并datadir目录下的csv文件为DataFrame，并根据open_time去重"""
+    """合并datadir目录下的csv文件为DataFrame，并根据open_time去重
+
+    paths: 要读取的文件(例如KlineFile.plan的结果)，为空时通过list_his_klines查询
+    """
+
+    if paths is None:
+        paths = list_his_klines(datadir, date_limit)
+    monthly = any(is_monthly_partition(extract_symbol_from_file(p)[2]) for p in paths)
 
     dfs = []
-    for f in os.listdir(datadir):
-        if date_limit:
-            *_, date = extract_symbol_from_file(f)
-            if date < date_limit[0] or date > date_limit[1]:
-                continue
-        item = pd.read_csv(os.path.join(datadir, f))
-        dfs.append(item)
+    for p in paths:
+        try:
+            dfs.append(pd.read_csv(p))
+        except FileNotFoundError:  # 已被压缩任务删除，数据在月度文件中
+            continue
 
     if not dfs:
         return
     df = pd.concat(dfs)
-    df = df.drop_duplicates(subset=["open_time"]).reset_index(drop=True)
+    df = df.drop_duplicates(subset=["open_time"])
+    if monthly:
+        # 月度文件和按天的文件可能同时存在，需要排序，并按date_limit过滤月度文件中的k线
+        df = df.sort_values("open_time")
+        if date_limit:
+            start, end = date_limit2timestamps(date_limit)
+            df = df[(df["open_time"] >= start) & (df["open_time"] <= end)]
+        if df.empty:
+            return
+    df = df.reset_index(drop=True)
     df["open_date"] = timestamp2dt_ps(df["open_time"])
     return df
 
 
-def filter_incr_gt(df: pd.DataFrame, n: float) -> pd.DataFrame:
-    """过滤df收益率大于n的记录"""
+def _next_month_start(month: str) -> int:
+    """%Y-%m的下个月1日0点(本地时间)的时间戳"""
+    y, m = map(int, month.split("-"))
+    y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return datetime2timestamp(datetime.datetime(y, m, 1))
+
+
+def iter_his_klines(
+    datadir: str,
+    date_limit: Optional[DataLimit] = None,
+    paths: Optional[List[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """按时间顺序逐个分区读取k线，各分区拼接后与merge_his_klines的结果相同(包括index)
+
+    分区为一个按天的文件；有月度文件时为一个月的所有文件。内存中只保留当前分区，
+    以及上一个分区的open_time(按天的文件包含次日0点的k线，与下一个分区重复)。
+    """
+    if paths is None:
+        paths = list_his_klines(datadir, date_limit)
+    monthly = any(is_monthly_partition(extract_symbol_from_file(p)[2]) for p in paths)
+    bounds = date_limit2timestamps(date_limit) if monthly and date_limit else None
+
+    def key(p: str) -> str:
+        return extract_symbol_from_file(p)[2][:7] if monthly else p
+
+    offset = 0
+    prev: Optional[np.ndarray] = None  # 上一个分区的open_time
+    carry: Optional[pd.DataFrame] = None  # 属于下一个月的k线
+
+    def emit(df: pd.DataFrame) -> pd.DataFrame:
+        nonlocal offset, prev
+        prev = df["open_time"].to_numpy()
+        df = df.reset_index(drop=True)
+        df.index += offset
+        offset += len(df)
+        df["open_date"] = timestamp2dt_ps(df["open_time"])
+        return df
+
+    for month, group in itertools.groupby(paths, key=key):
+        dfs = [carry] if carry is not None else []
+        carry = None
+        for p in group:
+            try:
+                dfs.append(pd.read_csv(p))
+            except FileNotFoundError:  # 已被压缩任务删除，数据在月度文件中
+                continue
+        if not dfs:
+            continue
+        df = pd.concat(dfs).drop_duplicates(subset=["open_time"])
+        if prev is not None:
+            df = df[~df["open_time"].isin(prev)]
+        if monthly:
+            df = df.sort_values("open_time")
+            if bounds:
+                df = df[(df["open_time"] >= bounds[0]) & (df["open_time"] <= bounds[1])]
+            # 月末的按天文件包含次月1日0点的k线，与次月的文件一起处理
+            mask = df["open_time"] >= _next_month_start(month)
+            if mask.any():
+                carry, df = df[mask], df[~mask]
+        if not df.empty:
+            yield emit(df)
+    if carry is not None and not carry.empty:
+        yield emit(carry)
+
+
+def filter_incr_gt(
+    df: pd.DataFrame, n: float, prev_incr: float = np.nan
+) -> pd.DataFrame:
+    """过滤df收益率大于n的记录
+
+    prev_incr: df之前一根k线的收益率，分区计算时用于第一行的next_incr
+    """
 
     df["incr"] = (df["close"] - df["open"]) / df["open"]
-    df["next_incr"] = df["incr"].shift(1)
+    df["next_incr"] = df["incr"].shift(1, fill_value=prev_incr)
     return df[df["incr"] > n]
 
 
@@ -56,33 +168,53 @@ def calc_cum_return(
     n: float = 0.05,
     loss: float = 0.002,
     date_limit: Optional[DataLimit] = None,
+    streaming: bool = False,
 ) -> float:
     """计算累计收益率
 
     策略：当k线涨幅大于n时买入，interval后卖出
 
     loss: 手续费
+    streaming: 每个symbol按分区(iter_his_klines)逐个计算，只保留收益率的乘积和交易次数，
+        内存占用不随k线数量和交易次数增长，结果与一次读取全部k线相同
     """
 
-    def gen_symbol_dir():
-        for symbol in os.listdir(datadir):
-            dir_ = os.path.join(datadir, symbol, interval)
-            if os.path.exists(dir_) and os.path.isdir(dir_):
-                yield dir_
+    def gen_symbol_paths() -> Iterator[Tuple[str, List[str]]]:
+        """通过KlineFile目录规划每个symbol要读取的文件，一次查询"""
+        KlineFile.ensure(datadir)
+        with db.connect() as conn:
+            plan = KlineFile.plan(conn, datadir, interval, date_limit=date_limit)
+        for symbol, paths in plan.items():
+            yield os.path.join(datadir, symbol, interval), paths
+
+    def calc_streaming(dir_: str, paths: List[str]) -> Tuple[float, int]:
+        """逐个分区累乘，只保留收益率乘积和交易次数"""
+        prev_incr = np.nan
+        ret, count = 1.0, 0
+        for df in iter_his_klines(dir_, date_limit=date_limit, paths=paths):
+            selected = filter_incr_gt(df, n, prev_incr)
+            ret *= (selected["next_incr"] + 1).prod()
+            count += selected.shape[0]
+            prev_incr = df["incr"].iloc[-1]
+        return ret, count
 
     cum_return = 1.0
-    for p in gen_symbol_dir():
-        df = merge_his_klines(p, date_limit=date_limit)
-        if df is None:
-            continue
-        df = filter_incr_gt(df, n)
-        # df = filter_draw_down_lt(df, 0.1)
-        # df = df[df["next_incr"] > 0]
-        # df = df[df["close"] == df["high"]]
-        if df.empty:
-            continue
-        print(df)
-        cum_return *= (df["next_incr"] + 1).prod() * (1 - loss) ** df.shape[0]
+    for dir_, paths in gen_symbol_paths():
+        if streaming:
+            ret, count = calc_streaming(dir_, paths)
+        else:
+            df = merge_his_klines(dir_, date_limit=date_limit, paths=paths)
+            if df is None:
+                continue
+            df = filter_incr_gt(df, n)
+            # df = filter_draw_down_lt(df, 0.1)
+            # df = df[df["next_incr"] > 0]
+            # df = df[df["close"] == df["high"]]
+            if df.empty:
+                continue
+            print(df)
+            ret, count = (df["next_incr"] + 1).prod(), df.shape[0]
+        cum_return *= ret * (1 - loss) ** count
         # print(f"calc {p} done, cum return: {cum_return}")
     return cum_return
 
@@ -1,13 +1,142 @@
 import os
 import json
-from typing import Dict, Any, List
+import time
+import threading
+from decimal import Decimal, ROUND_DOWN
+from typing import Dict, Any, List, Set, Union, Optional
+
+from loguru import logger
 
 from src.client import make_spot_clint
 
 
-class Exchange:
+t_num = Union[str, float, Decimal]
+
+
+def _is_power_of_10(d: Decimal) -> bool:
+    return d > 0 and d.normalize().as_tuple().digits == (1,)
+
+
+class Quantizer:
+    """按tickSize/stepSize向下取整"""
+
+    __slots__ = ("step", "exp")
+
+    def __init__(self, step: str):
+        self.step = Decimal(step)
+        # binance的tickSize/stepSize基本都是10的幂，可以直接quantize
+        self.exp = self.step.normalize() if _is_power_of_10(self.step) else None
+
+    def __call__(self, value: t_num) -> Decimal:
+        value = Decimal(value)
+        if not self.step:
+            return value
+        if self.exp is not None:
+            return value.quantize(self.exp, rounding=ROUND_DOWN)
+        return (value // self.step) * self.step
+
+
+class SymbolInfo:
+    __slots__ = (
+        "symbol",
+        "status",
+        "base_asset",
+        "quote_asset",
+        "min_price",
+        "max_price",
+        "min_qty",
+        "max_qty",
+        "min_notional",
+        "quantize_price",
+        "quantize_qty",
+        "raw",
+    )
+
+    def __init__(self, data: Dict):
+        self.symbol: str = data["symbol"]
+        self.status: str = data["status"]
+        self.base_asset: str = data["baseAsset"]
+        self.quote_asset: str = data["quoteAsset"]
+        self.raw = data
+
+        filters = {i["filterType"]: i for i in data.get("filters", [])}
+        price = filters.get("PRICE_FILTER", {})
+        lot = filters.get("LOT_SIZE", {})
+        notional = filters.get("NOTIONAL") or filters.get("MIN_NOTIONAL") or {}
+        self.min_price = Decimal(price.get("minPrice", "0"))
+        self.max_price = Decimal(price.get("maxPrice", "0"))
+        self.min_qty = Decimal(lot.get("minQty", "0"))
+        self.max_qty = Decimal(lot.get("maxQty", "0"))
+        self.min_notional = Decimal(notional.get("minNotional", "0"))
+        self.quantize_price = Quantizer(price.get("tickSize", "0"))
+        self.quantize_qty = Quantizer(lot.get("stepSize", "0"))
+
+    def check_qty(self, qty: Decimal) -> bool:
+        return qty >= self.min_qty and (not self.max_qty or qty <= self.max_qty)
+
+    def check_price(self, price: Decimal) -> bool:
+        return price >= self.min_price and (
+            not self.max_price or price <= self.max_price
+        )
+
+    def check_notional(self, price: Decimal, qty: Decimal) -> bool:
+        return price * qty >= self.min_notional
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.symbol},{self.status})"
+
+
+class SymbolRegistry:
+    """exchangeInfo解析后的快照，创建后不再修改，刷新时整体替换"""
+
+    # get_symbols的filters中可以走索引的字段
+    indexed = {
+        "quoteAsset": "quote_asset",
+        "baseAsset": "base_asset",
+        "status": "status",
+    }
+
     def __init__(self, data: Dict):
         self.data = data
+        self.symbols: Dict[str, SymbolInfo] = {}
+        self.indexes: Dict[str, Dict[str, Set[str]]] = {k: {} for k in self.indexed}
+        for s in data["symbols"]:
+            info = SymbolInfo(s)
+            self.symbols[info.symbol] = info
+            for k, attr in self.indexed.items():
+                self.indexes[k].setdefault(getattr(info, attr), set()).add(info.symbol)
+        self._query_cache: Dict[tuple, List[str]] = {}
+
+    def query(self, filters: Dict[str, Any]) -> List[str]:
+        try:
+            key = tuple(sorted(filters.items()))
+            cached = self._query_cache.get(key)
+        except TypeError:  # filters的值不可hash
+            key = cached = None
+        if cached is not None:
+            return list(cached)
+
+        # 过滤不能交易的symbol
+        candidates = set(self.indexes["status"].get("TRADING", ()))
+        for k, v in filters.items():
+            if k in self.indexes:
+                candidates &= self.indexes[k].get(v, set())
+            else:
+                candidates = {s for s in candidates if self.symbols[s].raw[k] == v}
+        symbols = sorted(candidates)
+        if key is not None:
+            self._query_cache[key] = symbols
+        return list(symbols)
+
+
+class Exchange:
+    def __init__(self, data: Dict):
+        self.registry = SymbolRegistry(data)
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    @property
+    def data(self) -> Dict:
+        return self.registry.data
 
     @classmethod
     def from_json(cls) -> "Exchange":
@@ -28,21 +157,41 @@ class Exchange:
         with open("exchange_info.json", "w") as f:
             json.dump(self.data, f)
 
+    def refresh(self, data: Optional[Dict] = None) -> None:
+        """重新解析exchangeInfo，整体替换快照，读取方不会看到更新了一半的数据"""
+        if data is None:
+            data = make_spot_clint().exchange_info()
+        self.registry = SymbolRegistry(data)
+
+    def start_auto_refresh(self, seconds: int = 3600) -> None:
+        """启动后台线程定时刷新"""
+        if self._refresh_thread is not None:
+            return
+
+        def run():
+            while 1:
+                time.sleep(seconds)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.warning(f"refresh exchange info failed: {e}")
+                else:
+                    logger.info("refresh exchange info done")
+
+        self._refresh_thread = threading.Thread(target=run, daemon=True)
+        self._refresh_thread.start()
+
+    def get(self, symbol: str) -> Optional[SymbolInfo]:
+        return self.registry.symbols.get(symbol)
+
     def get_symbols(self, filters: Dict[str, Any]) -> List[str]:
-        symbols = []
-        for s in self.data["symbols"]:
-            if s["status"] != "TRADING":  # 过滤不能交易的symbol
-                continue
-            flag = 1
-            for k, v in filters.items():
-                if s[k] != v:
-                    flag = 0
-                    break
-            if flag == 0:
-                continue
-            symbols.append(s["symbol"])
-        symbols.sort()
-        return symbols
+        return self.registry.query(filters)
+
+    def quantize_price(self, symbol: str, price: t_num) -> Decimal:
+        return self.registry.symbols[symbol].quantize_price(price)
+
+    def quantize_qty(self, symbol: str, qty: t_num) -> Decimal:
+        return self.registry.symbols[symbol].quantize_qty(qty)
 
 
 if __name__ == "__main__":
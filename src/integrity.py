@@ -0,0 +1,217 @@
+"""检查本地k线数据的完整性，生成缺失/异常日期的报告，下载器可以据此重新下载
+
+检查项：
+- gap: open_time不连续(缺k线)，或间隔不是interval的整数倍(misaligned)
+- duplicate: 同一个文件内open_time重复
+- conflict: 不同文件中同一个open_time的k线数据不一致
+- ohlc: low > min(open, close)、high < max(open, close)、价格非正或不是有限值
+- rows: 某天k线数量少于应有数量(第一天和当天除外)
+- error: 检查过程出错(例如文件损坏)，date为空，不会重新下载
+"""
+
+import os
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.interval import INTERVALS, interval_ms
+from src.utils import datetime2timestamp, local_days
+from src.utils import local_utc_offset_ms, read_refetch_list  # noqa: F401
+
+DAY_MS = 24 * 3600 * 1000
+
+REPORT_COLUMNS = ["symbol", "interval", "date", "issue", "detail"]
+
+SeriesArgs = Tuple[str, str, List[str], str]
+
+
+def days2dates(days: np.ndarray) -> List[str]:
+    return [str(i)[:10] for i in (days * DAY_MS).astype("datetime64[ms]")]
+
+
+def day_lengths(days: np.ndarray) -> np.ndarray:
+    """本地日期的长度(毫秒)，夏令时切换的那天是23或25小时"""
+    epoch = datetime.datetime(1970, 1, 1)
+
+    def midnight(day: int) -> int:
+        return datetime2timestamp(epoch + datetime.timedelta(days=day))
+
+    return np.array([midnight(int(d) + 1) - midnight(int(d)) for d in days])
+
+
+def load_series(paths: List[str]) -> pd.DataFrame:
+    dfs = []
+    for i, p in enumerate(paths):
+        try:
+            df = pd.read_csv(p, usecols=["open_time", "open", "high", "low", "close"])
+        except FileNotFoundError:  # 被压缩任务删除
+            continue
+        df["file"] = i
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(
+            columns=["open_time", "open", "high", "low", "close", "file"]
+        )
+    return pd.concat(dfs, ignore_index=True)
+
+
+def scan_series(args: SeriesArgs) -> List[Dict]:
+    """检查一个(symbol, interval)的所有文件，返回问题列表"""
+    symbol, interval, paths, today = args
+    step = interval_ms(interval)
+    df = load_series(paths)
+    if df.empty:
+        return []
+
+    issues = []
+
+    def add(days: np.ndarray, issue: str, details: List[str]) -> None:
+        for date, detail in zip(days2dates(days), details):
+            issues.append(dict(
+                symbol=symbol, interval=interval, date=date, issue=issue, detail=detail
+            ))
+
+    def to_days(ts: np.ndarray) -> np.ndarray:
+        return local_days(ts)
+
+    ts = df["open_time"].to_numpy(np.int64)
+
+    # 同一个文件内重复
+    dup = df.duplicated(["file", "open_time"]).to_numpy()
+    if dup.any():
+        t, n = np.unique(to_days(ts[dup]), return_counts=True)
+        add(t, "duplicate", [f"{i} duplicated rows" for i in n])
+
+    # 不同文件中数据不一致
+    uniq = df.drop_duplicates(["open_time", "open", "high", "low", "close"])
+    conflict = uniq["open_time"].duplicated().to_numpy()
+    if conflict.any():
+        t = uniq["open_time"].to_numpy(np.int64)[conflict]
+        d, n = np.unique(to_days(t), return_counts=True)
+        add(d, "conflict", [f"{i} conflicting rows" for i in n])
+
+    # ohlc
+    o, h, l, c = (
+        uniq[k].to_numpy(np.float64) for k in ("open", "high", "low", "close")
+    )
+    bad = (
+        ~np.isfinite(o) | ~np.isfinite(h) | ~np.isfinite(l) | ~np.isfinite(c)
+        | (l <= 0)
+        | (l > np.minimum(o, c))
+        | (h < np.maximum(o, c))
+    )
+    if bad.any():
+        t = uniq["open_time"].to_numpy(np.int64)[bad]
+        d, n = np.unique(to_days(t), return_counts=True)
+        add(d, "ohlc", [f"{i} invalid rows" for i in n])
+
+    # 不连续
+    u = np.unique(ts)
+    diffs = np.diff(u)
+    for i in np.nonzero(diffs != step)[0]:
+        start, end = u[i], u[i + 1]
+        if (end - start) % step:
+            add(to_days(np.array([end])), "gap", [f"misaligned open_time {end}"])
+            continue
+        # 缺失的k线所在的每一天
+        missing_days = np.arange(to_days(start + step), to_days(end - step) + 1)
+        detail = f"missing {(end - start) // step - 1} klines in ({start}, {end})"
+        add(missing_days, "gap", [detail] * len(missing_days))
+
+    # 每天的数量
+    if step <= DAY_MS:
+        days, counts = np.unique(to_days(u), return_counts=True)
+        expected = day_lengths(days) // step
+        epoch = datetime.date(1970, 1, 1)
+        today_day = (datetime.date.fromisoformat(today) - epoch).days
+        mask = (counts < expected) & (days > days[0]) & (days < today_day)
+        # 按天下载的文件包含次日0点的k线，最后一天只有这一根时不算缺失
+        mask &= ~((days == days[-1]) & (counts == 1))
+        if mask.any():
+            add(
+                days[mask],
+                "rows",
+                [f"{i}/{e} rows" for i, e in zip(counts[mask], expected[mask])],
+            )
+
+    return issues
+
+
+def scan_series_safe(args: SeriesArgs) -> List[Dict]:
+    """出错时返回一条error记录，不影响其他(symbol, interval)的检查"""
+    try:
+        return scan_series(args)
+    except Exception as e:
+        symbol, interval, *_ = args
+        return [dict(
+            symbol=symbol, interval=interval, date="", issue="error", detail=repr(e)
+        )]
+
+
+def gen_series(
+    datadir: str,
+    intervals: Optional[List[str]] = None,
+    use_catalog: bool = False,
+) -> List[Tuple[str, str, List[str]]]:
+    if use_catalog:
+        from src.sql import db, KlineFile
+
+        KlineFile.ensure(datadir)
+        series = []
+        with db.connect() as conn:
+            for interval in intervals or KlineFile.list_intervals(conn, datadir):
+                plan = KlineFile.plan(conn, datadir, interval)
+                series.extend((s, interval, paths) for s, paths in plan.items())
+        return series
+
+    series = []
+    for symbol in sorted(os.listdir(datadir)):
+        symbol_dir = os.path.join(datadir, symbol)
+        if not os.path.isdir(symbol_dir):
+            continue
+        for interval in sorted(os.listdir(symbol_dir)):
+            dir_ = os.path.join(symbol_dir, interval)
+            if (intervals and interval not in intervals) or not os.path.isdir(dir_):
+                continue
+            # 不是k线的目录，例如旧版本下载器写入的{symbol}/aggTrades
+            if interval not in INTERVALS:
+                continue
+            paths = sorted(
+                os.path.join(dir_, f) for f in os.listdir(dir_) if f.endswith(".csv")
+            )
+            series.append((symbol, interval, paths))
+    return series
+
+
+def scan(
+    datadir: str = "../data",
+    intervals: Optional[List[str]] = None,
+    processes: Optional[int] = None,
+    use_catalog: bool = False,
+) -> pd.DataFrame:
+    """多进程检查所有(symbol, interval)，返回报告"""
+    today = datetime.date.today().isoformat()
+    args = [(*i, today) for i in gen_series(datadir, intervals, use_catalog)]
+    issues = []
+    with ProcessPoolExecutor(processes) as pool:
+        for (symbol, interval, *_), result in zip(
+            args, pool.map(scan_series_safe, args, chunksize=4)
+        ):
+            if result:
+                logger.info(f"{symbol} {interval}: {len(result)} issues")
+            issues.extend(result)
+    return pd.DataFrame(issues, columns=REPORT_COLUMNS)
+
+
+def write_report(report: pd.DataFrame, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    report.to_csv(path, index=False)
+    logger.info(f"save report {path} done, {len(report)} issues")
+
+
+if __name__ == "__main__":
+    write_report(scan(), "../data/integrity_report.csv")
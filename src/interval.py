@@ -0,0 +1,154 @@
+"""binance k线周期表和时间戳工具
+
+所有时间都以UTC毫秒时间戳(int64)表示，k线的open_time按周期对齐：
+- 1s~3d：对齐到1970-01-01 00:00 UTC起的整数倍
+- 1w：对齐到周一00:00 UTC
+- 1M：对齐到每月1日00:00 UTC，长度不固定
+
+数组版本的函数直接对numpy数组计算，不逐个创建datetime。
+"""
+
+import datetime
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+SECOND_MS = 1000
+MINUTE_MS = 60 * SECOND_MS
+HOUR_MS = 60 * MINUTE_MS
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+
+Timestamps = Union[int, np.ndarray]
+
+
+@dataclass(frozen=True)
+class Interval:
+    name: str
+    # 1M为None
+    ms: Optional[int]
+    # 对齐的起点
+    offset: int = 0
+
+    @property
+    def timedelta(self) -> datetime.timedelta:
+        if self.ms is None:
+            raise ValueError(f"Interval {self.name} has no fixed length")
+        return datetime.timedelta(milliseconds=self.ms)
+
+
+INTERVALS: Dict[str, Interval] = {
+    i.name: i
+    for i in (
+        Interval("1s", SECOND_MS),
+        Interval("1m", MINUTE_MS),
+        Interval("3m", 3 * MINUTE_MS),
+        Interval("5m", 5 * MINUTE_MS),
+        Interval("15m", 15 * MINUTE_MS),
+        Interval("30m", 30 * MINUTE_MS),
+        Interval("1h", HOUR_MS),
+        Interval("2h", 2 * HOUR_MS),
+        Interval("4h", 4 * HOUR_MS),
+        Interval("6h", 6 * HOUR_MS),
+        Interval("8h", 8 * HOUR_MS),
+        Interval("12h", 12 * HOUR_MS),
+        Interval("1d", DAY_MS),
+        Interval("3d", 3 * DAY_MS),
+        # 1970-01-01是周四，第一个周一是1970-01-05
+        Interval("1w", WEEK_MS, offset=4 * DAY_MS),
+        Interval("1M", None),
+    )
+}
+
+# 每个周期的毫秒数，1M不在其中
+INTERVAL_MS: Dict[str, int] = {k: v.ms for k, v in INTERVALS.items() if v.ms}
+
+
+def get_interval(interval: str) -> Interval:
+    try:
+        return INTERVALS[interval]
+    except KeyError:
+        raise ValueError(f"Invalid interval: {interval}") from None
+
+
+def interval_ms(interval: str) -> int:
+    """周期的毫秒数，1M长度不固定，抛出ValueError"""
+    try:
+        return INTERVAL_MS[interval]
+    except KeyError:
+        get_interval(interval)
+        raise ValueError(f"Interval {interval} has no fixed length") from None
+
+
+# rolling window ticker支持的windowSize：1m~59m、1h~23h、1d~7d
+TICKER_WINDOW_UNITS = (("d", DAY_MS, 7), ("h", HOUR_MS, 23), ("m", MINUTE_MS, 59))
+
+
+def ticker_window(interval: str, bars: int = 2) -> str:
+    """覆盖bars根k线的滚动窗口行情的windowSize，交易所不支持时抛出ValueError"""
+    ms = interval_ms(interval) * bars
+    for unit, unit_ms, limit in TICKER_WINDOW_UNITS:
+        if ms % unit_ms == 0 and ms // unit_ms <= limit:
+            return f"{ms // unit_ms}{unit}"
+    raise ValueError(f"No ticker window for {bars} bars of {interval}")
+
+
+def floor(ts: Timestamps, interval: str) -> Timestamps:
+    """时间戳所在k线的open_time"""
+    i = get_interval(interval)
+    if i.ms is None:
+        months = np.asarray(ts, dtype="int64").astype("datetime64[ms]").astype(
+            "datetime64[M]"
+        )
+        out = months.astype("datetime64[ms]").astype("int64")
+        return int(out) if np.ndim(ts) == 0 else out
+    return ts - (ts - i.offset) % i.ms
+
+
+def next_open(ts: Timestamps, interval: str) -> Timestamps:
+    """时间戳所在k线的下一根k线的open_time，即所在k线的收盘时间 + 1ms"""
+    i = get_interval(interval)
+    if i.ms is None:
+        months = np.asarray(ts, dtype="int64").astype("datetime64[ms]").astype(
+            "datetime64[M]"
+        )
+        out = (months + 1).astype("datetime64[ms]").astype("int64")
+        return int(out) if np.ndim(ts) == 0 else out
+    return floor(ts, interval) + i.ms
+
+
+def bars_between(start: Timestamps, end: Timestamps, interval: str) -> Timestamps:
+    """start所在k线到end所在k线之间相隔的k线数量"""
+    i = get_interval(interval)
+    if i.ms is None:
+        def months(ts):
+            return np.asarray(ts, dtype="int64").astype("datetime64[ms]").astype(
+                "datetime64[M]"
+            ).astype("int64")
+
+        out = months(end) - months(start)
+        return int(out) if np.ndim(out) == 0 else out
+    return (floor(end, interval) - floor(start, interval)) // i.ms
+
+
+def is_aligned(ts: Timestamps, interval: str) -> Union[bool, np.ndarray]:
+    return floor(ts, interval) == ts
+
+
+def ms2datetime64(ts: np.ndarray) -> np.ndarray:
+    """毫秒时间戳数组转为datetime64[ms](UTC)，int64数组不复制"""
+    return np.asarray(ts, dtype="int64").view("datetime64[ms]")
+
+
+def datetime642ms(dt: np.ndarray) -> np.ndarray:
+    return np.asarray(dt).astype("datetime64[ms]").view("int64")
+
+
+def ms2datetime(ts: int) -> datetime.datetime:
+    """带UTC时区的datetime"""
+    return datetime.datetime.fromtimestamp(ts / 1000, tz=datetime.timezone.utc)
+
+
+def now_ms() -> int:
+    return int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
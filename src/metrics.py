@@ -0,0 +1,291 @@
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import defaultdict, Counter as CallCounter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple, Optional, Iterator
+
+from loguru import logger
+
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    s = ",".join(
+        '{}="{}"'.format(
+            k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for k, v in items
+    )
+    return "{" + s + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type_ = "untyped"
+
+    def __init__(self, name: str, help_: str):
+        self.name = name
+        self.help = help_
+        self._lock = threading.Lock()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, help_: str):
+        super().__init__(name, help_)
+        self._values: Dict[LabelKey, float] = defaultdict(float)
+
+    def inc(self, value: float = 1.0, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] += value
+
+    def get(self, **labels: str) -> float:
+        key = _label_key(labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(k)} {_format_value(v)}" for k, v in items
+        ]
+
+
+class Gauge(Counter):
+    type_ = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name: str, help_: str, buckets: Tuple[float, ...]):
+        super().__init__(name, help_)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [各bucket计数(不累加), sum, count]
+        self._values: Dict[LabelKey, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = _label_key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                item = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            item[0][i] += 1
+            item[1] += value
+            item[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(
+                (k, (list(v[0]), v[1], v[2])) for k, v in self._values.items()
+            )
+        lines = []
+        for key, (counts, sum_, count) in items:
+            cum = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                cum += n
+                labels = _format_labels(key, ("le", _format_value(le)))
+                lines.append(f"{self.name}_bucket{labels} {cum}")
+            labels = _format_labels(key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(sum_)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args) -> Metric:
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args)
+            elif type(metric) is not cls:
+                raise ValueError(f"metric {name} already registered")
+            return metric
+
+    def counter(self, name: str, help_: str) -> Counter:
+        return self._get_or_create(Counter, name, help_)
+
+    def gauge(self, name: str, help_: str) -> Gauge:
+        return self._get_or_create(Gauge, name, help_)
+
+    def histogram(
+        self, name: str, help_: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._get_or_create(Histogram, name, help_, buckets)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """导出为prometheus文本文件(node_exporter textfile collector)，写临时文件后替换"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """在后台线程启动http服务，GET /metrics 返回prometheus文本格式"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"metrics server started at http://{host}:{port}/metrics")
+        return server
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "w3_stage_seconds", "耗时：rest请求、解析、KlinesManager.add、策略计算、写库等"
+)
+REQUEST_SECONDS = registry.histogram("w3_request_seconds", "binance rest请求耗时")
+REQUESTS = registry.counter("w3_requests_total", "binance rest请求数")
+USED_WEIGHT = registry.gauge("w3_used_weight", "binance返回的已用请求权重")
+SYMBOL_SECONDS = registry.histogram(
+    "w3_symbol_seconds", "每个symbol每轮的耗时(下载+策略计算)"
+)
+STRATEGY_ERRORS = registry.counter("w3_strategy_errors_total", "策略计算抛出异常的次数")
+SIGNAL_LATENCY = registry.histogram(
+    "w3_signal_latency_seconds",
+    "策略信号相对上一根k线收盘的延迟",
+    buckets=(0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+ROUND_SECONDS = registry.histogram(
+    "w3_round_seconds",
+    "executor每轮耗时",
+    buckets=(1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0),
+)
+
+
+@contextmanager
+def timer(stage: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def record_response(response, *args, **kwargs) -> None:
+    """requests的response hook，记录请求耗时和已用权重"""
+    path = response.request.path_url.split("?")[0]
+    REQUEST_SECONDS.observe(response.elapsed.total_seconds(), path=path)
+    REQUESTS.inc(path=path, status=str(response.status_code))
+    for k, v in response.headers.items():
+        k = k.lower()
+        if k.startswith("x-mbx-used-weight"):
+            USED_WEIGHT.set(float(v), window=k[len("x-mbx-used-weight-"):] or "total")
+
+
+class Sampler:
+    """采样分析器：后台线程定时采样目标线程的调用栈，
+    输出collapsed stack格式，可用flamegraph.pl或speedscope查看"""
+
+    def __init__(self, interval: float = 0.005, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks: CallCounter = CallCounter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def dump(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+    def __enter__(self) -> "Sampler":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
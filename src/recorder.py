@@ -0,0 +1,353 @@
+"""录制kline、aggTrade、bookTicker行情流
+
+消息解码后追加到内存中的列式缓冲区，按小时(UTC)分区写入parquet文件：
+    {root}/{stream}/{YYYY-MM-DD}/{HH}/{stream}-{起始毫秒}-{序号}.parquet
+满足以下任一条件时把缓冲区交给后台写线程：跨小时、缓冲区超过max_age秒、
+总大小超过memory_budget(写最大的缓冲区)。
+总大小包括交给写线程但还没写完的缓冲区，写完后才释放，
+写入跟不上时总大小超过memory_budget，接收线程等待写线程。
+"""
+
+import os
+import time
+import json
+import queue
+import threading
+import datetime
+from array import array
+from typing import Dict, List, Tuple, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from src.client import config
+from src.utils import log2file
+
+# 列名 -> 类型：q-int64，d-float64，b-bool，s-str
+SCHEMAS: Dict[str, List[Tuple[str, str]]] = {
+    "kline": [
+        ("recv_time", "q"),
+        ("event_time", "q"),
+        ("symbol", "s"),
+        ("interval", "s"),
+        ("open_time", "q"),
+        ("close_time", "q"),
+        ("open", "d"),
+        ("high", "d"),
+        ("low", "d"),
+        ("close", "d"),
+        ("volume", "d"),
+        ("quote_volume", "d"),
+        ("count", "q"),
+        ("taker_buy_volume", "d"),
+        ("taker_buy_quote_volume", "d"),
+        ("closed", "b"),
+    ],
+    "aggTrade": [
+        ("recv_time", "q"),
+        ("event_time", "q"),
+        ("symbol", "s"),
+        ("agg_id", "q"),
+        ("price", "d"),
+        ("qty", "d"),
+        ("first_id", "q"),
+        ("last_id", "q"),
+        ("trade_time", "q"),
+        ("is_buyer_maker", "b"),
+    ],
+    "bookTicker": [
+        ("recv_time", "q"),
+        ("symbol", "s"),
+        ("update_id", "q"),
+        ("bid", "d"),
+        ("bid_qty", "d"),
+        ("ask", "d"),
+        ("ask_qty", "d"),
+    ],
+}
+
+ARROW_TYPES = {"q": pa.int64(), "d": pa.float64(), "b": pa.bool_(), "s": pa.string()}
+NUMPY_TYPES = {"q": np.int64, "d": np.float64}
+# 估算内存用，字符串另加len()
+ITEM_SIZES = {"q": 8, "d": 8, "b": 1, "s": 8}
+
+HOUR_MS = 3600 * 1000
+
+
+class ColumnBuffer:
+    def __init__(self, stream: str, partition: int):
+        self.stream = stream
+        self.partition = partition  # 所在小时的起始毫秒
+        self.schema = SCHEMAS[stream]
+        self.columns = [
+            array(t) if t in NUMPY_TYPES else [] for _, t in self.schema
+        ]
+        self.row_size = sum(ITEM_SIZES[t] for _, t in self.schema)
+        self.str_columns = [i for i, (_, t) in enumerate(self.schema) if t == "s"]
+        self.rows = 0
+        self.nbytes = 0
+        self.created = time.time()
+
+    def append(self, row: Sequence) -> int:
+        """返回增加的字节数"""
+        for col, v in zip(self.columns, row):
+            col.append(v)
+        size = self.row_size + sum(len(row[i]) for i in self.str_columns)
+        self.rows += 1
+        self.nbytes += size
+        return size
+
+    def to_table(self) -> pa.Table:
+        arrays = []
+        for (_, t), col in zip(self.schema, self.columns):
+            if t in NUMPY_TYPES:
+                # 零拷贝
+                arrays.append(pa.array(np.frombuffer(col, dtype=NUMPY_TYPES[t])))
+            else:
+                arrays.append(pa.array(col, type=ARROW_TYPES[t]))
+        return pa.Table.from_arrays(arrays, names=[k for k, _ in self.schema])
+
+
+def decode(data: Dict, recv_time: int) -> Optional[Tuple[str, tuple]]:
+    """把消息解码为(stream, row)"""
+    e = data.get("e")
+    if e == "kline":
+        k = data["k"]
+        return "kline", (
+            recv_time,
+            data["E"],
+            data["s"],
+            k["i"],
+            k["t"],
+            k["T"],
+            float(k["o"]),
+            float(k["h"]),
+            float(k["l"]),
+            float(k["c"]),
+            float(k["v"]),
+            float(k["q"]),
+            k["n"],
+            float(k["V"]),
+            float(k["Q"]),
+            k["x"],
+        )
+    if e == "aggTrade":
+        return "aggTrade", (
+            recv_time,
+            data["E"],
+            data["s"],
+            data["a"],
+            float(data["p"]),
+            float(data["q"]),
+            data["f"],
+            data["l"],
+            data["T"],
+            data["m"],
+        )
+    if e is None and "b" in data and "a" in data and "u" in data:
+        return "bookTicker", (
+            recv_time,
+            data["s"],
+            data["u"],
+            float(data["b"]),
+            float(data["B"]),
+            float(data["a"]),
+            float(data["A"]),
+        )
+    return None
+
+
+class StreamRecorder:
+    def __init__(
+        self,
+        root: str,
+        symbols: List[str],
+        kline_intervals: Tuple[str, ...] = ("1m",),
+        agg_trade: bool = True,
+        book_ticker: bool = True,
+        memory_budget: int = 256 * 1024 * 1024,
+        max_age: float = 60,
+        streams_per_connection: int = 800,
+    ):
+        self.root = root
+        self.streams = []
+        for s in symbols:
+            s = s.lower()
+            self.streams.extend(f"{s}@kline_{i}" for i in kline_intervals)
+            if agg_trade:
+                self.streams.append(f"{s}@aggTrade")
+            if book_ticker:
+                self.streams.append(f"{s}@bookTicker")
+        self.memory_budget = memory_budget
+        self.max_age = max_age
+        self.streams_per_connection = streams_per_connection
+
+        self.buffers: Dict[str, ColumnBuffer] = {}
+        # 缓冲区和队列中还没写完的总大小
+        self.nbytes = 0
+        # 其中已交给写线程的大小
+        self.queued = 0
+        self.messages = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        # 写线程写完后通知等待的接收线程
+        self._written = threading.Condition(self._lock)
+        # 队列的大小由memory_budget限制
+        self._queue: queue.Queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._clients = []
+        self._stop = threading.Event()
+
+    def on_message(self, _, message: str) -> None:
+        recv_time = int(time.time() * 1000)
+        data = json.loads(message)
+        data = data.get("data", data)
+        decoded = decode(data, recv_time)
+        if decoded is None:
+            return
+        stream, row = decoded
+        partition = recv_time - recv_time % HOUR_MS
+
+        items = []
+        with self._lock:
+            self.messages += 1
+            buf = self.buffers.get(stream)
+            if buf is not None and buf.partition != partition:
+                items.append(self._take(stream))
+                buf = None
+            if buf is None:
+                buf = self.buffers[stream] = ColumnBuffer(stream, partition)
+            self.nbytes += buf.append(row)
+            # 队列中已有一半预算时不再拆分缓冲区，等待写线程，避免产生很多小文件
+            if self.nbytes > self.memory_budget and self.queued * 2 < self.memory_budget:
+                items.append(
+                    self._take(max(self.buffers, key=lambda k: self.buffers[k].nbytes))
+                )
+        self._enqueue(items)
+        self._wait_for_writer()
+
+    def _take(self, stream: str) -> Optional[Tuple[ColumnBuffer, int]]:
+        """取出要写入的缓冲区，调用方需要持有锁"""
+        buf = self.buffers.pop(stream, None)
+        if buf is None or not buf.rows:
+            return None
+        self._seq += 1
+        self.queued += buf.nbytes
+        return buf, self._seq
+
+    def _enqueue(self, items: List[Optional[Tuple[ColumnBuffer, int]]]) -> None:
+        """在锁外放入队列"""
+        for item in items:
+            if item is not None:
+                self._queue.put(item)
+
+    def _wait_for_writer(self, timeout: float = 1) -> None:
+        """等待中的缓冲区超过memory_budget时阻塞，直到写线程释放内存"""
+        with self._written:
+            while (
+                self.nbytes > self.memory_budget
+                and self._writer is not None
+                and self._writer.is_alive()
+            ):
+                self._written.wait(timeout)
+
+    def flush_all(self, older_than: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            items = [
+                self._take(stream)
+                for stream in list(self.buffers)
+                if older_than is None or now - self.buffers[stream].created > older_than
+            ]
+        self._enqueue(items)
+
+    def path(self, buf: ColumnBuffer, seq: int) -> str:
+        dt = datetime.datetime.fromtimestamp(
+            buf.partition / 1000, tz=datetime.timezone.utc
+        )
+        return os.path.join(
+            self.root,
+            buf.stream,
+            dt.strftime("%Y-%m-%d"),
+            dt.strftime("%H"),
+            f"{buf.stream}-{int(buf.created * 1000)}-{seq}.parquet",
+        )
+
+    def _write_loop(self) -> None:
+        while 1:
+            item = self._queue.get()
+            if item is None:
+                break
+            buf, seq = item
+            path = self.path(buf, seq)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.tmp"
+                pq.write_table(buf.to_table(), tmp, compression="zstd")
+                os.replace(tmp, path)
+            except Exception as e:
+                logger.warning(f"write {path} failed: {e}")
+            else:
+                logger.info(f"save {os.path.basename(path)} done, {buf.rows} rows")
+            with self._written:
+                self.nbytes -= buf.nbytes
+                self.queued -= buf.nbytes
+                self._written.notify_all()
+
+    def start(self) -> None:
+        from binance.websocket.spot.websocket_stream import (
+            SpotWebsocketStreamClient,
+        )
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+        for i in range(0, len(self.streams), self.streams_per_connection):
+            client = SpotWebsocketStreamClient(
+                on_message=self.on_message,
+                is_combined=True,
+                proxies=config.proxies,
+            )
+            streams = self.streams[i:i + self.streams_per_connection]
+            # 每个连接每秒最多5条订阅消息
+            for j in range(0, len(streams), 200):
+                client.subscribe(streams[j:j + 200])
+                time.sleep(0.25)
+            self._clients.append(client)
+        logger.info(
+            f"recorder started, {len(self.streams)} streams, "
+            f"{len(self._clients)} connections"
+        )
+
+    def stop(self) -> None:
+        self._stop.set()
+        for c in self._clients:
+            c.stop()
+        self.flush_all()
+        self._queue.put(None)
+        if self._writer:
+            self._writer.join()
+
+    def run_forever(self, seconds: float = 5) -> None:
+        self.start()
+        try:
+            while not self._stop.wait(seconds):
+                self.flush_all(older_than=self.max_age)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+
+def record_usdt_symbols(root: str = "../data/stream", **kwargs) -> None:
+    from src.exchange import Exchange
+
+    symbols = Exchange.from_json().get_symbols({"quoteAsset": "USDT"})
+    StreamRecorder(root, symbols, **kwargs).run_forever()
+
+
+if __name__ == "__main__":
+    log2file("recorder.log")
+    record_usdt_symbols()
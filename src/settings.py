@@ -0,0 +1,30 @@
+"""命令行和各模块共用的配置，默认值可以用环境变量覆盖
+
+W3_DATADIR: 本地数据目录
+W3_DB_URL: 下载记录、文件目录、k线表所在的数据库，支持sqlite、postgresql、mysql的SQLAlchemy URL
+W3_PROXY: 访问binance的https代理，为空时不使用代理
+
+只依赖标准库，需要在导入src.sql、src.client之前修改。
+"""
+
+import os
+from dataclasses import dataclass, field
+from typing import Dict
+
+
+@dataclass
+class Settings:
+    datadir: str = field(default_factory=lambda: os.getenv("W3_DATADIR", "../data"))
+    db_url: str = field(
+        default_factory=lambda: os.getenv("W3_DB_URL", "sqlite:///data.sql")
+    )
+    proxy: str = field(
+        default_factory=lambda: os.getenv("W3_PROXY", "http://127.0.0.1:7890")
+    )
+
+    @property
+    def proxies(self) -> Dict[str, str]:
+        return {"https": self.proxy} if self.proxy else {}
+
+
+settings = Settings()
@@ -1,18 +1,35 @@
 import datetime
+import itertools
+from collections import deque
 from enum import IntEnum
-from typing import Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import (
+    Any, Deque, Optional, Union, List, Dict, Iterable, Callable, Iterator, Tuple
+)
 
+import numpy as np
+import pandas as pd
 from loguru import logger
 from sqlalchemy import MetaData, Column, Integer, String, Table, DateTime
-from sqlalchemy import select, and_, create_engine, func
+from sqlalchemy import BigInteger, Index, Float
+from sqlalchemy import select, and_, or_, case, create_engine, func, inspect
 from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from sqlalchemy.schema import CreateTable
 from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
+from src.settings import settings
 from src.utils import (
-    get_csv_last_timestamp,
-    gen_datadir_csv,
+    datetime2timestamp,
+    get_file_stats,
+    get_file_last_timestamp,
+    scan_datadir,
     extract_symbol_from_file,
+    is_monthly_partition,
 )
 
 
@@ -37,8 +54,19 @@ class DB(metaclass=MetaDataReflect):
     def create_all(self, drop: bool = False) -> None:
         if drop:
             self.metadata.drop_all(self.engine)
+        else:
+            self._drop_outdated_catalog()
         self.metadata.create_all(self.engine, checkfirst=True)
 
+    def _drop_outdated_catalog(self) -> None:
+        """旧版本的kline_file没有datadir列，目录可以从文件重建(KlineFile.ensure)，直接删除"""
+        insp = inspect(self.engine)
+        if not insp.has_table("kline_file"):
+            return
+        if "datadir" not in {c["name"] for c in insp.get_columns("kline_file")}:
+            logger.warning("drop outdated kline_file table, it will be rebuilt")
+            self.metadata.tables["kline_file"].drop(self.engine)
+
     @classmethod
     def ddl(cls) -> str:
         sql = (
@@ -50,7 +78,37 @@ class DB(metaclass=MetaDataReflect):
         return sql
 
 
-db = DB("sqlite:///data.sql")
+db = DB(settings.db_url)
+
+
+def upsert_stmt(
+    dialect: str,
+    table: Table,
+    update: Callable[[Any], List[Tuple[str, Any]]],
+    where: Optional[Callable[[Any], Any]] = None,
+):
+    """按数据库方言生成插入或更新的语句，按主键判断冲突
+
+    sqlite/postgresql: INSERT ... ON CONFLICT (主键) DO UPDATE SET ... WHERE ...
+    mysql: INSERT ... ON DUPLICATE KEY UPDATE，不支持WHERE，每列写成IF(where, 新值, 原值)；
+        mysql按顺序逐列赋值，后面的列看到的是前面的列更新后的值，调用方要安排好update的顺序
+    update(excluded): 要更新的(列名, 值)，excluded为冲突时要插入的那行
+    """
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else pg_insert)(table)
+        return stmt.on_conflict_do_update(
+            index_elements=list(table.primary_key.columns),
+            set_=dict(update(stmt.excluded)),
+            where=None if where is None else where(stmt.excluded),
+        )
+    if dialect in ("mysql", "mariadb"):
+        stmt = mysql_insert(table)
+        values = update(stmt.inserted)
+        if where is not None:
+            cond = where(stmt.inserted)
+            values = [(k, case((cond, v), else_=table.c[k])) for k, v in values]
+        return stmt.on_duplicate_key_update(values)
+    raise ValueError(f"Unsupported database: {dialect}")
 
 
 class DLogStatus(IntEnum):
@@ -184,23 +242,527 @@ class DownloadLog(DB):
             conn.commit()
 
     @classmethod
-    def init_from_csvs(cls, datadir: str = "../data") -> None:
+    def bulk_upsert(cls, conn: Connection, rows: List[Dict]) -> None:
+        """批量插入或更新，已有记录只在状态变为成功或last_timestamp变大时更新，
+        避免覆盖下载器同时写入的更新的记录"""
+        if not rows:
+            return
+        t = cls.table
+        stmt = upsert_stmt(
+            conn.dialect.name,
+            t,
+            # mysql逐列求值：status放在最后，where不成立时status本来就与新值相同
+            lambda excluded: [
+                ("update_time", datetime.datetime.now()),
+                ("last_timestamp", excluded.last_timestamp),
+                ("status", excluded.status),
+            ],
+            where=lambda excluded: or_(
+                t.c.status != excluded.status,
+                t.c.last_timestamp.is_(None),
+                t.c.last_timestamp < excluded.last_timestamp,
+            ),
+        )
+        conn.execute(stmt, rows)
+
+    @classmethod
+    def rebuild_from_files(
+        cls,
+        datadir: str = "../data",
+        processes: Optional[int] = None,
+        batch_size: int = 5000,
+    ) -> int:
+        """用多进程只读取每个文件的最后一行(parquet读footer)，批量写入，返回处理的文件数。
+        每批单独提交，下载器可以同时运行"""
+        n = 0
+        batch = []
         with db.connect() as conn:
-            for path in gen_datadir_csv(datadir):
-                logger.info(f"going to process {path}")
-                symbol, interval, date = extract_symbol_from_file(path)
-                timestamp = get_csv_last_timestamp(path)
-                cls.insert_or_update(
-                    conn=conn,
-                    symbol=symbol,
-                    interval=interval,
-                    date=date,
-                    status=DLogStatus.success,
-                    last_timestamp=timestamp,
+            paths = scan_datadir(datadir, suffixes=(".csv", ".parquet"))
+            for rows in _pool_map(_scan_file, paths, processes):
+                batch.extend(rows)
+                if len(batch) >= batch_size:
+                    cls.bulk_upsert(conn, batch)
+                    conn.commit()
+                    n += len(batch)
+                    batch = []
+                    logger.info(f"rebuild download log, {n} files processed")
+            cls.bulk_upsert(conn, batch)
+            conn.commit()
+            n += len(batch)
+        logger.info(f"rebuild download log done, {n} files processed")
+        return n
+
+    @classmethod
+    def init_from_csvs(cls, datadir: str = "../data") -> None:
+        cls.rebuild_from_files(datadir)
+
+
+class AggTradeLog(DB):
+    """aggTrades下载记录，每个(symbol, date)一条，last_id为已写入文件的最后一条成交id"""
+
+    table = Table(
+        "agg_trade_log",
+        DB.metadata,
+        Column("symbol", String(16), primary_key=True),
+        Column("date", String(10), primary_key=True),
+        Column(
+            "status", Integer,
+            nullable=False,
+            comment="1-success(当天已下载完),2-fail(未下载完)"
+        ),
+        Column("first_id", BigInteger, nullable=False),
+        Column("last_id", BigInteger, nullable=False),
+        Column("rows", BigInteger, nullable=False),
+        Column("insert_time", DateTime, default=datetime.datetime.now),
+        Column("update_time", DateTime, onupdate=datetime.datetime.now),
+    )
+
+    @classmethod
+    def find_last_id(cls, conn: Connection, symbol: str) -> Optional[int]:
+        t = cls.table
+        stmt = select(func.max(t.c.last_id)).where(t.c.symbol == symbol)
+        return conn.execute(stmt).scalar()
+
+    @classmethod
+    def upsert(
+        cls,
+        conn: Connection,
+        symbol: str,
+        date: str,
+        status: int,
+        first_id: int,
+        last_id: int,
+        rows: int,
+    ) -> None:
+        """写入一个分片后调用，累加当天的行数"""
+        t = cls.table
+        stmt = upsert_stmt(
+            conn.dialect.name,
+            t,
+            lambda excluded: [
+                ("status", excluded.status),
+                ("last_id", excluded.last_id),
+                ("rows", t.c.rows + excluded.rows),
+                ("update_time", datetime.datetime.now()),
+            ],
+        )
+        conn.execute(stmt, [dict(
+            symbol=symbol,
+            date=date,
+            status=status,
+            first_id=first_id,
+            last_id=last_id,
+            rows=rows,
+        )])
+
+
+class KlineFile(DB):
+    """k线文件目录，读取方通过查询该表规划要读的文件，不需要遍历文件系统
+
+    同一个数据库可以保存多个datadir的目录，按datadir的绝对路径区分。
+    """
+
+    table = Table(
+        "kline_file",
+        DB.metadata,
+        Column("datadir", String(255), primary_key=True, comment="绝对路径"),
+        Column("symbol", String(16), primary_key=True),
+        Column("interval", String(8), primary_key=True),
+        Column("date", String(10), primary_key=True),
+        Column("path", String(128), nullable=False, comment="相对datadir的路径"),
+        Column("rows", Integer, nullable=False),
+        Column("min_open_time", BigInteger),
+        Column("max_open_time", BigInteger),
+        Column("size", BigInteger, nullable=False),
+        Column("mtime", BigInteger, nullable=False),
+        Column("checksum", BigInteger, nullable=False, comment="crc32"),
+        Column("update_time", DateTime, default=datetime.datetime.now),
+        Index("ix_kline_file_interval_date", "datadir", "interval", "date"),
+    )
+
+    @classmethod
+    def upsert(cls, conn: Connection, rows: List[Dict]) -> None:
+        if not rows:
+            return
+        stmt = upsert_stmt(
+            conn.dialect.name,
+            cls.table,
+            lambda excluded: [
+                (k, excluded[k])
+                for k in (
+                    "path",
+                    "rows",
+                    "min_open_time",
+                    "max_open_time",
+                    "size",
+                    "mtime",
+                    "checksum",
                 )
+            ]
+            + [("update_time", datetime.datetime.now())],
+        )
+        conn.execute(stmt, rows)
+
+    @classmethod
+    def update_file(cls, conn: Connection, datadir: str, path: str) -> None:
+        """下载器写文件后调用，更新该文件的记录"""
+        row = _stat_file((datadir, path))
+        if row is not None:
+            cls.upsert(conn, [row])
+
+    @classmethod
+    def list_intervals(cls, conn: Connection, datadir: str) -> List[str]:
+        t = cls.table
+        stmt = select(t.c.interval).where(t.c.datadir == os.path.abspath(datadir))
+        return list(conn.execute(stmt.distinct()).scalars())
+
+    @classmethod
+    def exists(cls, conn: Connection, datadir: str) -> bool:
+        """目录中是否有datadir的记录"""
+        t = cls.table
+        stmt = select(t.c.symbol).where(t.c.datadir == os.path.abspath(datadir))
+        return conn.execute(stmt.limit(1)).first() is not None
+
+    @classmethod
+    def ensure(cls, datadir: str, processes: Optional[int] = None) -> None:
+        """目录中没有datadir的记录时(例如新建的数据库)先扫描重建，避免读取方静默地读不到数据"""
+        try:
+            with db.connect() as conn:
+                if cls.exists(conn, datadir):
+                    return
+        except (OperationalError, ProgrammingError):  # 没有建表或者是旧版本的表
+            db.create_all()
+        logger.warning(f"kline file catalog of {datadir} is empty, rebuild it")
+        cls.rebuild(datadir, processes)
+
+    @classmethod
+    def list_paths(
+        cls, conn: Connection, datadir: str, suffixes: Tuple[str, ...] = (".csv",)
+    ) -> List[str]:
+        """datadir中的所有文件，按symbol、interval、date排序"""
+        t = cls.table
+        stmt = (
+            select(t.c.path)
+            .where(t.c.datadir == os.path.abspath(datadir))
+            .order_by(t.c.symbol, t.c.interval, t.c.date)
+        )
+        return [
+            os.path.join(datadir, p)
+            for p in conn.execute(stmt).scalars()
+            if p.endswith(suffixes)
+        ]
+
+    @classmethod
+    def plan(
+        cls,
+        conn: Connection,
+        datadir: str,
+        interval: str,
+        symbols: Optional[List[str]] = None,
+        date_limit: Optional[tuple] = None,
+    ) -> Dict[str, List[str]]:
+        """返回每个symbol需要读取的文件，按时间排序"""
+        t = cls.table
+        conds = [
+            t.c.datadir == os.path.abspath(datadir),
+            t.c.interval == interval,
+            t.c.rows > 0,
+        ]
+        if symbols:
+            conds.append(t.c.symbol.in_(symbols))
+        if date_limit:
+            conds.append(
+                or_(
+                    t.c.date.between(date_limit[0], date_limit[1]),
+                    # 压缩后的月度文件
+                    and_(
+                        func.length(t.c.date) == 7,
+                        t.c.date.between(date_limit[0][:7], date_limit[1][:7]),
+                    ),
+                )
+            )
+        stmt = (
+            select(t.c.symbol, t.c.path)
+            .where(and_(*conds))
+            .order_by(t.c.symbol, t.c.date)
+        )
+        plan: Dict[str, List[str]] = {}
+        for symbol, path in conn.execute(stmt):
+            plan.setdefault(symbol, []).append(os.path.join(datadir, path))
+        return plan
+
+    @classmethod
+    def rebuild(
+        cls,
+        datadir: str = "../data",
+        processes: Optional[int] = None,
+        batch_size: int = 5000,
+    ) -> int:
+        """扫描datadir重建目录，返回处理的文件数"""
+        n = 0
+        batch = []
+        with db.connect() as conn:
+            args = (
+                (datadir, p)
+                for p in scan_datadir(datadir, suffixes=(".csv", ".parquet"))
+            )
+            for row in _pool_map(_stat_file, args, processes):
+                if row is None:
+                    continue
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    cls.upsert(conn, batch)
+                    conn.commit()
+                    n += len(batch)
+                    batch = []
+                    logger.info(f"rebuild kline file catalog, {n} files processed")
+            cls.upsert(conn, batch)
             conn.commit()
+            n += len(batch)
+        logger.info(f"rebuild kline file catalog done, {n} files processed")
+        return n
+
+
+class Kline(DB):
+    """k线表，主键(symbol, interval, open_time)，可选，用于时间范围查询"""
+
+    table = Table(
+        "kline",
+        DB.metadata,
+        Column("symbol", String(16), primary_key=True),
+        Column("interval", String(8), primary_key=True),
+        Column("open_time", BigInteger, primary_key=True),
+        Column("open", Float, nullable=False),
+        Column("high", Float, nullable=False),
+        Column("low", Float, nullable=False),
+        Column("close", Float, nullable=False),
+        Column("volume", Float, nullable=False),
+        Column("close_time", BigInteger, nullable=False),
+        Column("quote_volume", Float, nullable=False),
+        Column("count", Integer, nullable=False),
+        Column("taker_buy_volume", Float, nullable=False),
+        Column("taker_buy_quote_volume", Float, nullable=False),
+        # 按时间范围查询所有symbol
+        Index("ix_kline_interval_open_time", "interval", "open_time"),
+    )
+
+    columns = [
+        "open_time",
+        "open",
+        "high",
+        "low",
+        "close",
+        "volume",
+        "close_time",
+        "quote_volume",
+        "count",
+        "taker_buy_volume",
+        "taker_buy_quote_volume",
+    ]
+    dtypes = {
+        "open_time": "int64",
+        "close_time": "int64",
+        "count": "int64",
+        **{
+            k: "float64"
+            for k in (
+                "open",
+                "high",
+                "low",
+                "close",
+                "volume",
+                "quote_volume",
+                "taker_buy_volume",
+                "taker_buy_quote_volume",
+            )
+        },
+    }
+
+    @classmethod
+    def bulk_load(
+        cls,
+        conn: Connection,
+        df: pd.DataFrame,
+        symbol: str,
+        interval: str,
+        batch_size: int = 10000,
+    ) -> int:
+        """批量写入下载的k线DataFrame，已存在的k线会被覆盖，返回写入行数"""
+        if df.empty:
+            return 0
+        stmt = upsert_stmt(
+            conn.dialect.name,
+            cls.table,
+            lambda excluded: [
+                (k, excluded[k]) for k in cls.columns if k != "open_time"
+            ],
+        )
+        df = df[cls.columns].astype(cls.dtypes)
+        df.insert(0, "interval", interval)
+        df.insert(0, "symbol", symbol)
+        rows = df.to_dict("records")
+        for i in range(0, len(rows), batch_size):
+            conn.execute(stmt, rows[i:i + batch_size])
+        return len(rows)
+
+    @classmethod
+    def ingest(
+        cls,
+        datadir: str = "../data",
+        interval: str = "1h",
+        symbols: Optional[List[str]] = None,
+        date_limit: Optional[tuple] = None,
+    ) -> int:
+        """按KlineFile目录把本地k线文件导入k线表，每个symbol提交一次"""
+        KlineFile.ensure(datadir)
+        n = 0
+        with db.connect() as conn:
+            plan = KlineFile.plan(conn, datadir, interval, symbols, date_limit)
+            for symbol, paths in plan.items():
+                df = pd.concat(
+                    pd.read_parquet(p) if p.endswith(".parquet") else pd.read_csv(p)
+                    for p in paths
+                ).drop_duplicates(subset=["open_time"])
+                n += cls.bulk_load(conn, df, symbol, interval)
+                conn.commit()
+                logger.info(f"ingest {symbol} {interval} done, {n} rows total")
+        return n
+
+    @classmethod
+    def query_range(
+        cls,
+        conn: Connection,
+        interval: str,
+        start_time: Union[int, datetime.datetime],
+        end_time: Union[int, datetime.datetime],
+        symbols: Optional[List[str]] = None,
+    ) -> pd.DataFrame:
+        """查询open_time在[start_time, end_time)内的k线，按symbol、open_time排序"""
+        t = cls.table
+        conds = [
+            t.c.interval == interval,
+            t.c.open_time >= datetime2timestamp(start_time),
+            t.c.open_time < datetime2timestamp(end_time),
+        ]
+        if symbols:
+            conds.append(t.c.symbol.in_(symbols))
+        stmt = (
+            select(t.c.symbol, *[t.c[k] for k in cls.columns])
+            .where(and_(*conds))
+            .order_by(t.c.symbol, t.c.open_time)
+        )
+        result = conn.execute(stmt)
+        df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        return df.astype(cls.dtypes)
+
+
+def _map_chunk(func: Callable, chunk: List) -> List:
+    return [func(i) for i in chunk]
+
+
+def _pool_map(
+    func: Callable,
+    items: Iterable,
+    processes: Optional[int] = None,
+    chunksize: int = 256,
+) -> Iterator:
+    """按顺序返回func(item)，与pool.map相同，但最多同时提交2 * processes个chunk，
+    items(例如遍历百万个文件的生成器)按需消费，不会一次全部读入内存"""
+    processes = processes or os.cpu_count() or 1
+    it = iter(items)
+    pending: Deque = deque()
+    with ProcessPoolExecutor(processes) as pool:
+        while True:
+            while len(pending) < 2 * processes:
+                chunk = list(itertools.islice(it, chunksize))
+                if not chunk:
+                    break
+                pending.append(pool.submit(_map_chunk, func, chunk))
+            if not pending:
+                break
+            yield from pending.popleft().result()
+
+
+def _stat_file(args: tuple) -> Optional[Dict]:
+    datadir, path = args
+    try:
+        symbol, interval, date = extract_symbol_from_file(path)
+        stats = get_file_stats(path)
+    except Exception as e:
+        logger.warning(f"stat {path} failed: {e}")
+        return None
+    if stats is None:  # 正在写入
+        return None
+    return dict(
+        datadir=os.path.abspath(datadir),
+        symbol=symbol,
+        interval=interval,
+        date=date,
+        path=os.path.relpath(path, datadir),
+        **stats,
+    )
+
+
+def monthly_download_log_rows(
+    symbol: str, interval: str, month: str, open_times: np.ndarray
+) -> List[Dict]:
+    """月度文件对应的按天下载记录
+
+    下载记录按天保存，月度文件中min/max open_time之间属于该月的每一天一条成功记录，
+    last_timestamp与按天的文件一致(包含次日0点的k线)
+    """
+    if not len(open_times):
+        return []
+    open_times = np.sort(open_times)
+    day = datetime.date.fromtimestamp(open_times[0] / 1000)
+    last = datetime.date.fromtimestamp(open_times[-1] / 1000)
+    rows = []
+    while day <= last:
+        next_day = day + datetime.timedelta(days=1)
+        date = day.isoformat()
+        if date[:7] == month:
+            end = datetime2timestamp(datetime.datetime.combine(next_day, datetime.time()))
+            i = int(np.searchsorted(open_times, end, "right"))
+            rows.append(dict(
+                symbol=symbol,
+                interval=interval,
+                date=date,
+                status=DLogStatus.success.value,
+                last_timestamp=int(open_times[i - 1]),
+            ))
+        day = next_day
+    return rows
+
+
+def _read_open_times(path: str) -> np.ndarray:
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=["open_time"])["open_time"].to_numpy()
+    return pd.read_csv(path, usecols=["open_time"])["open_time"].to_numpy()
+
+
+def _scan_file(path: str) -> List[Dict]:
+    try:
+        symbol, interval, date = extract_symbol_from_file(path)
+        if is_monthly_partition(date):
+            return monthly_download_log_rows(
+                symbol, interval, date, _read_open_times(path)
+            )
+        timestamp = get_file_last_timestamp(path)
+    except Exception as e:
+        logger.warning(f"scan {path} failed: {e}")
+        return []
+    if timestamp is None:  # 空文件或正在写入
+        return []
+    return [dict(
+        symbol=symbol,
+        interval=interval,
+        date=date,
+        status=DLogStatus.success.value,
+        last_timestamp=timestamp,
+    )]
 
 
 if __name__ == "__main__":
     db.create_all(drop=True)
     DownloadLog.init_from_csvs()
+    KlineFile.rebuild()
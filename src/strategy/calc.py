@@ -1,7 +1,7 @@
 from decimal import Decimal
 from typing import Union, List
 
-from src.strategy.kline import KlineItem, Klines
+from src.strategy.kline import KlineItem, Klines, TickerItem
 
 
 t_num = Union[str, float, Decimal]
@@ -19,3 +19,8 @@ def calc_kl_last_incr(klines: Klines) -> Union[None, Decimal]:
 def calc_kl_incr(klines: Klines) -> List[Decimal]:
     incr = list(map(calc_incr, klines))
     return incr
+
+
+def calc_ticker_range(ticker: TickerItem) -> Decimal:
+    """窗口内最高价相对最低价的涨幅，窗口内任意k线的涨跌幅都不会超过它"""
+    return (Decimal(ticker.high) - Decimal(ticker.low)) / Decimal(ticker.low)
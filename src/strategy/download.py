@@ -1,9 +1,12 @@
-from typing import List
+from typing import List, Dict
 
-from src.client import make_spot_clint
-from src.utils import binance_timestamp2dt
+from src.client import DEFAULT_BASE_URL, make_spot_clint
+from src.metrics import timer
 
-from src.strategy.kline import KlineItem
+from src.strategy.kline import KlineItem, TickerItem
+
+# 滚动窗口行情接口单次请求的最大symbol数量
+MAX_TICKER_SYMBOLS = 100
 
 
 class SpotDownloader:
@@ -12,26 +15,52 @@ class SpotDownloader:
     ) -> List[KlineItem]:
         raise NotImplementedError
 
+    def download_tickers(
+        self, symbols: List[str], window_size: str
+    ) -> List[TickerItem]:
+        raise NotImplementedError
+
 
 class BinanceSpotDownloader(SpotDownloader):
-    def __init__(self):
-        self.client = make_spot_clint()
+    def __init__(self, base_url: str = DEFAULT_BASE_URL):
+        self.client = make_spot_clint(base_url)
 
     def download_klines(
         self, symbol: str, interval: str, limit: int
     ) -> List[KlineItem]:
-        data: List[List] = self.client.klines(symbol, interval=interval, limit=limit)
-        klines = []
-        for i in data:
-            klines.append(
-                KlineItem(
-                    symbol=symbol,
-                    interval=interval,
-                    open=i[1],
-                    high=i[2],
-                    low=i[3],
-                    close=i[4],
-                    dt=binance_timestamp2dt(i[0]),
-                )
+        with timer("rest"):
+            data: List[List] = self.client.klines(
+                symbol, interval=interval, limit=limit
             )
+        with timer("parse"):
+            klines = [
+                KlineItem(symbol, interval, i[1], i[2], i[3], i[4], i[0])
+                for i in data
+            ]
         return klines
+
+    def download_tickers(
+        self, symbols: List[str], window_size: str
+    ) -> List[TickerItem]:
+        """批量下载多个symbol的滚动窗口行情"""
+        tickers = []
+        for i in range(0, len(symbols), MAX_TICKER_SYMBOLS):
+            with timer("rest"):
+                data: List[Dict] = self.client.rolling_window_ticker(
+                    symbols=symbols[i:i + MAX_TICKER_SYMBOLS],
+                    windowSize=window_size,
+                )
+            for j in data:
+                tickers.append(
+                    TickerItem(
+                        symbol=j["symbol"],
+                        window_size=window_size,
+                        open=j["openPrice"],
+                        high=j["highPrice"],
+                        low=j["lowPrice"],
+                        close=j["lastPrice"],
+                        open_time=j["openTime"],
+                        close_time=j["closeTime"],
+                    )
+                )
+        return tickers
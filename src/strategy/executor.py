@@ -1,67 +1,111 @@
+import os
 import time
 import datetime
-from decimal import Decimal
-from dataclasses import dataclass
 from functools import cached_property
-from typing import List, Callable, Any, Literal
+from typing import List, Callable, Any, Optional, Dict
 
 from loguru import logger
 
 from src.exchange import Exchange
-from src.strategy.kline import Klines, KlinesManager
-from src.strategy.download import BinanceSpotDownloader
-from src.utils import get_next_runtime
+from src.interval import bars_between, ticker_window
+from src.metrics import (
+    registry,
+    timer,
+    Sampler,
+    SYMBOL_SECONDS,
+    SIGNAL_LATENCY,
+    ROUND_SECONDS,
+    STRATEGY_ERRORS,
+)
+from src.strategy.kline import Klines, KlinesManager, TickerItem
+from src.strategy.rank import RankIndex
+from src.strategy.download import SpotDownloader, BinanceSpotDownloader
+from src.strategy.order import (  # noqa: F401
+    OrderParams,
+    OrderProxy,
+    BinanceOrderParams,
+    BinanceOrderProxy,
+)
+from src.utils import get_next_runtime, datetime2timestamp
+
+# 单次klines请求的最大limit
+MAX_KLINES_LIMIT = 1000
 
 
 class StrategyPipeline:
     def __init__(self, strategies: List[Callable[[Any], bool]]):
         self.strategies = strategies
+        # 策略的指标状态，随快照持久化
+        self.state: Dict[str, Any] = {}
 
     def __call__(self, data: Any) -> bool:
         return any(f(data) for f in self.strategies)
 
 
-class OrderParams:
-    pass
-
-
-class OrderProxy:
-    def make_new_order(self, params: OrderParams):
-        raise NotImplementedError
-
-    def cancel_order(self, order_id: int):
-        raise NotImplementedError
-
-
-@dataclass
-class BinanceOrderParams(OrderParams):
-    symbol: str
-    side: Literal["SELL", "BUY"]
-    type: Literal["MARKET"]
-    quantity: Decimal
-    price: Decimal
-    timestamp: int
-
-
-class BinanceOrderProxy(OrderProxy):
-    def make_new_order(self, params: BinanceOrderParams):
-        pass
-
-    def cancel_order(self, order_id: int):
-        pass
-
-
 class Executor:
     def __init__(
-        self, strategy: StrategyPipeline, interval: str, init_limit: int = 5
+        self,
+        strategy: StrategyPipeline,
+        interval: str,
+        init_limit: int = 5,
+        snapshot_path: Optional[str] = None,
+        seed_datadir: Optional[str] = None,
+        prescreen: Optional[Callable[[TickerItem], bool]] = None,
+        metrics_path: Optional[str] = None,
+        metrics_port: Optional[int] = None,
+        on_signal: Optional[Callable[[str, Klines], None]] = None,
+        downloader: Optional[SpotDownloader] = None,
+        symbols: Optional[List[str]] = None,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+        ranks: Optional[Dict[str, RankIndex]] = None,
     ):
+        """
+        snapshot_path: 快照文件，启动时加载，之后每轮保存，重启时只下载快照之后缺失的k线
+        seed_datadir: 本地历史k线目录，快照中没有的symbol从这里初始化
+        prescreen: 粗筛，先批量获取所有symbol的滚动窗口行情，只下载通过粗筛的symbol的k线。
+            滚动窗口按分钟计算，不与k线对齐，窗口取两个interval，在最后一根k线收盘后
+            一个interval内执行时覆盖这根k线；粗筛条件必须是策略的必要条件，
+            并且窗口变大时仍然成立(例如窗口内最高价相对最低价的涨幅)
+        metrics_path: 每轮结束后把指标导出为prometheus文本文件
+        metrics_port: 在该端口启动http服务导出指标
+        on_signal: symbol通过策略时调用，例如下单
+        downloader: 默认BinanceSpotDownloader，回放时传入回放数据源
+        symbols: 默认交易所所有USDT交易对
+        clock: 当前时间，回放时传入虚拟时钟
+        ranks: 截面排名(interval -> RankIndex)，由KlinesManager维护，策略通过它查询
+            最后一根已收盘k线涨幅的名次和分位数，以及最近几根k线的分位数(RankIndex.history)；
+            传入时每轮先下载所有symbol再计算策略，排名包含本轮所有symbol。
+            排名包含所有symbol时才有意义，不要和prescreen一起使用
+        """
         logger.info("strategy executor started")
 
         self.strategy = strategy
         self.interval = interval
+        self.init_limit = init_limit
+        self.snapshot_path = snapshot_path
+        self.prescreen = prescreen
+        # interval不支持对应的窗口时在这里报错
+        self.ticker_window = ticker_window(interval) if prescreen else None
+        self.metrics_path = metrics_path
+        self.on_signal = on_signal
+        self.profile_path: Optional[str] = None
+        self.clock = clock
+        self.ranks = ranks
+        # symbol -> 上次计算策略时最后一根k线的open_time
+        self._evaluated: Dict[str, int] = {}
+        if symbols is not None:
+            self.symbols = symbols
+        if metrics_port:
+            registry.serve(metrics_port)
 
-        self.klines_manager = KlinesManager(BinanceSpotDownloader())
-        self.exec_strategy(init_limit)
+        self.klines_manager = KlinesManager(
+            downloader or BinanceSpotDownloader(),
+            ranks=ranks,
+            clock=clock,
+            rank=ranks is not None,
+        )
+        warm = self.warm_start(init_limit, seed_datadir)
+        self.exec_strategy(init_limit, fill_gap=warm)
 
     @cached_property
     def symbols(self) -> List[str]:
@@ -70,23 +114,183 @@ class Executor:
         logger.info(f"got {len(symbols)} symbols: {str(symbols)[:100]}...")
         return symbols
 
-    def exec_strategy(self, limit: int) -> None:
-        for s in self.symbols:
+    def warm_start(self, limit: int, seed_datadir: Optional[str] = None) -> bool:
+        """从快照和本地历史数据恢复k线，返回是否恢复了数据"""
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
             try:
-                self.klines_manager.download_klines(
-                    s, interval=self.interval, limit=limit
+                state = self.klines_manager.load(self.snapshot_path)
+            except Exception as e:
+                logger.warning(f"load snapshot {self.snapshot_path} failed: {e}")
+            else:
+                self.strategy.state.update(state.get("strategy", {}))
+                logger.info(
+                    f"load snapshot {self.snapshot_path} done, "
+                    f"saved at {state.get('saved_at')}"
                 )
+
+        if seed_datadir:
+            for s in self.symbols:
+                if self.klines_manager.get(f"{s}{self.interval}"):
+                    continue
+                try:
+                    self.klines_manager.seed_from_datadir(
+                        seed_datadir, s, interval=self.interval, limit=limit
+                    )
+                except Exception as e:
+                    logger.warning(f"seed {s} from {seed_datadir} failed: {e}")
+
+        return bool(self.klines_manager.klines_dict)
+
+    def save_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+        state = {
+            "saved_at": self.clock(),
+            "strategy": self.strategy.state,
+        }
+        try:
+            self.klines_manager.dump(self.snapshot_path, state=state)
+        except Exception as e:
+            logger.warning(f"save snapshot {self.snapshot_path} failed: {e}")
+
+    def get_gap_limit(self, symbol: str, limit: int) -> int:
+        """计算补齐本地最后一根k线之后的缺口需要下载的k线数量"""
+        klines = self.klines_manager.get(f"{symbol}{self.interval}")
+        if not klines:  # 启动时被粗筛过滤或下载失败的symbol，下载初始的历史k线
+            return max(limit, self.init_limit)
+        now = datetime2timestamp(self.clock())
+        # 多下载一根，用于更新本地最后一根可能未收盘的k线
+        n = bars_between(klines[-1].open_time, now, self.interval) + 1
+        if n > MAX_KLINES_LIMIT:  # 缺口太大，丢弃本地数据重新下载
+            self.klines_manager.remove(klines.name)
+            return max(limit, self.init_limit)
+        return max(n, 1)
+
+    def prescreen_symbols(self, symbols: List[str]) -> List[str]:
+        """批量获取滚动窗口行情，返回通过粗筛的symbol"""
+        try:
+            tickers = self.klines_manager.downloader.download_tickers(
+                symbols, window_size=self.ticker_window
+            )
+        except Exception as e:
+            logger.warning(f"download tickers failed, skip prescreen: {e}")
+            return symbols
+
+        passed = set()
+        for t in tickers:
+            try:
+                if self.prescreen(t):
+                    passed.add(t.symbol)
             except Exception as e:
-                logger.info(f"download {s} failed: {e}")
-                continue
+                logger.warning(f"prescreen {t.symbol} failed: {e}")
+                passed.add(t.symbol)
+
+        candidates = [s for s in symbols if s in passed]
+        logger.info(
+            f"prescreen done, {len(candidates)}/{len(symbols)} symbols passed"
+        )
+        return candidates
+
+    def profile_next_round(self, path: str) -> None:
+        """对下一轮进行采样分析，结果以collapsed stack格式写入path"""
+        self.profile_path = path
+
+    def exec_strategy(self, limit: int, fill_gap: bool = False) -> None:
+        start = time.perf_counter()
+        if self.profile_path:
+            path, self.profile_path = self.profile_path, None
+            with Sampler() as sampler:
+                self._exec_strategy(limit, fill_gap)
+            sampler.dump(path)
+            logger.info(f"profile done, save to {path}")
+        else:
+            self._exec_strategy(limit, fill_gap)
+        ROUND_SECONDS.observe(time.perf_counter() - start)
+
+        self.save_snapshot()
+        if self.metrics_path:
+            try:
+                registry.write_textfile(self.metrics_path)
+            except Exception as e:
+                logger.warning(f"write metrics {self.metrics_path} failed: {e}")
+
+    def _download(self, symbol: str, limit: int, fill_gap: bool) -> Optional[Klines]:
+        # 本地没有k线时也按get_gap_limit下载初始的历史k线
+        if fill_gap or not self.klines_manager.get(f"{symbol}{self.interval}"):
+            limit = self.get_gap_limit(symbol, limit)
+        try:
+            self.klines_manager.download_klines(
+                symbol, interval=self.interval, limit=limit
+            )
+        except Exception as e:
+            logger.info(f"download {symbol} failed: {e}")
+            return None
+
+        klines = self.klines_manager.get(f"{symbol}{self.interval}")
+        if not klines:
+            return None
+        logger.info(f"download {symbol} done, got {len(klines)} klines")
+        return klines
+
+    def _is_new(self, symbol: str, klines: Klines) -> bool:
+        """最后一根k线与上次计算策略时相同(没有新k线)时返回False，避免重复产生信号"""
+        last = klines[-1].open_time
+        if self._evaluated.get(symbol) == last:
+            return False
+        self._evaluated[symbol] = last
+        return True
+
+    def _evaluate(self, symbol: str, klines: Klines) -> None:
+        try:
+            with timer("strategy"):
+                passed = self.strategy(klines)
+        except Exception as e:  # 单个symbol的异常不影响本轮其他symbol
+            STRATEGY_ERRORS.inc(symbol=symbol)
+            logger.warning(f"exec strategy {symbol} failed: {e!r}")
+            return
+        if passed:
+            self._handle_signal(symbol, klines)
+
+    def _handle_signal(self, symbol: str, klines: Klines) -> None:
+        # 最后一根k线的开盘时间即上一根k线的收盘时间
+        latency = datetime2timestamp(self.clock()) - klines[-1].open_time
+        SIGNAL_LATENCY.observe(latency / 1000)
+        logger.info(f"{symbol} pass strategy, klines: {klines[-5:]}")
+        if self.on_signal:
+            try:
+                self.on_signal(symbol, klines)
+            except Exception as e:
+                logger.warning(f"handle {symbol} signal failed: {e}")
+
+    def _exec_strategy(self, limit: int, fill_gap: bool) -> None:
+        symbols = self.symbols
+        if self.prescreen:
+            symbols = self.prescreen_symbols(symbols)
+            # 上一轮被粗筛过滤的symbol的k线不连续，需要补齐缺口
+            fill_gap = True
 
-            klines = self.klines_manager.get(f"{s}{self.interval}")
-            logger.info(f"download {s} done, got {len(klines)} klines")
+        if self.ranks is not None:
+            # 截面排名需要本轮所有symbol的k线都更新后再计算策略
+            ready = []
+            for s in symbols:
+                start = time.perf_counter()
+                klines = self._download(s, limit, fill_gap)
+                if klines and self._is_new(s, klines):
+                    ready.append((s, klines, time.perf_counter() - start))
+            self.klines_manager.snapshot_ranks()
+            for s, klines, elapsed in ready:
+                start = time.perf_counter()
+                self._evaluate(s, klines)
+                SYMBOL_SECONDS.observe(elapsed + time.perf_counter() - start, symbol=s)
+            return
 
-            if not klines:
+        for s in symbols:
+            start = time.perf_counter()
+            klines = self._download(s, limit, fill_gap)
+            if not klines or not self._is_new(s, klines):
                 continue
-            if self.strategy(klines):
-                logger.info(f"{s} pass strategy, klines: {klines[-5:]}")
+            self._evaluate(s, klines)
+            SYMBOL_SECONDS.observe(time.perf_counter() - start, symbol=s)
 
     def get_next_runtime(self) -> datetime.datetime:
         return get_next_runtime(self.interval)
@@ -96,7 +300,7 @@ class Executor:
 
         next_runtime = self.get_next_runtime()
         while 1:
-            if datetime.datetime.now() < next_runtime:
+            if self.clock() < next_runtime:
                 time.sleep(seconds)
                 continue
 
@@ -106,7 +310,9 @@ class Executor:
 
 
 def run_executor(
-    strategy: StrategyPipeline, interval: str, init_limit: int = 5
+    strategy: StrategyPipeline, interval: str, init_limit: int = 5, **kwargs: Any
 ) -> None:
-    executor = Executor(strategy, interval=interval, init_limit=init_limit)
+    executor = Executor(
+        strategy, interval=interval, init_limit=init_limit, **kwargs
+    )
     executor.run_forever()
@@ -0,0 +1,226 @@
+"""本地模拟撮合，用于离线测量信号到下单确认(ack)的延迟，也可以提供k线用于离线压测执行器"""
+
+import json
+import time
+import socket
+import threading
+from decimal import Decimal
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple, Optional, Callable, List
+
+from src.strategy.order import Signer
+
+
+class FakeMatchingEngine:
+    """市价单按prices中的价格立即成交，限价单价格可成交时立即成交，否则挂单"""
+
+    def __init__(
+        self,
+        api_secret: Optional[str] = None,
+        prices: Optional[Dict[str, str]] = None,
+        on_event: Optional[Callable[[Dict], None]] = None,
+        klines: Optional[Dict[str, List[List]]] = None,
+    ):
+        """klines: symbol -> /api/v3/klines格式的k线，按时间排序"""
+        self.signer = Signer(api_secret) if api_secret else None
+        self.prices = prices or {}
+        self.klines = klines or {}
+        self.on_event = on_event
+        self.orders: Dict[int, Dict] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def verify(self, query: str) -> bool:
+        if self.signer is None:
+            return True
+        payload, _, signature = query.rpartition("&signature=")
+        return self.signer.sign(payload) == signature
+
+    def _emit(self, order: Dict) -> None:
+        if self.on_event is None:
+            return
+        self.on_event({
+            "e": "executionReport",
+            "E": int(time.time() * 1000),
+            "s": order["symbol"],
+            "c": order["clientOrderId"],
+            "S": order["side"],
+            "o": order["type"],
+            "q": order["origQty"],
+            "X": order["status"],
+            "z": order["executedQty"],
+            "i": order["orderId"],
+        })
+
+    def new_order(self, params: Dict[str, str]) -> Tuple[int, Dict]:
+        for k in ("symbol", "side", "type", "quantity", "timestamp"):
+            if k not in params:
+                return 400, {"code": -1102, "msg": f"Mandatory parameter '{k}'"}
+
+        last = Decimal(self.prices.get(params["symbol"], "1"))
+        price = Decimal(params.get("price", last))
+        if params["type"] == "MARKET":
+            filled = True
+        elif params["side"] == "BUY":
+            filled = price >= last
+        else:
+            filled = price <= last
+
+        with self._lock:
+            order_id = self._next_id
+            self._next_id += 1
+            order = self.orders[order_id] = {
+                "symbol": params["symbol"],
+                "orderId": order_id,
+                "orderListId": -1,
+                "clientOrderId": params.get("newClientOrderId", f"fake{order_id}"),
+                "transactTime": int(time.time() * 1000),
+                "price": str(price),
+                "origQty": params["quantity"],
+                "executedQty": "0",
+                "status": "NEW",
+                "type": params["type"],
+                "side": params["side"],
+            }
+        self._emit(order)
+        if filled:
+            order["executedQty"] = order["origQty"]
+            order["status"] = "FILLED"
+            self._emit(order)
+
+        if params.get("newOrderRespType", "ACK") == "ACK":
+            keys = ("symbol", "orderId", "orderListId", "clientOrderId", "transactTime")
+            return 200, {k: order[k] for k in keys}
+        return 200, dict(order)
+
+    def cancel_order(self, params: Dict[str, str]) -> Tuple[int, Dict]:
+        order = self.orders.get(int(params.get("orderId", 0)))
+        if order is None or order["symbol"] != params.get("symbol"):
+            return 400, {"code": -2011, "msg": "Unknown order sent."}
+        if order["status"] != "NEW":
+            return 400, {"code": -2011, "msg": "Order already closed."}
+        order["status"] = "CANCELED"
+        self._emit(order)
+        return 200, dict(order)
+
+    def get_klines(self, params: Dict[str, str]) -> Tuple[int, Any]:
+        """返回最近的limit根k线，忽略interval和时间范围"""
+        rows = self.klines.get(params.get("symbol"))
+        if rows is None:
+            return 400, {"code": -1121, "msg": "Invalid symbol."}
+        return 200, rows[-int(params.get("limit", 500)):]
+
+
+class FakeExchangeServer:
+    def __init__(self, engine: FakeMatchingEngine, host: str = "127.0.0.1", port: int = 0):
+        self.engine = engine
+        engine_ = engine
+        # (method, path) -> (handler, 是否需要签名)
+        routes = {
+            ("POST", "/api/v3/order"): (engine.new_order, True),
+            ("DELETE", "/api/v3/order"): (engine.cancel_order, True),
+            ("GET", "/api/v3/klines"): (engine.get_klines, False),
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def _handle(self):
+                parts = urlsplit(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                func, signed = routes.get((self.command, parts.path), (None, False))
+                if func is None:
+                    status, data = 404, {"code": -1, "msg": "Not found"}
+                elif signed and not engine_.verify(parts.query):
+                    status, data = 400, {"code": -1022, "msg": "Invalid signature."}
+                else:
+                    status, data = func(dict(parse_qsl(parts.query)))
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def do_DELETE(self):
+                self._handle()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeExchangeServer":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def measure_latency(n: int = 1000, symbol: str = "BTCUSDT") -> Dict[str, float]:
+    """测量从构造订单参数到收到ack的延迟(毫秒)"""
+    from src.exchange import Exchange
+    from src.strategy.order import BinanceOrderParams, BinanceOrderProxy
+
+    exchange = Exchange({
+        "symbols": [{
+            "symbol": symbol,
+            "status": "TRADING",
+            "baseAsset": symbol[:-4],
+            "quoteAsset": symbol[-4:],
+            "filters": [
+                {"filterType": "PRICE_FILTER", "tickSize": "0.01"},
+                {"filterType": "LOT_SIZE", "minQty": "0.00001", "stepSize": "0.00001"},
+            ],
+        }]
+    })
+    proxy = BinanceOrderProxy("fake-key", "fake-secret")
+    engine = FakeMatchingEngine("fake-secret", on_event=proxy.tracker.on_event)
+    server = FakeExchangeServer(engine).start()
+    proxy.base_url = server.base_url
+
+    latencies: List[float] = []
+    try:
+        for _ in range(n):
+            start = time.perf_counter()
+            params = BinanceOrderParams.create(exchange, symbol, "BUY", "0.001234567")
+            proxy.make_new_order(params)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        proxy.close()
+        server.stop()
+
+    latencies.sort()
+    return {
+        "n": n,
+        "p50": latencies[n // 2],
+        "p90": latencies[int(n * 0.9)],
+        "p99": latencies[int(n * 0.99)],
+        "max": latencies[-1],
+    }
+
+
+if __name__ == "__main__":
+    print(measure_latency())
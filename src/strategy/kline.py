@@ -1,13 +1,26 @@
+import os
+import csv
+import pickle
 import datetime
 from dataclasses import dataclass
-from typing import Dict, Iterable, List, Union, Optional
+from typing import Callable, Dict, Iterable, List, Union, Optional
 
 import pandas as pd
 
-from src.utils import interval2timedelta, remove_trailing_0s
+from src.interval import INTERVAL_MS, next_open
+from src.metrics import timer
+from src.strategy.rank import RankIndex
+from src.utils import (
+    remove_trailing_0s,
+    binance_timestamp2dt,
+    datetime2timestamp,
+)
 
+# 2: 保存open_time(毫秒时间戳)而不是dt
+SNAPSHOT_VERSION = 2
 
-@dataclass
+
+@dataclass(slots=True)
 class KlineItem:
     symbol: str
     interval: str
@@ -15,18 +28,25 @@ class KlineItem:
     high: str
     low: str
     close: str
-    dt: datetime.datetime
+    # 开盘时间，UTC毫秒时间戳
+    open_time: int
 
     @property
     def name(self) -> str:
         return self.symbol + self.interval
 
+    @property
+    def dt(self) -> datetime.datetime:
+        """开盘时间(本地时间)，用到时才创建"""
+        return binance_timestamp2dt(self.open_time)
+
     def is_valid_next_item(self, kline: "KlineItem") -> bool:
-        return (
-            kline.symbol == self.symbol
-            and kline.interval == self.interval
-            and kline.dt - self.dt == interval2timedelta(self.interval)
-        )
+        if kline.symbol != self.symbol or kline.interval != self.interval:
+            return False
+        step = INTERVAL_MS.get(self.interval)
+        if step is None:  # 1M
+            return kline.open_time == next_open(self.open_time, self.interval)
+        return kline.open_time - self.open_time == step
 
     def __repr__(self) -> str:
         s_args = ",".join((
@@ -41,6 +61,20 @@ class KlineItem:
         return f"{self.__class__.__name__}({s_args})"
 
 
+@dataclass
+class TickerItem:
+    """滚动窗口行情(rolling window ticker)"""
+
+    symbol: str
+    window_size: str
+    open: str
+    high: str
+    low: str
+    close: str
+    open_time: int
+    close_time: int
+
+
 class Klines(list):
     def __init__(self, klines: Optional[Iterable[KlineItem]] = None):
         super().__init__(list(klines or []))
@@ -63,19 +97,69 @@ class Klines(list):
         super().append(kline)
 
     def extend(self, klines: Iterable[KlineItem]) -> None:
-        for i in sorted(klines, key=lambda x: x.dt):
+        for i in sorted(klines, key=lambda x: x.open_time):
+            self.append(i)
+
+    def merge(self, klines: Iterable[KlineItem]) -> None:
+        """合并k线：跳过已有的k线，时间相同的最后一根用新数据覆盖(未收盘的k线会变化)"""
+        for i in sorted(klines, key=lambda x: x.open_time):
+            if self and i.open_time <= self[-1].open_time:
+                if i.open_time == self[-1].open_time:
+                    self[-1] = i
+                continue
             self.append(i)
 
     def to_df(self) -> pd.DataFrame:
-        df = pd.DataFrame(self).astype({"close": "float", "open": "float"})
+        df = pd.DataFrame(
+            [
+                (i.symbol, i.interval, i.open, i.high, i.low, i.close, i.open_time)
+                for i in self
+            ],
+            columns=["symbol", "interval", "open", "high", "low", "close", "open_time"],
+        ).astype({"close": "float", "open": "float"})
+        df["dt"] = pd.to_datetime(df["open_time"], unit="ms", utc=True)
         df["incr"] = (df["close"] - df["open"]) / df["open"]
         return df
 
 
 class KlinesManager:
-    def __init__(self, downloader: "SpotDownloader"):
+    def __init__(
+        self,
+        downloader: "SpotDownloader",
+        ranks: Optional[Dict[str, RankIndex]] = None,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+        rank: bool = True,
+    ):
+        """ranks: interval -> 各symbol最后一根已收盘k线涨幅的截面排名，k线更新时维护
+        clock: 当前时间，用于判断最后一根k线是否已收盘
+        rank: 为False时不维护排名，没有策略查询排名时省去每次add的排名更新
+        """
         self.downloader = downloader
+        self.clock = clock
+        self.rank = rank
         self.klines_dict: Dict[str, Klines] = {}
+        self.ranks = ranks if ranks is not None else {}
+
+    def rank_index(self, interval: str) -> RankIndex:
+        return self.ranks.setdefault(interval, RankIndex())
+
+    def _update_rank(self, klines: Klines) -> None:
+        """实盘下载的最后一根k线还没收盘，用最后一根已收盘的k线，排名在一根k线内不变"""
+        if not self.rank:
+            return
+        now = datetime2timestamp(self.clock())
+        index = self.rank_index(klines.interval)
+        for item in reversed(klines[-2:]):
+            if next_open(item.open_time, item.interval) <= now:
+                incr = (float(item.close) - float(item.open)) / float(item.open)
+                index.update(klines.symbol, incr, item.open_time)
+                return
+        index.remove(klines.symbol)
+
+    def snapshot_ranks(self) -> None:
+        """所有symbol更新后记录各symbol这根k线的分位数，见RankIndex.snapshot"""
+        for index in self.ranks.values():
+            index.snapshot()
 
     def get(self, name: str) -> Union[None, Klines]:
         return self.klines_dict.get(name)
@@ -87,13 +171,92 @@ class KlinesManager:
         if not data:
             return
 
-        klines = self.klines_dict.setdefault(data[0].name, Klines())
-        klines.extend(data)
+        with timer("klines_add"):
+            klines = self.klines_dict.setdefault(data[0].name, Klines())
+            klines.merge(data)
+            self._update_rank(klines)
+
+    def remove(self, name: str) -> None:
+        klines = self.klines_dict.pop(name, None)
+        if klines and self.rank:
+            self.rank_index(klines.interval).remove(klines.symbol)
 
     def download_klines(self, symbol: str, interval: str, limit: int) -> None:
         data = self.downloader.download_klines(symbol, interval=interval, limit=limit)
         self.add(data)
 
+    def dump(self, path: str, state: Optional[Dict] = None) -> None:
+        """保存快照，先写临时文件再替换，避免读到写了一半的快照"""
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "klines": {
+                name: [
+                    (i.symbol, i.interval, i.open, i.high, i.low, i.close, i.open_time)
+                    for i in klines
+                ]
+                for name, klines in self.klines_dict.items()
+            },
+            "state": state or {},
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> Dict:
+        """加载快照，返回保存时附带的state"""
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        version = data.get("version")
+        if version not in (1, SNAPSHOT_VERSION):
+            raise ValueError(f"Invalid snapshot version: {version}")
+        for name, rows in data["klines"].items():
+            if version == 1:  # 最后一列是dt
+                rows = [(*i[:-1], datetime2timestamp(i[-1])) for i in rows]
+            klines = self.klines_dict[name] = Klines(KlineItem(*i) for i in rows)
+            if klines:
+                self._update_rank(klines)
+        return data["state"]
+
+    def seed_from_datadir(
+        self, datadir: str, symbol: str, interval: str, limit: int
+    ) -> None:
+        """用本地历史k线csv(最近的limit根)初始化，通过KlineFile目录查询要读的文件"""
+        from src.sql import db, KlineFile
+
+        KlineFile.ensure(datadir)
+        with db.connect() as conn:
+            paths = KlineFile.plan(conn, datadir, interval, [symbol]).get(symbol, [])
+
+        rows: Dict[int, List[str]] = {}
+        for path in reversed(paths):
+            if not path.endswith(".csv"):
+                continue
+            try:
+                with open(path, newline="") as fp:
+                    reader = csv.reader(fp)
+                    next(reader, None)
+                    for r in reader:
+                        rows.setdefault(int(r[0]), r)
+            except FileNotFoundError:  # 已被压缩任务删除，数据在月度文件中
+                continue
+            if len(rows) >= limit:
+                break
+
+        self.add([
+            KlineItem(
+                symbol=symbol,
+                interval=interval,
+                open=rows[ts][1],
+                high=rows[ts][2],
+                low=rows[ts][3],
+                close=rows[ts][4],
+                open_time=ts,
+            )
+            for ts in sorted(rows)[-limit:]
+        ])
+
 
 def get_klines_df(symbol: str, interval: str, limit: int) -> pd.DataFrame:
     from src.strategy.download import BinanceSpotDownloader
@@ -0,0 +1,344 @@
+import hmac
+import json
+import time
+import hashlib
+import threading
+from decimal import Decimal
+from dataclasses import dataclass, field
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Literal, Optional, Tuple, Union, Any
+
+from loguru import logger
+
+from src.client import DEFAULT_BASE_URL, config, get_session, make_spot_clint
+from src.exchange import Exchange
+from src.metrics import timer
+from src.strategy.kline import Klines
+
+
+class OrderError(Exception):
+    def __init__(self, status_code: int, data: Any):
+        super().__init__(f"{status_code}: {data}")
+        self.status_code = status_code
+        self.data = data
+
+
+class OrderParams:
+    pass
+
+
+class OrderProxy:
+    def make_new_order(self, params: OrderParams):
+        raise NotImplementedError
+
+    def cancel_order(self, order_id: int):
+        raise NotImplementedError
+
+
+@dataclass
+class BinanceOrderParams(OrderParams):
+    symbol: str
+    side: Literal["SELL", "BUY"]
+    type: Literal["MARKET", "LIMIT"]
+    quantity: Decimal
+    price: Optional[Decimal] = None
+    timestamp: int = 0
+    time_in_force: Optional[Literal["GTC", "IOC", "FOK"]] = None
+    client_order_id: Optional[str] = None
+
+    @classmethod
+    def create(
+        cls,
+        exchange: Exchange,
+        symbol: str,
+        side: Literal["SELL", "BUY"],
+        quantity: Union[str, float, Decimal],
+        price: Union[None, str, float, Decimal] = None,
+        type: Literal["MARKET", "LIMIT"] = "MARKET",
+        client_order_id: Optional[str] = None,
+    ) -> "BinanceOrderParams":
+        """按交易规则取整并校验，下单时不再需要计算"""
+        info = exchange.get(symbol)
+        if info is None:
+            raise ValueError(f"Invalid symbol: {symbol}")
+
+        qty = info.quantize_qty(quantity)
+        if not info.check_qty(qty):
+            raise ValueError(f"Invalid quantity for {symbol}: {quantity}")
+        if price is not None:
+            price = info.quantize_price(price)
+            if not info.check_price(price):
+                raise ValueError(f"Invalid price for {symbol}: {price}")
+            if not info.check_notional(price, qty):
+                raise ValueError(f"Notional too small for {symbol}: {price}*{qty}")
+        if type == "LIMIT" and price is None:
+            raise ValueError("LIMIT order requires price")
+
+        return cls(
+            symbol=symbol,
+            side=side,
+            type=type,
+            quantity=qty,
+            price=price,
+            time_in_force="GTC" if type == "LIMIT" else None,
+            client_order_id=client_order_id,
+        )
+
+    def to_query(self) -> List[Tuple[str, str]]:
+        query = [
+            ("symbol", self.symbol),
+            ("side", self.side),
+            ("type", self.type),
+            ("quantity", str(self.quantity)),
+        ]
+        if self.type != "MARKET" and self.price is not None:
+            query.append(("price", str(self.price)))
+        if self.time_in_force:
+            query.append(("timeInForce", self.time_in_force))
+        if self.client_order_id:
+            query.append(("newClientOrderId", self.client_order_id))
+        return query
+
+
+class Signer:
+    """HMAC SHA256签名，key只初始化一次，每次签名copy一份"""
+
+    def __init__(self, secret: str):
+        self._hmac = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def sign(self, payload: str) -> str:
+        h = self._hmac.copy()
+        h.update(payload.encode())
+        return h.hexdigest()
+
+
+@dataclass
+class Order:
+    symbol: str
+    order_id: int
+    side: str = ""
+    type: str = ""
+    status: str = "NEW"
+    quantity: Decimal = Decimal(0)
+    executed_qty: Decimal = Decimal(0)
+    client_order_id: str = ""
+    update_time: int = 0
+    events: List[Dict] = field(default_factory=list, repr=False)
+
+
+# 订单状态的先后，时间相同时只能向后更新
+STATUS_RANK = {"NEW": 0, "PARTIALLY_FILLED": 1, "PENDING_CANCEL": 1}
+FINAL_RANK = 2  # FILLED、CANCELED、REJECTED、EXPIRED等
+
+
+class OrderTracker:
+    """根据下单/撤单响应和user data stream的executionReport维护订单状态
+
+    响应和事件可能乱序到达，按交易所的时间(响应的updateTime/transactTime，事件的T)
+    只接受更新的状态，避免晚到的响应覆盖事件中已成交/已撤销的状态
+    """
+
+    def __init__(self):
+        self.orders: Dict[int, Order] = {}
+        self._lock = threading.Lock()
+
+    def get(self, order_id: int) -> Optional[Order]:
+        return self.orders.get(order_id)
+
+    def _get_or_create(self, symbol: str, order_id: int) -> Order:
+        """调用方需要持有锁"""
+        order = self.orders.get(order_id)
+        if order is None:
+            order = self.orders[order_id] = Order(symbol=symbol, order_id=order_id)
+        return order
+
+    @staticmethod
+    def _is_newer(order: Order, status: str, update_time: int) -> bool:
+        if update_time != order.update_time:
+            return update_time > order.update_time
+        rank = STATUS_RANK.get(status, FINAL_RANK)
+        return rank >= STATUS_RANK.get(order.status, FINAL_RANK)
+
+    def _apply(self, order: Order, data: Dict) -> None:
+        """用REST响应更新状态，调用方需要持有锁"""
+        if "status" not in data:  # ACK响应没有状态
+            return
+        update_time = data.get("updateTime") or data.get("transactTime") or 0
+        if not self._is_newer(order, data["status"], update_time):
+            return
+        order.status = data["status"]
+        if "executedQty" in data:
+            order.executed_qty = Decimal(data["executedQty"])
+        order.update_time = update_time
+
+    def on_ack(self, params: BinanceOrderParams, data: Dict) -> Order:
+        with self._lock:
+            # executionReport可能先于响应到达
+            order = self._get_or_create(data["symbol"], data["orderId"])
+            order.side = params.side
+            order.type = params.type
+            order.quantity = params.quantity
+            order.client_order_id = data.get("clientOrderId", "")
+            self._apply(order, data)
+            return order
+
+    def on_cancel(self, order_id: int, data: Dict) -> Optional[Order]:
+        """撤单响应"""
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is not None:
+                self._apply(order, data)
+            return order
+
+    def on_event(self, event: Dict) -> None:
+        if event.get("e") != "executionReport":
+            return
+        with self._lock:
+            order = self._get_or_create(event["s"], event["i"])
+            # 事件可能乱序，只接受更新的事件
+            update_time = event.get("T") or event["E"]
+            if not self._is_newer(order, event["X"], update_time):
+                return
+            order.side = event["S"]
+            order.type = event["o"]
+            order.quantity = Decimal(event["q"])
+            order.status = event["X"]
+            order.executed_qty = Decimal(event["z"])
+            order.client_order_id = event["c"]
+            order.update_time = update_time
+            order.events.append(event)
+
+    def on_message(self, _, message: str) -> None:
+        """websocket的on_message回调"""
+        data = json.loads(message)
+        self.on_event(data.get("data", data))
+
+
+class BinanceOrderProxy(OrderProxy):
+    def __init__(
+        self,
+        api_key: str,
+        api_secret: str,
+        base_url: str = DEFAULT_BASE_URL,
+        recv_window: int = 5000,
+        resp_type: Literal["ACK", "RESULT", "FULL"] = "ACK",
+        max_workers: int = 4,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.recv_window = recv_window
+        self.resp_type = resp_type
+        self.max_workers = max_workers
+        self.signer = Signer(api_secret)
+        self.tracker = OrderTracker()
+        # 与Spot client共用同一个api_key的keep-alive session
+        self.session = get_session(api_key)
+        self.session.headers.update({"X-MBX-APIKEY": api_key})
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._ws = None
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        query: List[Tuple[str, str]],
+        timestamp: int = 0,
+    ) -> Dict:
+        query = query + [
+            ("recvWindow", str(self.recv_window)),
+            ("timestamp", str(timestamp or int(time.time() * 1000))),
+        ]
+        payload = urlencode(query)
+        url = f"{self.base_url}{path}?{payload}&signature={self.signer.sign(payload)}"
+        with timer("order_rest"):
+            resp = self.session.request(
+                method, url, timeout=config.timeout, proxies=config.proxies
+            )
+        data = resp.json()
+        if resp.status_code >= 400:
+            raise OrderError(resp.status_code, data)
+        return data
+
+    def make_new_order(self, params: BinanceOrderParams) -> Dict:
+        query = params.to_query() + [("newOrderRespType", self.resp_type)]
+        data = self._request(
+            "POST", "/api/v3/order", query, timestamp=params.timestamp
+        )
+        order = self.tracker.on_ack(params, data)
+        logger.debug(f"new order: {order}")
+        return data
+
+    def make_new_orders(
+        self, params: List[BinanceOrderParams]
+    ) -> List[Union[Dict, Exception]]:
+        """并发下单，按params的顺序返回结果，失败的返回异常"""
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.max_workers)
+
+        def submit(p: BinanceOrderParams) -> Union[Dict, Exception]:
+            try:
+                return self.make_new_order(p)
+            except Exception as e:
+                logger.warning(f"new order {p} failed: {e}")
+                return e
+
+        return list(self._pool.map(submit, params))
+
+    def cancel_order(self, order_id: int) -> Dict:
+        order = self.tracker.get(order_id)
+        if order is None:
+            raise ValueError(f"order {order_id} not found")
+        query = [("symbol", order.symbol), ("orderId", str(order_id))]
+        data = self._request("DELETE", "/api/v3/order", query)
+        self.tracker.on_cancel(order_id, data)
+        return data
+
+    def listen_user_stream(self, renew_seconds: int = 1800) -> None:
+        """订阅user data stream，用executionReport更新订单状态"""
+        from binance.websocket.spot.websocket_stream import (
+            SpotWebsocketStreamClient,
+        )
+
+        client = make_spot_clint(base_url=self.base_url, api_key=self.api_key)
+        listen_key = client.new_listen_key()["listenKey"]
+        self._ws = SpotWebsocketStreamClient(on_message=self.tracker.on_message)
+        self._ws.user_data(listen_key=listen_key)
+
+        def renew():
+            while 1:
+                time.sleep(renew_seconds)
+                try:
+                    client.renew_listen_key(listen_key)
+                except Exception as e:
+                    logger.warning(f"renew listen key failed: {e}")
+
+        threading.Thread(target=renew, daemon=True).start()
+
+    def close(self) -> None:
+        if self._pool:
+            self._pool.shutdown()
+        if self._ws:
+            self._ws.stop()
+
+
+class MarketBuyOnSignal:
+    """策略信号的处理：以最后一根k线的收盘价估算数量，市价买入quote_amount"""
+
+    def __init__(
+        self, proxy: OrderProxy, exchange: Exchange, quote_amount: Union[str, Decimal]
+    ):
+        self.proxy = proxy
+        self.exchange = exchange
+        self.quote_amount = Decimal(quote_amount)
+
+    def __call__(self, symbol: str, klines: Klines) -> None:
+        price = Decimal(klines[-1].close)
+        try:
+            # 市价单不会发送price，这里只用于校验最小名义价值
+            params = BinanceOrderParams.create(
+                self.exchange, symbol, "BUY", self.quote_amount / price, price=price
+            )
+            self.proxy.make_new_order(params)
+        except Exception as e:
+            logger.warning(f"buy {symbol} failed: {e}")
@@ -0,0 +1,93 @@
+"""截面排名：按最后一根已收盘k线的涨幅对所有symbol排序，增量更新"""
+
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+
+class RankIndex:
+    """symbol按值排序的索引，更新、按名次查询、查名次都是O(log n)
+
+    值相同时按symbol排序，结果是确定的。
+    每个symbol保存最近history_size根k线的分位数，用于"最近3根k线都在前10%"这类查询。
+    """
+
+    def __init__(self, history_size: int = 20):
+        self._sorted = SortedList()
+        self._values: Dict[str, float] = {}
+        # symbol -> 当前值对应k线的open_time
+        self._bars: Dict[str, int] = {}
+        self._history: Dict[str, Deque[Tuple[int, float]]] = {}
+        self.history_size = history_size
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self._values
+
+    def get(self, symbol: str) -> Optional[float]:
+        return self._values.get(symbol)
+
+    def update(self, symbol: str, value: float, open_time: Optional[int] = None) -> None:
+        """open_time: 值对应k线的open_time，snapshot时按它记录历史"""
+        if open_time is not None:
+            self._bars[symbol] = open_time
+        old = self._values.get(symbol)
+        if old == value:
+            return
+        if old is not None:
+            self._sorted.remove((old, symbol))
+        self._sorted.add((value, symbol))
+        self._values[symbol] = value
+
+    def remove(self, symbol: str) -> None:
+        value = self._values.pop(symbol, None)
+        if value is not None:
+            self._sorted.remove((value, symbol))
+        self._bars.pop(symbol, None)
+        self._history.pop(symbol, None)
+
+    def snapshot(self) -> None:
+        """把每个symbol当前k线的分位数记入历史，同一根k线只记一次
+
+        分位数要在本轮所有symbol都更新后才是该k线的截面排名，由执行器在计算策略前调用
+        """
+        for symbol, open_time in self._bars.items():
+            history = self._history.get(symbol)
+            if history is None:
+                history = self._history[symbol] = deque(maxlen=self.history_size)
+            elif history[-1][0] == open_time:
+                continue
+            history.append((open_time, self.percentile(symbol)))
+
+    def history(self, symbol: str, n: int) -> List[float]:
+        """最近n根k线的分位数，从旧到新，不足n根时返回已有的"""
+        history = self._history.get(symbol)
+        if not history or n <= 0:
+            return []
+        return [p for _, p in list(history)[-n:]]
+
+    def top(self, n: int) -> List[Tuple[str, float]]:
+        """值最大的n个，从大到小"""
+        items = self._sorted[-n:] if n > 0 else []
+        return [(s, v) for v, s in reversed(items)]
+
+    def bottom(self, n: int) -> List[Tuple[str, float]]:
+        """值最小的n个，从小到大"""
+        return [(s, v) for v, s in self._sorted[:max(n, 0)]]
+
+    def rank(self, symbol: str) -> Optional[int]:
+        """名次，值最大的为0"""
+        value = self._values.get(symbol)
+        if value is None:
+            return None
+        return len(self._sorted) - 1 - self._sorted.index((value, symbol))
+
+    def percentile(self, symbol: str) -> Optional[float]:
+        """值小于该symbol的比例，[0, 1)，例如前10%为percentile >= 0.9"""
+        value = self._values.get(symbol)
+        if value is None:
+            return None
+        return self._sorted.bisect_left((value, "")) / len(self._sorted)
@@ -0,0 +1,316 @@
+"""用历史k线或录制的行情流回放执行器
+
+数据通过ReplayDownloader交给Executor，和实盘走同一条KlinesManager/StrategyPipeline路径，
+时间由虚拟时钟控制：每根k线收盘时推进一次时钟并执行一轮，下载只返回该时刻已收盘的k线。
+speed为None时尽快回放，否则按speed倍速回放(1为实时)。
+
+结果只依赖输入数据，多次回放的信号相同(digest一致)，可以作为执行器改动的回归测试；
+同时统计吞吐(事件/秒)和每个事件的延迟(从该轮开始到该symbol的策略计算完成)。
+"""
+
+import os
+import glob
+import time
+import hashlib
+import datetime
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.etl import merge_his_klines
+from src.interval import interval_ms, ticker_window
+from src.sql import db, KlineFile
+from src.strategy.download import SpotDownloader
+from src.strategy.executor import Executor, StrategyPipeline
+from src.strategy.kline import KlineItem, Klines, TickerItem
+from src.utils import binance_timestamp2dt
+
+# 每个symbol的(open_time, open, high, low, close)
+Series = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+class VirtualClock:
+    def __init__(self, timestamp: int = 0):
+        self.timestamp = timestamp  # 毫秒
+
+    def __call__(self) -> datetime.datetime:
+        return binance_timestamp2dt(self.timestamp)
+
+    def advance_to(self, timestamp: int) -> None:
+        assert timestamp >= self.timestamp
+        self.timestamp = timestamp
+
+
+def df2series(df: pd.DataFrame) -> Series:
+    df = df.sort_values("open_time").drop_duplicates("open_time", keep="last")
+    prices = (
+        df[k].astype(float).astype(str).to_numpy()
+        for k in ("open", "high", "low", "close")
+    )
+    return (df["open_time"].to_numpy(np.int64), *prices)
+
+
+class ReplayDownloader(SpotDownloader):
+    """从内存中的k线序列返回虚拟时钟当前时刻已收盘的k线"""
+
+    def __init__(self, data: Dict[str, Series], interval: str, clock: VirtualClock):
+        self.data = data
+        self.interval = interval
+        self.step = interval_ms(interval)
+        self.clock = clock
+
+    @classmethod
+    def from_datadir(
+        cls,
+        datadir: str,
+        interval: str,
+        clock: VirtualClock,
+        symbols: Optional[List[str]] = None,
+        date_limit: Optional[Tuple[str, str]] = None,
+    ) -> "ReplayDownloader":
+        """读取下载器保存的历史k线，通过KlineFile目录查询要读的文件"""
+        KlineFile.ensure(datadir)
+        with db.connect() as conn:
+            plan = KlineFile.plan(conn, datadir, interval, symbols, date_limit)
+        data = {}
+        for symbol, paths in sorted(plan.items()):
+            dir_ = os.path.join(datadir, symbol, interval)
+            df = merge_his_klines(dir_, date_limit=date_limit, paths=paths)
+            if df is not None:
+                data[symbol] = df2series(df)
+        return cls(data, interval, clock)
+
+    @classmethod
+    def from_recording(
+        cls,
+        root: str,
+        interval: str,
+        clock: VirtualClock,
+        symbols: Optional[List[str]] = None,
+    ) -> "ReplayDownloader":
+        """读取src.recorder录制的kline流，只使用已收盘的k线"""
+        paths = sorted(glob.glob(os.path.join(root, "kline", "*", "*", "*.parquet")))
+        if not paths:
+            return cls({}, interval, clock)
+        columns = [
+            "symbol", "interval", "open_time", "open", "high", "low", "close", "closed"
+        ]
+        df = pd.concat(pd.read_parquet(p, columns=columns) for p in paths)
+        df = df[(df["interval"] == interval) & df["closed"]]
+        if symbols:
+            df = df[df["symbol"].isin(symbols)]
+        data = {s: df2series(g) for s, g in sorted(df.groupby("symbol"))}
+        return cls(data, interval, clock)
+
+    @property
+    def symbols(self) -> List[str]:
+        return sorted(self.data)
+
+    def closed_index(self, symbol: str) -> int:
+        """当前时刻已收盘的k线数量"""
+        series = self.data.get(symbol)
+        if series is None:
+            return 0
+        return int(np.searchsorted(series[0], self.clock.timestamp - self.step, "right"))
+
+    def download_klines(
+        self, symbol: str, interval: str, limit: int
+    ) -> List[KlineItem]:
+        assert interval == self.interval
+        end = self.closed_index(symbol)
+        if not end:
+            return []
+        ts, o, h, l, c = self.data[symbol]
+        start = max(end - limit, 0)
+        return [
+            KlineItem(symbol, interval, o[i], h[i], l[i], c[i], t)
+            for i, t in enumerate(ts[start:end].tolist(), start)
+        ]
+
+    def download_tickers(
+        self, symbols: List[str], window_size: str
+    ) -> List[TickerItem]:
+        """窗口为两根k线(Executor的ticker_window)，用最后两根已收盘的k线近似"""
+        assert window_size == ticker_window(self.interval, 2)
+        tickers = []
+        for s in symbols:
+            end = self.closed_index(s)
+            if not end:
+                continue
+            ts, o, h, l, c = self.data[s]
+            start = max(end - 2, 0)
+            tickers.append(TickerItem(
+                symbol=s,
+                window_size=window_size,
+                open=o[start],
+                high=max(h[start:end], key=float),
+                low=min(l[start:end], key=float),
+                close=c[end - 1],
+                open_time=int(ts[start]),
+                close_time=int(ts[end - 1]) + self.step - 1,
+            ))
+        return tickers
+
+    def ticks(self) -> np.ndarray:
+        """所有k线的收盘时刻"""
+        if not self.data:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate([s[0] for s in self.data.values()])) + self.step
+
+
+class TimedPipeline(StrategyPipeline):
+    """记录每次策略计算完成的时间"""
+
+    def __init__(self, pipeline: StrategyPipeline, on_done: Callable[[], None]):
+        super().__init__(pipeline.strategies)
+        self.state = pipeline.state
+        self.on_done = on_done
+
+    def __call__(self, data: Any) -> bool:
+        passed = super().__call__(data)
+        self.on_done()
+        return passed
+
+
+@dataclass
+class ReplayReport:
+    rounds: int = 0
+    events: int = 0
+    seconds: float = 0.0
+    # (虚拟时钟的UTC毫秒时间戳, symbol)
+    signals: List[Tuple[int, str]] = field(default_factory=list)
+    latencies: List[float] = field(default_factory=list)
+
+    @property
+    def throughput(self) -> float:
+        return self.events / self.seconds if self.seconds else 0.0
+
+    @property
+    def digest(self) -> str:
+        """信号的摘要，相同输入的多次回放应该一致"""
+        h = hashlib.sha1()
+        for ts, s in self.signals:
+            h.update(f"{ts},{s}\n".encode())
+        return h.hexdigest()
+
+    def latency_percentiles(self) -> Dict[str, float]:
+        if not self.latencies:
+            return {}
+        a = np.array(self.latencies)
+        return {
+            f"p{q}": float(np.percentile(a, q)) for q in (50, 90, 99)
+        } | {"max": float(a.max())}
+
+    def __str__(self) -> str:
+        lat = ", ".join(
+            f"{k}={v * 1000:.3f}ms" for k, v in self.latency_percentiles().items()
+        )
+        return (
+            f"rounds={self.rounds} events={self.events} signals={len(self.signals)} "
+            f"seconds={self.seconds:.3f} throughput={self.throughput:.0f}/s "
+            f"latency[{lat}] digest={self.digest}"
+        )
+
+
+class Replayer:
+    def __init__(
+        self,
+        strategy: StrategyPipeline,
+        downloader: ReplayDownloader,
+        init_limit: int = 5,
+        speed: Optional[float] = None,
+        **kwargs: Any,
+    ):
+        """kwargs传给Executor，例如prescreen、on_signal"""
+        self.downloader = downloader
+        self.clock = downloader.clock
+        self.speed = speed
+        self.report = ReplayReport()
+        self._round_start = 0.0
+
+        on_signal = kwargs.pop("on_signal", None)
+
+        def _on_signal(symbol: str, klines: Klines) -> None:
+            self.report.signals.append((self.clock.timestamp, symbol))
+            if on_signal:
+                on_signal(symbol, klines)
+
+        ticks = downloader.ticks()
+        self.ticks = ticks[init_limit - 1:] if len(ticks) >= init_limit else ticks[:0]
+        if len(self.ticks):
+            self.clock.advance_to(int(self.ticks[0]))
+        self.executor = Executor(
+            TimedPipeline(strategy, self._on_event),
+            interval=downloader.interval,
+            init_limit=init_limit,
+            on_signal=_on_signal,
+            downloader=downloader,
+            symbols=downloader.symbols,
+            clock=self.clock,
+            **kwargs,
+        )
+
+    def _on_event(self) -> None:
+        self.report.latencies.append(time.perf_counter() - self._round_start)
+
+    def run(self) -> ReplayReport:
+        report = self.report
+        # 初始化的一轮不计入
+        report.latencies.clear()
+        report.signals.clear()
+
+        start = time.perf_counter()
+        for i, tick in enumerate(self.ticks[1:]):
+            if self.speed:
+                virtual = (tick - self.ticks[0]) / 1000 / self.speed
+                delay = start + virtual - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            self.clock.advance_to(int(tick))
+            self._round_start = time.perf_counter()
+            self.executor.exec_strategy(1)
+            report.rounds += 1
+        report.seconds = time.perf_counter() - start
+        report.events = len(report.latencies)
+        logger.info(f"replay done, {report}")
+        return report
+
+
+def replay(
+    strategy: StrategyPipeline,
+    interval: str,
+    datadir: Optional[str] = None,
+    recording: Optional[str] = None,
+    symbols: Optional[List[str]] = None,
+    date_limit: Optional[Tuple[str, str]] = None,
+    **kwargs: Any,
+) -> ReplayReport:
+    """从datadir(历史k线)或recording(录制的行情流)回放"""
+    clock = VirtualClock()
+    if recording:
+        downloader = ReplayDownloader.from_recording(recording, interval, clock, symbols)
+    else:
+        downloader = ReplayDownloader.from_datadir(
+            datadir or "../data", interval, clock, symbols, date_limit
+        )
+    return Replayer(strategy, downloader, **kwargs).run()
+
+
+if __name__ == "__main__":
+    from src.strategy.calc import calc_kl_last_incr
+
+    def is_kl_last_incr_gt_5p(klines: Klines) -> bool:
+        incr = calc_kl_last_incr(klines)
+        return bool(incr and incr >= 0.05)
+
+    logger.remove()
+    logger.add(lambda m: print(m, end=""), level="WARNING")
+    for _ in range(2):
+        print(replay(
+            StrategyPipeline([is_kl_last_incr_gt_5p]),
+            interval="1h",
+            date_limit=("2024-01-01", "2024-01-31"),
+        ))
@@ -0,0 +1,172 @@
+"""多进程分片执行策略，用于计算量大的策略(例如基于to_df的pandas计算)
+
+主进程负责下载k线(网络io)和处理信号，symbol按crc32固定分配到常驻的worker进程，
+每个worker维护自己那部分symbol的KlinesManager，每轮只把新增或更新的k线
+以元组批量发给worker，worker计算策略后返回结果，主进程按symbol原来的顺序处理信号。
+
+限制：
+- 策略在worker中运行，StrategyPipeline.state的修改不会回到主进程，快照中的state不会更新
+- 截面排名(ranks)需要所有symbol在同一个进程中，不能分片
+"""
+
+import time
+import zlib
+import atexit
+import multiprocessing as mp
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from src.metrics import STAGE_SECONDS, STRATEGY_ERRORS, SYMBOL_SECONDS
+from src.strategy.executor import Executor, StrategyPipeline
+from src.strategy.kline import KlineItem, Klines, KlinesManager
+
+# (open, high, low, close, open_time)
+Row = Tuple[str, str, str, str, int]
+# (symbol, rows, reset)：reset为True时worker丢弃该symbol已有的k线
+Batch = List[Tuple[str, List[Row], bool]]
+# (symbol, passed, error, seconds)
+Result = Tuple[str, bool, Optional[str], float]
+
+
+def _worker(conn: Connection, strategy: StrategyPipeline, interval: str) -> None:
+    # 分片时不能使用排名，不维护
+    manager = KlinesManager(None, rank=False)
+    while 1:
+        batch: Optional[Batch] = conn.recv()
+        if batch is None:
+            break
+        results: List[Result] = []
+        for symbol, rows, reset in batch:
+            name = f"{symbol}{interval}"
+            start = time.perf_counter()
+            try:
+                if reset:
+                    manager.remove(name)
+                manager.add([KlineItem(symbol, interval, *r) for r in rows])
+                passed = bool(strategy(manager.get(name)))
+            except Exception as e:
+                results.append((symbol, False, repr(e), time.perf_counter() - start))
+            else:
+                results.append((symbol, passed, None, time.perf_counter() - start))
+        conn.send(results)
+    conn.close()
+
+
+class ShardedExecutor(Executor):
+    def __init__(
+        self,
+        strategy: StrategyPipeline,
+        interval: str,
+        processes: Optional[int] = None,
+        **kwargs: Any,
+    ):
+        """processes: worker进程数，默认cpu核数；其他参数同Executor"""
+        if kwargs.get("ranks") is not None:
+            raise ValueError("ranks can not be used with ShardedExecutor")
+
+        self.processes = processes or mp.cpu_count()
+        self._conns: List[Connection] = []
+        self._workers: List[mp.Process] = []
+        # symbol -> 已发给worker的最后一根k线的open_time
+        self._sent: Dict[str, int] = {}
+        for _ in range(self.processes):
+            parent, child = mp.Pipe()
+            p = mp.Process(
+                target=_worker, args=(child, strategy, interval), daemon=True
+            )
+            p.start()
+            child.close()
+            self._conns.append(parent)
+            self._workers.append(p)
+        atexit.register(self.close)
+        logger.info(f"started {self.processes} strategy workers")
+
+        super().__init__(strategy, interval, **kwargs)
+
+    def shard(self, symbol: str) -> int:
+        return zlib.crc32(symbol.encode()) % self.processes
+
+    def _new_rows(self, symbol: str, klines: Klines) -> Tuple[List[Row], bool]:
+        """返回需要发给worker的k线：上次发送的最后一根(可能未收盘)及之后的k线"""
+        sent = self._sent.get(symbol)
+        reset = sent is None or klines[0].open_time > sent
+        new = klines if reset else klines[len(klines) - _count_since(klines, sent):]
+        rows = [(i.open, i.high, i.low, i.close, i.open_time) for i in new]
+        self._sent[symbol] = klines[-1].open_time
+        return rows, reset
+
+    def _exec_strategy(self, limit: int, fill_gap: bool) -> None:
+        symbols = self.symbols
+        if self.prescreen:
+            symbols = self.prescreen_symbols(symbols)
+            fill_gap = True
+
+        ready: List[Tuple[str, Klines, float]] = []
+        batches: List[Batch] = [[] for _ in range(self.processes)]
+        for s in symbols:
+            start = time.perf_counter()
+            klines = self._download(s, limit, fill_gap)
+            if not klines or not self._is_new(s, klines):
+                continue
+            rows, reset = self._new_rows(s, klines)
+            batches[self.shard(s)].append((s, rows, reset))
+            ready.append((s, klines, time.perf_counter() - start))
+
+        # 先发给所有worker再接收，各worker并行计算
+        for conn, batch in zip(self._conns, batches):
+            conn.send(batch)
+        results: Dict[str, Result] = {}
+        for conn in self._conns:
+            for r in conn.recv():
+                results[r[0]] = r
+
+        for s, klines, elapsed in ready:
+            _, passed, error, seconds = results[s]
+            STAGE_SECONDS.observe(seconds, stage="strategy")
+            if error:
+                STRATEGY_ERRORS.inc(symbol=s)
+                logger.warning(f"exec strategy {s} failed: {error}")
+                self._sent.pop(s, None)  # 下一轮重新发送全部k线
+            elif passed:
+                self._handle_signal(s, klines)
+            SYMBOL_SECONDS.observe(elapsed + seconds, symbol=s)
+
+    def close(self) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(None)
+                conn.close()
+            except OSError:
+                pass
+        for p in self._workers:
+            p.join(timeout=5)
+        self._conns, self._workers = [], []
+
+
+def _count_since(klines: Klines, open_time: int) -> int:
+    """open_time及之后的k线数量，k线按时间排序，从后往前找"""
+    n = 0
+    for i in reversed(klines):
+        if i.open_time < open_time:
+            break
+        n += 1
+    return n
+
+
+def run_sharded_executor(
+    strategy: StrategyPipeline,
+    interval: str,
+    init_limit: int = 5,
+    processes: Optional[int] = None,
+    **kwargs: Any,
+) -> None:
+    executor = ShardedExecutor(
+        strategy,
+        interval=interval,
+        init_limit=init_limit,
+        processes=processes,
+        **kwargs,
+    )
+    executor.run_forever()
@@ -1,14 +1,15 @@
 """策略1：1小时k线涨幅大于5%"""
 
+import os
 from decimal import Decimal
 from typing import Union
 
 from src.strategy.executor import Klines, StrategyPipeline, run_executor
-from src.strategy.calc import calc_kl_last_incr
+from src.strategy.kline import TickerItem
+from src.strategy.calc import calc_kl_last_incr, calc_ticker_range
+from src.settings import settings
 from src.utils import log2file
 
-log2file("strategy1.log")
-
 
 def is_kl_last_incr_gt_5p(klines: Klines) -> Union[None, bool]:
     incr = calc_kl_last_incr(klines)
@@ -16,9 +17,20 @@ def is_kl_last_incr_gt_5p(klines: Klines) -> Union[None, bool]:
         return incr >= Decimal(0.05)
 
 
+def is_ticker_range_gt_5p(ticker: TickerItem) -> bool:
+    """粗筛：窗口内最高价相对最低价涨幅不到5%的，最后一根k线涨幅不可能大于5%"""
+    return calc_ticker_range(ticker) >= Decimal(0.05)
+
+
 def main():
+    log2file("strategy1.log")
     strategy = StrategyPipeline([is_kl_last_incr_gt_5p])
-    run_executor(strategy, interval="1h")
+    run_executor(
+        strategy,
+        interval="1h",
+        snapshot_path=os.path.join(settings.datadir, "snapshot", "strategy1.pkl"),
+        prescreen=is_ticker_range_gt_5p,
+    )
 
 
 if __name__ == "__main__":
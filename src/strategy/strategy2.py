@@ -1,13 +1,13 @@
+import os
 from typing import Union
 
 import pandas as pd
 from loguru import logger
 
 from src.strategy.executor import Klines, StrategyPipeline, run_executor
+from src.settings import settings
 from src.utils import log2file
 
-log2file("strategy2.log")
-
 
 def has_incr_gt_5p(klines: Klines) -> Union[None, bool]:
     df = klines.to_df()
@@ -20,8 +20,14 @@ def has_incr_gt_5p(klines: Klines) -> Union[None, bool]:
 
 
 def main():
+    log2file("strategy2.log")
     strategy = StrategyPipeline([has_incr_gt_5p])
-    run_executor(strategy, interval="1h", init_limit=10)
+    run_executor(
+        strategy,
+        interval="1h",
+        init_limit=10,
+        snapshot_path=os.path.join(settings.datadir, "snapshot", "strategy2.pkl"),
+    )
 
 
 if __name__ == "__main__":
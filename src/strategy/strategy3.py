@@ -1,14 +1,14 @@
 """策略1：最近的5根1小时k线，至少4根涨了且最近2根是涨的"""
 
+import os
 from decimal import Decimal
 from typing import Union
 
 from src.strategy.executor import Klines, StrategyPipeline, run_executor
 from src.strategy.calc import calc_kl_incr
+from src.settings import settings
 from src.utils import log2file
 
-log2file("strategy3.log")
-
 
 def has_4_incr(klines: Klines) -> Union[None, bool]:
     incr = calc_kl_incr(klines)
@@ -22,8 +22,13 @@ def has_4_incr(klines: Klines) -> Union[None, bool]:
 
 
 def main():
+    log2file("strategy3.log")
     strategy = StrategyPipeline([has_4_incr])
-    run_executor(strategy, interval="1h")
+    run_executor(
+        strategy,
+        interval="1h",
+        snapshot_path=os.path.join(settings.datadir, "snapshot", "strategy3.pkl"),
+    )
 
 
 if __name__ == "__main__":
@@ -1,10 +1,17 @@
 import os
+import zlib
 import datetime
-from typing import Union, List, Iterator, Tuple, Optional
+from typing import TYPE_CHECKING, Union, List, Iterator, Tuple, Optional, Dict
 
-import pandas as pd
 from loguru import logger
 
+if TYPE_CHECKING:  # pandas导入较慢，只在用到的函数中导入
+    import numpy as np
+    import pandas as pd
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
 
 def binance_timestamp2dt(ts: int) -> datetime.datetime:
     return datetime.datetime.fromtimestamp(ts / 1000)
@@ -15,26 +22,17 @@ def split_interval(interval: str) -> Tuple[int, str]:
 
 
 def interval2timedelta(interval: str) -> datetime.timedelta:
-    n, t = split_interval(interval)
-    if t == "h":
-        kw = dict(hours=n)
-    elif t == "m":
-        kw = dict(minutes=n)
-    else:
-        raise ValueError(f"Invalid interval: {interval}")
-    return datetime.timedelta(**kw)
+    """固定长度的周期(1s~1w)，周期表见src.interval"""
+    from src.interval import get_interval
+
+    return get_interval(interval).timedelta
 
 
 def get_next_runtime(interval: str) -> datetime.datetime:
-    n, t = split_interval(interval)
-    rt = datetime.datetime.now().replace(second=0, microsecond=0)
-    if t == "h":
-        rt = rt.replace(minute=0) + datetime.timedelta(hours=n)
-    elif t == "m":
-        rt = rt + datetime.timedelta(minutes=n)
-    else:
-        raise ValueError(f"Invalid interval: {interval}")
-    return rt
+    """当前k线收盘后下一根k线的开始时间(本地时间)，按binance的k线边界对齐"""
+    from src.interval import next_open, now_ms
+
+    return binance_timestamp2dt(next_open(now_ms(), interval))
 
 
 def datetime2timestamp(dt: Union[int, datetime.datetime]) -> int:
@@ -52,6 +50,8 @@ def datetime2str(dt: Union[str, datetime.datetime], fmt: str = "%Y-%m-%d") -> st
 def date_range(
     date: Union[str, datetime.datetime], ndays: Optional[int] = None
 ) -> List[datetime.datetime]:
+    import pandas as pd
+
     if isinstance(date, str):
         date = pd.to_datetime(date).to_pydatetime()
     end = None if ndays else datetime.date.today()
@@ -69,37 +69,188 @@ def remove_trailing_0s(s: str) -> str:
     return s[:index + 1]
 
 
-def df2csv(df: pd.DataFrame, path: str) -> None:
+def df2csv(df: "pd.DataFrame", path: str) -> None:
     os.makedirs(os.path.dirname(path), exist_ok=True)
     df.to_csv(path, index=False)
     logger.info(f"save {os.path.basename(path)} done")
 
 
-def get_csv_last_timestamp(path: str) -> int:
-    df = pd.read_csv(path)
-    last_row = df.iloc[-1]
-    return last_row["open_time"]
+def read_last_line(path: str, block_size: int = 4096) -> Optional[bytes]:
+    """从文件末尾往前读取最后一行，文件不是以换行结尾(可能正在写入)时返回None"""
+    with open(path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return None
+        f.seek(end - 1)
+        if f.read(1) != b"\n":
+            return None
 
+        buf = b""
+        pos = end - 1  # 不包含最后的换行
+        while pos > 0:
+            size = min(block_size, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)
+            i = chunk.rfind(b"\n")
+            if i != -1:
+                return chunk[i + 1:] + buf
+            buf = chunk + buf
+        return buf
 
-def gen_datadir_csv(datadir: str = "../data") -> Iterator[str]:
-    for s in os.listdir(datadir):
-        dir1 = os.path.join(datadir, s)
-        if not os.path.isdir(dir1):
-            continue
-        for i in os.listdir(dir1):
-            dir2 = os.path.join(dir1, i)
-            if not os.path.isdir(dir2):
+
+def get_csv_last_timestamp(path: str) -> Optional[int]:
+    """只读取csv的最后一行，返回open_time(第一列)"""
+    line = read_last_line(path)
+    if not line:
+        return None
+    try:
+        return int(line.split(b",", 1)[0])
+    except ValueError:  # 只有表头
+        return None
+
+
+def get_parquet_last_timestamp(path: str) -> Optional[int]:
+    """从parquet footer的统计信息读取open_time的最大值"""
+    import pyarrow.parquet as pq
+
+    metadata = pq.ParquetFile(path).metadata
+    index = metadata.schema.names.index("open_time")
+    values = []
+    for i in range(metadata.num_row_groups):
+        stats = metadata.row_group(i).column(index).statistics
+        if stats is not None and stats.has_min_max:
+            values.append(stats.max)
+    return int(max(values)) if values else None
+
+
+def get_file_stats(path: str) -> Optional[Dict]:
+    """读取文件的行数、open_time范围、大小和crc32，文件不完整时返回None"""
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    stats = dict(size=stat.st_size, mtime=int(stat.st_mtime), checksum=zlib.crc32(data))
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        metadata = pq.ParquetFile(path).metadata
+        index = metadata.schema.names.index("open_time")
+        min_values, max_values = [], []
+        for i in range(metadata.num_row_groups):
+            s = metadata.row_group(i).column(index).statistics
+            if s is not None and s.has_min_max:
+                min_values.append(s.min)
+                max_values.append(s.max)
+        stats.update(
+            rows=metadata.num_rows,
+            min_open_time=int(min(min_values)) if min_values else None,
+            max_open_time=int(max(max_values)) if max_values else None,
+        )
+        return stats
+
+    if not data.endswith(b"\n"):  # 正在写入
+        return None
+    rows = data.count(b"\n") - 1  # 去掉表头
+    min_open_time = max_open_time = None
+    if rows > 0:
+        first = data.find(b"\n") + 1
+        last = data.rfind(b"\n", 0, len(data) - 1) + 1
+        min_open_time = int(data[first:data.find(b",", first)])
+        max_open_time = int(data[last:data.find(b",", last)])
+    stats.update(
+        rows=rows, min_open_time=min_open_time, max_open_time=max_open_time
+    )
+    return stats
+
+
+def get_file_last_timestamp(path: str) -> Optional[int]:
+    if path.endswith(".parquet"):
+        return get_parquet_last_timestamp(path)
+    return get_csv_last_timestamp(path)
+
+
+def scan_datadir(
+    datadir: str = "../data", suffixes: Tuple[str, ...] = (".csv",)
+) -> Iterator[str]:
+    """遍历datadir/symbol/interval/下的数据文件"""
+    with os.scandir(datadir) as it1:
+        for e1 in it1:
+            if not e1.is_dir():
                 continue
-            for f in os.listdir(dir2):
-                path = os.path.join(dir2, f)
-                if not path.endswith("csv"):
-                    continue
-                yield path
+            with os.scandir(e1.path) as it2:
+                for e2 in it2:
+                    if not e2.is_dir():
+                        continue
+                    with os.scandir(e2.path) as it3:
+                        for e3 in it3:
+                            if e3.name.endswith(suffixes) and e3.is_file():
+                                yield e3.path
+
+
+def gen_datadir_csv(datadir: str = "../data") -> Iterator[str]:
+    """datadir中的csv文件，通过KlineFile目录查询，不遍历文件系统"""
+    from src.sql import db, KlineFile
+
+    KlineFile.ensure(datadir)
+    with db.connect() as conn:
+        return iter(KlineFile.list_paths(conn, datadir))
+
+
+def is_monthly_partition(date: str) -> bool:
+    """压缩后的月度文件的日期为%Y-%m"""
+    return len(date) == 7
+
+
+def local_utc_offset_ms(ts: Optional[int] = None) -> int:
+    """ts(默认当前时间)时本地时间与UTC的差，有夏令时的时区在一年中不同"""
+    if ts is None:
+        dt = datetime.datetime.now()
+    else:
+        dt = datetime.datetime.fromtimestamp(ts / 1000)
+    offset = dt.astimezone().utcoffset()
+    return int(offset.total_seconds() * 1000)
+
+
+def local_days(ts: "np.ndarray") -> "np.ndarray":
+    """UTC毫秒时间戳所在的本地日期(1970-01-01起的天数)
+
+    文件按本地日期命名，按本地日期划分每天的数据；时区偏移按每个小时分别计算，
+    夏令时前后的数据也划分到正确的日期
+    """
+    import numpy as np
+
+    ts = np.asarray(ts, dtype="int64")
+    hours, inverse = np.unique(ts // HOUR_MS, return_inverse=True)
+    offsets = np.array(
+        [local_utc_offset_ms(int(h) * HOUR_MS) for h in hours], dtype="int64"
+    )
+    return (ts + offsets[inverse.reshape(ts.shape)]) // DAY_MS
+
+
+def read_refetch_list(path: str) -> List[Tuple[str, str, str]]:
+    """读取完整性检查报告(src.integrity)，返回需要重新下载的(symbol, interval, date)"""
+    import pandas as pd
+
+    report = pd.read_csv(path, dtype=str, keep_default_na=False)
+    report = report[report["issue"] != "error"]
+    items = report[["symbol", "interval", "date"]].drop_duplicates()
+    return sorted(map(tuple, items.itertuples(index=False)))
+
+
+def date_limit2timestamps(date_limit: Tuple[str, str]) -> Tuple[int, int]:
+    """日期范围对应的open_time范围(闭区间)，与按天下载的文件一致，包含结束日期次日0点的k线"""
+    import pandas as pd
+
+    start = pd.to_datetime(date_limit[0]).to_pydatetime()
+    end = pd.to_datetime(date_limit[1]).to_pydatetime() + datetime.timedelta(days=1)
+    return datetime2timestamp(start), datetime2timestamp(end)
 
 
 def extract_symbol_from_file(file: str) -> Tuple[str, str, str]:
     file = os.path.basename(file)
-    symbol, interval, date = file.replace(".csv", "").split("-", 2)
+    file = file.replace(".csv", "").replace(".parquet", "")
+    symbol, interval, date = file.split("-", 2)
     return symbol, interval, date
 
 
@@ -0,0 +1,35 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine
+
+from src import sql
+
+
+@pytest.fixture
+def tmp_db(tmp_path):
+    """把src.sql.db换成临时目录中的sqlite"""
+    engine = sql.db.engine
+    sql.db.engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'test.sql')}")
+    sql.db.create_all()
+    yield sql.db
+    sql.db.engine.dispose()
+    sql.db.engine = engine
+
+
+@pytest.fixture
+def set_tz():
+    """设置本地时区，结束后恢复"""
+    old = os.environ.get("TZ")
+
+    def set_(name):
+        os.environ["TZ"] = name
+        time.tzset()
+
+    yield set_
+    if old is None:
+        os.environ.pop("TZ", None)
+    else:
+        os.environ["TZ"] = old
+    time.tzset()
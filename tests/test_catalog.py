@@ -0,0 +1,84 @@
+import os
+import glob
+import contextlib
+import io
+
+import pandas as pd
+
+from src.bench import write_datadir
+from src.etl import calc_cum_return, merge_his_klines
+from src.sql import KlineFile
+from src.utils import gen_datadir_csv
+
+SYMBOLS = ["AAAUSDT", "BBBUSDT", "CCCUSDT"]
+
+
+def cum_return_from_files(datadir, n, loss=0.002):
+    """直接读取所有文件计算，不经过目录"""
+    cum_return = 1.0
+    for symbol in SYMBOLS:
+        paths = sorted(glob.glob(os.path.join(datadir, symbol, "1h", "*.csv")))
+        df = pd.concat(pd.read_csv(p) for p in paths).drop_duplicates("open_time")
+        df = df.sort_values("open_time")
+        incr = (df["close"] - df["open"]) / df["open"]
+        next_incr = incr.shift(1)
+        selected = next_incr[incr > n]
+        cum_return *= (selected + 1).prod() * (1 - loss) ** len(selected)
+    return cum_return
+
+
+def test_readers_rebuild_empty_catalog(tmp_path, tmp_db):
+    datadir = str(tmp_path / "data")
+    write_datadir(datadir, SYMBOLS, "1h", "2024-01-01", 5)
+
+    with tmp_db.connect() as conn:
+        assert not KlineFile.exists(conn, datadir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        ret = calc_cum_return(datadir, interval="1h", n=0.005)
+    with tmp_db.connect() as conn:
+        assert KlineFile.exists(conn, datadir)
+    assert ret != 1.0
+    assert abs(ret - cum_return_from_files(datadir, 0.005)) < 1e-12
+
+    df = merge_his_klines(os.path.join(datadir, "AAAUSDT", "1h"))
+    assert len(df) == 5 * 24 + 1
+    assert len(list(gen_datadir_csv(datadir))) == len(SYMBOLS) * 5
+
+
+def test_catalog_separates_datadirs(tmp_path, tmp_db):
+    a, b = str(tmp_path / "a"), str(tmp_path / "b")
+    write_datadir(a, SYMBOLS[:2], "1h", "2024-01-01", 3)
+    write_datadir(b, SYMBOLS[:1], "1h", "2024-02-01", 2)
+    KlineFile.rebuild(a, processes=1)
+    KlineFile.rebuild(b, processes=1)
+
+    with tmp_db.connect() as conn:
+        plan_a = KlineFile.plan(conn, a, "1h")
+        plan_b = KlineFile.plan(conn, b, "1h")
+    assert sorted(plan_a) == SYMBOLS[:2]
+    assert len(plan_a["AAAUSDT"]) == 3
+    assert all(p.startswith(a) for paths in plan_a.values() for p in paths)
+    assert sorted(plan_b) == SYMBOLS[:1]
+    assert len(plan_b["AAAUSDT"]) == 2
+
+
+def test_create_all_drops_outdated_catalog(tmp_db):
+    with tmp_db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE kline_file")
+        conn.exec_driver_sql(
+            "CREATE TABLE kline_file (symbol VARCHAR(16), interval VARCHAR(8), "
+            "date VARCHAR(10), path VARCHAR(128))"
+        )
+    tmp_db.create_all()
+    with tmp_db.connect() as conn:
+        assert not KlineFile.exists(conn, "data")
+
+
+def test_readers_create_missing_tables(tmp_path, tmp_db):
+    datadir = str(tmp_path / "data")
+    write_datadir(datadir, SYMBOLS, "1h", "2024-01-01", 2)
+    tmp_db.metadata.drop_all(tmp_db.engine)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        ret = calc_cum_return(datadir, interval="1h", n=0.005)
+    assert abs(ret - cum_return_from_files(datadir, 0.005)) < 1e-12
@@ -0,0 +1,70 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+from src import cli, etl
+from src.settings import settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def restore_settings(monkeypatch):
+    for k, v in vars(settings).items():
+        monkeypatch.setattr(settings, k, v)
+
+
+def test_global_options_write_settings(restore_settings, capsys):
+    cli.main(["--datadir", "d", "--db-url", "sqlite:///x.sql", "--proxy", "", "config"])
+    assert settings.datadir == "d"
+    assert settings.db_url == "sqlite:///x.sql"
+    assert settings.proxies == {}
+    out = capsys.readouterr().out
+    assert "datadir=d\n" in out
+    assert "db_url=sqlite:///x.sql\n" in out
+
+
+def test_backtest_arguments(restore_settings, monkeypatch, capsys):
+    calls = []
+    monkeypatch.setattr(etl, "calc_cum_return", lambda *a, **kw: calls.append((a, kw)) or 1.5)
+
+    cli.main([
+        "--datadir", "d", "backtest", "--interval", "1h", "--n", "0.01",
+        "--start", "2024-01-01", "--end", "2024-01-31", "--streaming",
+    ])
+    assert calls == [(("d",), dict(
+        interval="1h",
+        n=0.01,
+        loss=0.002,
+        date_limit=("2024-01-01", "2024-01-31"),
+        streaming=True,
+    ))]
+    assert "cum return: 1.5" in capsys.readouterr().out
+
+    with pytest.raises(SystemExit):
+        cli.main(["backtest", "--start", "2024-01-01"])
+
+
+def test_subcommand_required():
+    with pytest.raises(SystemExit):
+        cli.main([])
+    with pytest.raises(SystemExit):
+        cli.main(["catalog", "bad-action"])
+
+
+def test_config_does_not_import_heavy_modules():
+    code = (
+        "import sys\n"
+        "from src.cli import main\n"
+        "main(['config'])\n"
+        "print(sorted(m for m in ('pandas', 'sqlalchemy', 'binance') if m in sys.modules))\n"
+    )
+    env = dict(os.environ, PYTHONPATH=ROOT, W3_DATADIR="envdir")
+    out = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    assert "datadir=envdir\n" in out
+    assert out.strip().endswith("[]")
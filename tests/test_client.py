@@ -0,0 +1,76 @@
+import time
+
+from binance.spot import Spot
+
+from src import client
+from src.client import CachedSpot, ResponseCache, get_session
+
+HOUR_MS = 3600 * 1000
+
+
+def make_client(tmp_path, monkeypatch):
+    calls = []
+
+    def klines(self, symbol, interval, **kwargs):
+        calls.append(("klines", symbol, interval, kwargs))
+        return [[kwargs.get("startTime", 0), "1", "2", "0.5", "1.5"]]
+
+    def exchange_info(self, *args, **kwargs):
+        calls.append(("exchange_info", args, kwargs))
+        return {"symbols": [], "n": len(calls)}
+
+    monkeypatch.setattr(Spot, "klines", klines)
+    monkeypatch.setattr(Spot, "exchange_info", exchange_info)
+    spot = CachedSpot(cache=ResponseCache(str(tmp_path / "cache")))
+    return spot, calls
+
+
+def test_closed_range_klines_cached(tmp_path, monkeypatch):
+    spot, calls = make_client(tmp_path, monkeypatch)
+    kwargs = dict(startTime=0, endTime=10 * HOUR_MS, limit=10)
+    first = spot.klines("BTCUSDT", "1h", **kwargs)
+    assert spot.klines("BTCUSDT", "1h", **kwargs) == first
+    assert len(calls) == 1
+
+    # 参数不同的请求不共用缓存
+    spot.klines("BTCUSDT", "1h", startTime=HOUR_MS, endTime=10 * HOUR_MS)
+    spot.klines("ETHUSDT", "1h", **kwargs)
+    assert len(calls) == 3
+
+    # 新的client从磁盘读取
+    other = CachedSpot(cache=ResponseCache(str(tmp_path / "cache")))
+    assert other.klines("BTCUSDT", "1h", **kwargs) == first
+    assert len(calls) == 3
+
+
+def test_open_range_klines_not_cached(tmp_path, monkeypatch):
+    spot, calls = make_client(tmp_path, monkeypatch)
+    now = int(time.time() * 1000)
+    for _ in range(2):
+        # 最后一根k线未收盘
+        spot.klines("BTCUSDT", "1h", startTime=now - HOUR_MS, endTime=now)
+        # 没有endTime，返回最新的k线
+        spot.klines("BTCUSDT", "1h", limit=10)
+    assert len(calls) == 4
+
+
+def test_limit_usage_not_cached(tmp_path, monkeypatch):
+    spot, calls = make_client(tmp_path, monkeypatch)
+    spot.show_limit_usage = True
+    for _ in range(2):
+        spot.klines("BTCUSDT", "1h", startTime=0, endTime=HOUR_MS)
+    assert len(calls) == 2
+
+
+def test_exchange_info_ttl(tmp_path, monkeypatch):
+    spot, calls = make_client(tmp_path, monkeypatch)
+    assert spot.exchange_info() == spot.exchange_info()
+    assert len(calls) == 1
+
+    monkeypatch.setattr(client.config, "exchange_info_ttl", -1)
+    assert spot.exchange_info()["n"] == 2
+
+
+def test_session_shared_per_api_key():
+    assert get_session("key-a") is get_session("key-a")
+    assert get_session("key-a") is not get_session("key-b")
@@ -0,0 +1,66 @@
+import os
+import io
+import datetime
+import contextlib
+
+import pandas as pd
+
+from src.bench import write_datadir
+from src.compact import compact
+from src.etl import calc_cum_return
+from src.sql import DownloadLog
+
+SYMBOL = "AAAUSDT"
+JANUARY = [d.strftime("%Y-%m-%d") for d in pd.date_range("2024-01-01", "2024-01-31")]
+
+
+def days_to_download(db, dates):
+    with db.connect() as conn:
+        return [d for d in dates if not DownloadLog.should_ignore(conn, SYMBOL, "1h", d)]
+
+
+def test_rebuild_download_log_after_compact(tmp_path, tmp_db):
+    datadir = str(tmp_path / "data")
+    write_datadir(datadir, [SYMBOL], "1h", "2024-01-01", 40)
+
+    compact(datadir, before_month="2024-02", grace_seconds=0)
+    # 第二次运行删除已合并的按天文件
+    compact(datadir, before_month="2024-02", grace_seconds=0)
+    files = os.listdir(os.path.join(datadir, SYMBOL, "1h"))
+    assert f"{SYMBOL}-1h-2024-01.csv" in files
+    assert not [f for f in files if f.startswith(f"{SYMBOL}-1h-2024-01-")]
+    assert days_to_download(tmp_db, JANUARY) == []
+
+    tmp_db.create_all(drop=True)
+    DownloadLog.rebuild_from_files(datadir, processes=1)
+    assert days_to_download(tmp_db, JANUARY) == []
+
+    with tmp_db.connect() as conn:
+        info = DownloadLog.find_info(conn, SYMBOL, "1h", "2024-01-31")
+    # 与按天的文件一致，最后一根为次日0点的k线
+    assert info.last_timestamp == int(datetime.datetime(2024, 2, 1).timestamp() * 1000)
+
+
+def test_streaming_cum_return_with_compacted_month(tmp_path, tmp_db):
+    datadir = str(tmp_path / "data")
+    symbols = [SYMBOL, "BBBUSDT"]
+    write_datadir(datadir, symbols, "1h", "2024-01-20", 20)
+
+    def cum_returns(**kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [
+                calc_cum_return(datadir, interval="1h", n=0.005, streaming=streaming, **kwargs)
+                for streaming in (False, True)
+            ]
+
+    limit = ("2024-01-25", "2024-02-05")
+    before = [cum_returns(), cum_returns(date_limit=limit)]
+    compact(datadir, before_month="2024-02", grace_seconds=0)
+    compact(datadir, before_month="2024-02", grace_seconds=0)
+    assert f"{SYMBOL}-1h-2024-01.csv" in os.listdir(os.path.join(datadir, SYMBOL, "1h"))
+    after = [cum_returns(), cum_returns(date_limit=limit)]
+
+    assert before[0][0] != 1.0
+    for expected, (in_memory, streaming) in zip(before, after):
+        assert abs(in_memory - streaming) < 1e-12
+        assert abs(in_memory - expected[0]) < 1e-12
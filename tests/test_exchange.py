@@ -0,0 +1,69 @@
+from decimal import Decimal
+
+import pytest
+
+from src.bench import gen_exchange_info, gen_symbols
+from src.exchange import Exchange, Quantizer
+
+
+def brute_force(data, filters):
+    return sorted(
+        s["symbol"]
+        for s in data["symbols"]
+        if s["status"] == "TRADING" and all(s[k] == v for k, v in filters.items())
+    )
+
+
+@pytest.mark.parametrize("step, value, expected", [
+    ("0.01", "1.23456", "1.23"),
+    ("0.01000000", "1.239", "1.23"),
+    ("1", "12.9", "12"),
+    ("10", "129", "1.2E+2"),
+    ("0.05", "1.239", "1.20"),
+    ("0.00025", "0.0011", "0.00100"),
+    ("0", "1.23456", "1.23456"),
+])
+def test_quantizer_rounds_down(step, value, expected):
+    q = Quantizer(step)
+    assert q(value) == Decimal(expected)
+    assert q(Decimal(value)) == Decimal(expected)
+    if Decimal(step):
+        assert q(value) % Decimal(step) == 0
+
+
+def test_registry_query_matches_scan():
+    data = gen_exchange_info(gen_symbols(200))
+    for i, s in enumerate(data["symbols"]):
+        s["isSpotTradingAllowed"] = bool(i % 3)
+    exchange = Exchange(data)
+
+    for filters in (
+        {},
+        {"quoteAsset": "USDT"},
+        {"quoteAsset": "BTC", "status": "TRADING"},
+        {"quoteAsset": "USDT", "isSpotTradingAllowed": True},
+        {"baseAsset": data["symbols"][1]["baseAsset"]},
+        {"quoteAsset": "XXX"},
+    ):
+        expected = brute_force(data, filters)
+        assert exchange.get_symbols(filters) == expected
+        # 缓存的结果不会被调用方修改
+        exchange.get_symbols(filters).append("BADUSDT")
+        assert exchange.get_symbols(filters) == expected
+
+
+def test_symbol_info_and_refresh():
+    data = gen_exchange_info(gen_symbols(20))
+    exchange = Exchange(data)
+    symbol = data["symbols"][1]["symbol"]
+    info = exchange.get(symbol)
+    assert exchange.quantize_qty(symbol, "1.23456") == Decimal("1.234")
+    assert exchange.quantize_price(symbol, 1.239) == Decimal("1.23")
+    assert info.check_qty(Decimal("0.001"))
+    assert not info.check_qty(Decimal("0.0009"))
+    assert exchange.get("NOTEXIST") is None
+
+    before = exchange.get_symbols({"quoteAsset": "USDT"})
+    exchange.refresh({"symbols": data["symbols"][:1]})
+    assert exchange.get(symbol) is None
+    assert exchange.get_symbols({"quoteAsset": "USDT"}) != before
@@ -0,0 +1,84 @@
+from src.bench import gen_klines
+from src.metrics import STRATEGY_ERRORS
+from src.strategy.executor import Executor, StrategyPipeline
+from src.strategy.replay import ReplayDownloader, VirtualClock, df2series
+
+INTERVAL = "1h"
+SYMBOLS = ["AAAUSDT", "BBBUSDT"]
+
+
+def make_executor(strategy, admitted, **kwargs):
+    data = {
+        s: df2series(gen_klines(INTERVAL, "2024-01-01", 2, seed))
+        for seed, s in enumerate(SYMBOLS)
+    }
+    start = int(data[SYMBOLS[0]][0][10])
+    clock = VirtualClock(start)
+    executor = Executor(
+        strategy,
+        INTERVAL,
+        init_limit=5,
+        prescreen=lambda t: t.symbol in admitted,
+        downloader=ReplayDownloader(data, INTERVAL, clock),
+        symbols=SYMBOLS,
+        clock=clock,
+        **kwargs,
+    )
+    return executor, clock
+
+
+def test_symbol_admitted_by_prescreen_later_gets_history():
+    seen = {}
+
+    def prev_incr_gt_0(klines):
+        # 需要最后一根之前的k线
+        seen[klines.symbol] = len(klines)
+        return float(klines[-2].close) > float(klines[-2].open)
+
+    admitted = {"AAAUSDT"}
+    executor, clock = make_executor(StrategyPipeline([prev_incr_gt_0]), admitted)
+    assert executor.klines_manager.get(f"BBBUSDT{INTERVAL}") is None
+    errors = STRATEGY_ERRORS.get(symbol="BBBUSDT")
+
+    admitted.add("BBBUSDT")
+    clock.advance_to(clock.timestamp + 3600 * 1000)
+    executor.exec_strategy(1)
+
+    assert seen["BBBUSDT"] >= executor.init_limit
+    assert STRATEGY_ERRORS.get(symbol="BBBUSDT") == errors
+
+
+def test_strategy_error_does_not_abort_round():
+    evaluated = []
+
+    def fails_on_aaa(klines):
+        evaluated.append(klines.symbol)
+        if klines.symbol == "AAAUSDT":
+            raise ValueError("boom")
+        return False
+
+    errors = STRATEGY_ERRORS.get(symbol="AAAUSDT")
+    make_executor(StrategyPipeline([fails_on_aaa]), set(SYMBOLS))
+    assert evaluated == SYMBOLS
+    assert STRATEGY_ERRORS.get(symbol="AAAUSDT") == errors + 1
+
+
+def test_prescreen_window_covers_last_closed_bar():
+    tickers = []
+
+    def record(t):
+        tickers.append(t)
+        return True
+
+    executor, clock = make_executor(StrategyPipeline([lambda kl: False]), set())
+    executor.prescreen = record
+    clock.advance_to(clock.timestamp + 3600 * 1000 + 59 * 60 * 1000)
+    executor.exec_strategy(1)
+
+    for t in tickers:
+        last = executor.klines_manager.get(f"{t.symbol}{INTERVAL}")[-1]
+        assert t.window_size == "2h"
+        assert t.open_time <= last.open_time
+        assert float(t.high) >= float(last.high)
+        assert float(t.low) <= float(last.low)
+    assert len(tickers) == len(SYMBOLS)
@@ -0,0 +1,57 @@
+import os
+
+from src.bench import write_datadir
+from src.integrity import read_refetch_list, scan, write_report
+
+
+def test_scan_reports_error_and_continues(tmp_path):
+    datadir = str(tmp_path / "data")
+    write_datadir(datadir, ["AAAUSDT", "BBBUSDT"], "1h", "2024-01-01", 3)
+    with open(os.path.join(datadir, "AAAUSDT", "1h", "AAAUSDT-1h-2024-01-02.csv"), "w") as f:
+        f.write("not,a,kline,file\n1,2,3,4\n")
+
+    report = scan(datadir, processes=1)
+    errors = report[report["issue"] == "error"]
+    assert errors[["symbol", "interval"]].values.tolist() == [["AAAUSDT", "1h"]]
+    assert report[report["symbol"] == "BBBUSDT"].empty
+
+    path = str(tmp_path / "report.csv")
+    write_report(report, path)
+    assert read_refetch_list(path) == []
+
+
+def test_scan_across_dst(tmp_path, set_tz):
+    # 2024-03-10夏令时开始，当天只有23小时；2024-11-03结束，当天有25小时
+    set_tz("America/New_York")
+    for start in ("2024-03-08", "2024-11-01"):
+        datadir = str(tmp_path / start)
+        write_datadir(datadir, ["AAAUSDT"], "1h", start, 5)
+
+        report = scan(datadir, processes=1)
+        assert report.empty, report
+
+
+def test_scan_skips_agg_trades_dirs(tmp_path, tmp_db):
+    from src.download import AggTradesPartWriter, SpotDownloader, parse_agg_trades
+
+    datadir = str(tmp_path / "data")
+    write_datadir(datadir, ["AAAUSDT"], "1h", "2024-01-01", 3)
+    # 旧版本的目录结构：{datadir}/{symbol}/aggTrades
+    old = os.path.join(datadir, "AAAUSDT", "aggTrades", "date=2024-01-01")
+    os.makedirs(old)
+    open(os.path.join(old, "1.parquet"), "wb").close()
+
+    downloader = SpotDownloader(datadir)
+    writer = AggTradesPartWriter(downloader, "AAAUSDT")
+    ts = 1704067200000
+    writer.write(parse_agg_trades([
+        dict(a=i, p="1.0", q="2.0", f=i, l=i, T=ts + i, m=False, M=True)
+        for i in range(3)
+    ]))
+    writer.close(complete=True)
+    downloader.close()
+    assert os.listdir(os.path.join(datadir, "aggTrades", "AAAUSDT"))
+
+    report = scan(datadir, processes=1)
+    assert report[report["issue"] == "error"].empty
+    assert set(report["interval"]) <= {"1h"}
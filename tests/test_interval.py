@@ -0,0 +1,100 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from src.interval import (
+    DAY_MS,
+    INTERVAL_MS,
+    bars_between,
+    floor,
+    interval_ms,
+    is_aligned,
+    ms2datetime,
+    next_open,
+    ticker_window,
+)
+
+UTC = datetime.timezone.utc
+
+
+def ms(*args):
+    return int(datetime.datetime(*args, tzinfo=UTC).timestamp() * 1000)
+
+
+def week_start(ts):
+    d = ms2datetime(ts).date()
+    monday = d - datetime.timedelta(days=d.weekday())
+    return ms(monday.year, monday.month, monday.day)
+
+
+def month_start(ts):
+    d = ms2datetime(ts)
+    return ms(d.year, d.month, 1)
+
+
+# 跨年、闰年2月、月末最后1ms等
+TIMESTAMPS = np.array([
+    0,
+    ms(2023, 12, 31, 23, 59, 59) + 999,
+    ms(2024, 1, 1),
+    ms(2024, 1, 1) + 1,
+    ms(2024, 2, 29, 12),
+    ms(2024, 3, 1) - 1,
+    ms(2024, 12, 30, 8),
+    ms(2025, 1, 5, 23),
+    ms(2025, 1, 6),
+], dtype=np.int64)
+
+
+def test_week_aligned_to_monday():
+    expected = [week_start(int(t)) for t in TIMESTAMPS]
+    assert floor(TIMESTAMPS, "1w").tolist() == expected
+    assert [floor(int(t), "1w") for t in TIMESTAMPS] == expected
+    assert all(ms2datetime(t).weekday() == 0 for t in expected)
+    assert (next_open(TIMESTAMPS, "1w") - floor(TIMESTAMPS, "1w") == 7 * DAY_MS).all()
+    assert bars_between(ms(2024, 12, 29), ms(2024, 12, 30), "1w") == 1
+    assert bars_between(ms(2024, 12, 30), ms(2025, 1, 5, 23), "1w") == 0
+
+
+def test_month_aligned_to_first_day():
+    expected = [month_start(int(t)) for t in TIMESTAMPS]
+    assert floor(TIMESTAMPS, "1M").tolist() == expected
+    assert [floor(int(t), "1M") for t in TIMESTAMPS] == expected
+    assert next_open(ms(2024, 2, 29, 12), "1M") == ms(2024, 3, 1)
+    assert next_open(ms(2024, 12, 31), "1M") == ms(2025, 1, 1)
+    assert isinstance(next_open(ms(2024, 2, 1), "1M"), int)
+    assert bars_between(ms(2023, 11, 30), ms(2024, 2, 1), "1M") == 3
+    assert bars_between(TIMESTAMPS[:-1], TIMESTAMPS[1:], "1M").tolist() == [
+        (ms2datetime(b).year - ms2datetime(a).year) * 12
+        + ms2datetime(b).month - ms2datetime(a).month
+        for a, b in zip(TIMESTAMPS[:-1].tolist(), TIMESTAMPS[1:].tolist())
+    ]
+    assert is_aligned(ms(2024, 3, 1), "1M")
+    assert not is_aligned(ms(2024, 3, 1) + 1, "1M")
+
+
+@pytest.mark.parametrize("interval", sorted(INTERVAL_MS))
+def test_fixed_intervals(interval):
+    step = interval_ms(interval)
+    opens = floor(TIMESTAMPS, interval)
+    assert is_aligned(opens, interval).all()
+    assert ((TIMESTAMPS - opens >= 0) & (TIMESTAMPS - opens < step)).all()
+    assert (next_open(TIMESTAMPS, interval) == opens + step).all()
+
+
+def test_invalid_interval():
+    with pytest.raises(ValueError):
+        interval_ms("1M")
+    with pytest.raises(ValueError):
+        floor(0, "2w")
+
+
+def test_ticker_window():
+    assert ticker_window("30m") == "1h"
+    assert ticker_window("1h") == "2h"
+    assert ticker_window("12h") == "1d"
+    assert ticker_window("3d") == "6d"
+    for interval in ("1s", "1w", "1M"):
+        with pytest.raises(ValueError):
+            ticker_window(interval)
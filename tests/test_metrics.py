@@ -0,0 +1,82 @@
+import re
+import urllib.request
+
+import pytest
+
+from src.metrics import Registry
+
+# prometheus文本格式的一行样本：name{label="value",...} value
+SAMPLE = re.compile(
+    r'^[a-zA-Z_:][a-zA-Z0-9_:]*'
+    r'(\{[a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*"(,[a-zA-Z_][a-zA-Z0-9_]*="(\\.|[^"\\])*")*\})?'
+    r' (\+Inf|-Inf|NaN|[-+]?[0-9.]+(e[-+]?[0-9]+)?)$'
+)
+
+
+def make_registry():
+    registry = Registry()
+    requests = registry.counter("t_requests_total", "请求数")
+    requests.inc(path="/api/v3/klines", status="200")
+    requests.inc(2, path="/api/v3/klines", status="200")
+    requests.inc(path='/a"b\\c\nd', status="429")
+    registry.gauge("t_used_weight", "权重").set(120, window="1m")
+    seconds = registry.histogram("t_seconds", "耗时", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        seconds.observe(v, stage="rest")
+    return registry
+
+
+def parse(text):
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            assert re.match(r"^# (HELP|TYPE) [a-zA-Z_:][a-zA-Z0-9_:]* .+$", line)
+            continue
+        assert SAMPLE.match(line), line
+        name, value = line.rsplit(" ", 1)
+        samples[name] = value
+    return samples
+
+
+def test_exposition_format():
+    text = make_registry().render()
+    assert text.endswith("\n")
+    samples = parse(text)
+
+    assert "# TYPE t_requests_total counter" in text
+    assert "# TYPE t_used_weight gauge" in text
+    assert "# TYPE t_seconds histogram" in text
+    assert samples['t_requests_total{path="/api/v3/klines",status="200"}'] == "3.0"
+    assert samples['t_requests_total{path="/a\\"b\\\\c\\nd",status="429"}'] == "1.0"
+    assert samples['t_used_weight{window="1m"}'] == "120.0"
+
+    # bucket计数累加，le包含边界值
+    assert samples['t_seconds_bucket{stage="rest",le="0.1"}'] == "2"
+    assert samples['t_seconds_bucket{stage="rest",le="1.0"}'] == "3"
+    assert samples['t_seconds_bucket{stage="rest",le="+Inf"}'] == "4"
+    assert samples['t_seconds_count{stage="rest"}'] == "4"
+    assert float(samples['t_seconds_sum{stage="rest"}']) == pytest.approx(3.65)
+
+
+def test_metric_type_conflict():
+    registry = Registry()
+    assert registry.counter("t_total", "a") is registry.counter("t_total", "a")
+    with pytest.raises(ValueError):
+        registry.gauge("t_total", "a")
+
+
+def test_textfile_and_http(tmp_path):
+    registry = make_registry()
+    path = tmp_path / "metrics" / "w3.prom"
+    registry.write_textfile(str(path))
+    assert path.read_text() == registry.render()
+
+    server = registry.serve(0)
+    try:
+        host, port = server.server_address[:2]
+        with urllib.request.urlopen(f"http://{host}:{port}/metrics") as resp:
+            assert resp.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert resp.read().decode() == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,144 @@
+import hmac
+import hashlib
+from decimal import Decimal
+
+import pytest
+
+from src.exchange import Exchange
+from src.strategy.fake_exchange import FakeExchangeServer, FakeMatchingEngine
+from src.strategy.order import (
+    BinanceOrderParams,
+    BinanceOrderProxy,
+    OrderTracker,
+    Signer,
+)
+
+SYMBOL = "BTCUSDT"
+
+
+def make_exchange():
+    return Exchange({
+        "symbols": [{
+            "symbol": SYMBOL,
+            "status": "TRADING",
+            "baseAsset": "BTC",
+            "quoteAsset": "USDT",
+            "filters": [
+                {"filterType": "PRICE_FILTER", "tickSize": "0.01"},
+                {"filterType": "LOT_SIZE", "minQty": "0.00001", "stepSize": "0.00001"},
+            ],
+        }]
+    })
+
+
+def make_params(**kwargs):
+    return BinanceOrderParams.create(make_exchange(), SYMBOL, "BUY", "0.001234567", **kwargs)
+
+
+def report(status, executed, t, order_id=1):
+    return {
+        "e": "executionReport",
+        "E": t + 1,
+        "T": t,
+        "s": SYMBOL,
+        "c": "c1",
+        "S": "BUY",
+        "o": "MARKET",
+        "q": "0.00123",
+        "X": status,
+        "z": executed,
+        "i": order_id,
+    }
+
+
+def ack(status, executed, transact_time, order_id=1):
+    return {
+        "symbol": SYMBOL,
+        "orderId": order_id,
+        "clientOrderId": "c1",
+        "transactTime": transact_time,
+        "status": status,
+        "executedQty": executed,
+    }
+
+
+def test_signer_matches_hmac_sha256():
+    payload = "symbol=BTCUSDT&side=BUY&type=MARKET&quantity=0.00123&timestamp=1"
+    expected = hmac.new(b"secret", payload.encode(), hashlib.sha256).hexdigest()
+    signer = Signer("secret")
+    assert signer.sign(payload) == expected
+    # 多次签名互不影响
+    assert signer.sign(payload) == expected
+
+
+def test_params_quantized_and_validated():
+    params = make_params()
+    assert params.quantity == Decimal("0.00123")
+    assert ("quantity", "0.00123") in params.to_query()
+    with pytest.raises(ValueError):
+        BinanceOrderParams.create(make_exchange(), SYMBOL, "BUY", "0.000001")
+    with pytest.raises(ValueError):
+        BinanceOrderParams.create(make_exchange(), SYMBOL, "BUY", "1", type="LIMIT")
+
+
+def test_late_ack_does_not_overwrite_report():
+    tracker = OrderTracker()
+    tracker.on_event(report("NEW", "0", 100))
+    tracker.on_event(report("FILLED", "0.00123", 200))
+    # RESULT响应晚于成交事件到达，状态是下单时的NEW
+    order = tracker.on_ack(make_params(), ack("NEW", "0", 100))
+    assert order.status == "FILLED"
+    assert order.executed_qty == Decimal("0.00123")
+    assert order.quantity == Decimal("0.00123")
+
+
+def test_ack_before_report():
+    tracker = OrderTracker()
+    order = tracker.on_ack(make_params(), ack("NEW", "0", 100))
+    assert order.status == "NEW"
+    tracker.on_event(report("FILLED", "0.00123", 200))
+    assert order.status == "FILLED"
+    # 乱序的旧事件被忽略
+    tracker.on_event(report("NEW", "0", 100))
+    assert order.status == "FILLED"
+
+
+def test_same_time_keeps_final_status():
+    tracker = OrderTracker()
+    tracker.on_event(report("FILLED", "0.00123", 100))
+    order = tracker.on_ack(make_params(), ack("NEW", "0", 100))
+    assert order.status == "FILLED"
+
+
+def test_cancel_response_is_ordered():
+    tracker = OrderTracker()
+    tracker.on_ack(make_params(), ack("NEW", "0", 100))
+    tracker.on_event(report("FILLED", "0.00123", 300))
+    order = tracker.on_cancel(1, {"orderId": 1, "status": "CANCELED", "transactTime": 200})
+    assert order.status == "FILLED"
+    assert tracker.on_cancel(2, {"orderId": 2, "status": "CANCELED"}) is None
+
+
+def test_proxy_signs_and_tracks():
+    proxy = BinanceOrderProxy("fake-key", "fake-secret", resp_type="RESULT")
+    engine = FakeMatchingEngine(
+        "fake-secret", prices={SYMBOL: "100"}, on_event=proxy.tracker.on_event
+    )
+    server = FakeExchangeServer(engine).start()
+    proxy.base_url = server.base_url
+    try:
+        data = proxy.make_new_order(make_params(price="90", type="LIMIT"))
+        order = proxy.tracker.get(data["orderId"])
+        assert order.status == "NEW"
+        proxy.cancel_order(order.order_id)
+        assert order.status == "CANCELED"
+
+        data = proxy.make_new_order(make_params())
+        assert proxy.tracker.get(data["orderId"]).status == "FILLED"
+
+        proxy.signer = Signer("wrong-secret")
+        with pytest.raises(Exception):
+            proxy.make_new_order(make_params())
+    finally:
+        proxy.close()
+        server.stop()
@@ -0,0 +1,119 @@
+import numpy as np
+
+from src.bench import gen_klines
+from src.interval import interval_ms
+from src.strategy.executor import StrategyPipeline
+from src.strategy.kline import KlineItem, KlinesManager
+from src.strategy.rank import RankIndex
+from src.strategy.replay import Replayer, ReplayDownloader, VirtualClock, df2series
+
+INTERVAL = "1h"
+SYMBOLS = ["AAAUSDT", "BBBUSDT", "CCCUSDT", "DDDUSDT"]
+
+
+def make_items(symbol, seed, n):
+    ts, o, h, l, c = df2series(gen_klines(INTERVAL, "2024-01-01", 1, seed))
+    return [
+        KlineItem(symbol, INTERVAL, o[i], h[i], l[i], c[i], int(ts[i]))
+        for i in range(n)
+    ]
+
+
+def incr(item):
+    return (float(item.close) - float(item.open)) / float(item.open)
+
+
+def test_rank_ignores_open_bar():
+    step = interval_ms(INTERVAL)
+    items = {s: make_items(s, seed, 10) for seed, s in enumerate(SYMBOLS)}
+    # 第9根(下标8)收盘前，第10根还没开盘，下载结果的最后一根未收盘
+    clock = VirtualClock(items[SYMBOLS[0]][8].open_time + step // 2)
+    manager = KlinesManager(None, clock=clock)
+    for s in SYMBOLS:
+        manager.add(items[s][:9])
+    index = manager.rank_index(INTERVAL)
+
+    expected = sorted(SYMBOLS, key=lambda s: (incr(items[s][7]), s), reverse=True)
+    assert [s for s, _ in index.top(len(SYMBOLS))] == expected
+    for s in SYMBOLS:
+        assert index.get(s) == incr(items[s][7])
+
+    # 未收盘的k线更新不改变排名
+    before = index.top(len(SYMBOLS))
+    for s in SYMBOLS:
+        last = items[s][8]
+        manager.add(KlineItem(
+            s, INTERVAL, last.open, last.high, last.low, str(float(last.open) * 2),
+            last.open_time,
+        ))
+    assert index.top(len(SYMBOLS)) == before
+
+    # 收盘后使用该k线
+    clock.advance_to(items[SYMBOLS[0]][9].open_time + 1)
+    for s in SYMBOLS:
+        manager.add(items[s][8:10])
+    expected = sorted(SYMBOLS, key=lambda s: (incr(items[s][8]), s), reverse=True)
+    assert [s for s, _ in index.top(len(SYMBOLS))] == expected
+
+
+def test_rank_without_closed_bar():
+    items = make_items("AAAUSDT", 0, 1)
+    manager = KlinesManager(None, clock=VirtualClock(items[0].open_time))
+    manager.add(items)
+    assert "AAAUSDT" not in manager.rank_index(INTERVAL)
+
+
+def test_rank_disabled():
+    items = make_items("AAAUSDT", 0, 3)
+    manager = KlinesManager(None, clock=VirtualClock(items[-1].open_time), rank=False)
+    manager.add(items)
+    manager.remove(items[0].name)
+    assert manager.ranks == {}
+
+
+def test_last_3_bars_in_top_decile():
+    symbols = [f"S{i:02d}USDT" for i in range(20)]
+    data = {
+        s: df2series(gen_klines(INTERVAL, "2024-01-01", 2, seed))
+        for seed, s in enumerate(symbols)
+    }
+    ranks = {INTERVAL: RankIndex()}
+    clock = VirtualClock()
+    seen = {}
+
+    def last_3_in_top_decile(klines):
+        history = ranks[INTERVAL].history(klines.symbol, 3)
+        seen[(clock.timestamp, klines.symbol)] = history
+        return len(history) == 3 and min(history) >= 0.9
+
+    replayer = Replayer(
+        StrategyPipeline([last_3_in_top_decile]),
+        ReplayDownloader(data, INTERVAL, clock),
+        ranks=ranks,
+    )
+    first = int(replayer.ticks[0])
+    report = replayer.run()
+
+    # 逐根k线全量排序计算分位数
+    step = interval_ms(INTERVAL)
+    ts = data[symbols[0]][0]
+    incrs = np.array([
+        (data[s][4].astype(float) - data[s][1].astype(float)) / data[s][1].astype(float)
+        for s in symbols
+    ])
+    percentiles = (incrs[None, :, :] < incrs[:, None, :]).sum(axis=1) / len(symbols)
+
+    expected_signals = []
+    for tick in replayer.ticks:
+        tick = int(tick)
+        end = int(np.searchsorted(ts, tick - step, "right"))
+        start = max(end - 3, int(np.searchsorted(ts, first - step)))
+        for i, s in enumerate(symbols):
+            expected = percentiles[i, start:end].tolist()
+            assert seen[(tick, s)] == expected
+            if len(expected) == 3 and min(expected) >= 0.9:
+                expected_signals.append((tick, s))
+    assert expected_signals
+    assert sorted(report.signals) == sorted(
+        (t, s) for t, s in expected_signals if t != first
+    )
@@ -0,0 +1,38 @@
+from collections import Counter
+
+from src.bench import gen_klines
+from src.strategy.executor import StrategyPipeline
+from src.strategy.replay import Replayer, ReplayDownloader, VirtualClock, df2series
+
+INTERVAL = "1h"
+
+
+def gen_data():
+    return {
+        "AAAUSDT": df2series(gen_klines(INTERVAL, "2024-01-01", 2, 0)),
+        # 只有第一天的k线，之后的tick中没有新k线
+        "BBBUSDT": df2series(gen_klines(INTERVAL, "2024-01-01", 1, 1)),
+    }
+
+
+def run_replay(data=None):
+    downloader = ReplayDownloader(data or gen_data(), INTERVAL, VirtualClock())
+    return Replayer(StrategyPipeline([lambda klines: True]), downloader).run()
+
+
+def test_signal_emitted_once_per_bar():
+    report = run_replay()
+    counts = Counter(report.signals)
+    assert max(counts.values()) == 1
+    bbb = [ts for ts, s in report.signals if s == "BBBUSDT"]
+    assert len(bbb) == len(set(bbb))
+    assert len(bbb) < len([s for _, s in report.signals if s == "AAAUSDT"])
+
+
+def test_digest_does_not_depend_on_timezone(set_tz):
+    # 同一份数据在不同时区回放
+    data = gen_data()
+    set_tz("UTC")
+    digest = run_replay(data).digest
+    set_tz("Asia/Shanghai")
+    assert run_replay(data).digest == digest
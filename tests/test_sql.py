@@ -0,0 +1,65 @@
+import pytest
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from src.sql import (
+    AggTradeLog, DownloadLog, DLogStatus, Kline, KlineFile, _pool_map, upsert_stmt,
+)
+
+
+def download_log_stmt(dialect):
+    t = DownloadLog.table
+    return upsert_stmt(
+        dialect,
+        t,
+        lambda excluded: [("status", excluded.status)],
+        where=lambda excluded: t.c.status != excluded.status,
+    )
+
+
+@pytest.mark.parametrize("name, dialect, clause", [
+    ("sqlite", sqlite.dialect(), "ON CONFLICT (symbol, interval, date) DO UPDATE"),
+    ("postgresql", postgresql.dialect(), "ON CONFLICT (symbol, interval, date) DO UPDATE"),
+    ("mysql", mysql.dialect(), "ON DUPLICATE KEY UPDATE status = CASE WHEN"),
+])
+def test_upsert_stmt_dialects(name, dialect, clause):
+    sql = str(download_log_stmt(name).compile(dialect=dialect))
+    assert clause in sql
+    for table in (AggTradeLog.table, Kline.table, KlineFile.table):
+        col = next(c.name for c in table.columns if not c.primary_key)
+        stmt = upsert_stmt(name, table, lambda excluded: [(col, excluded[col])])
+        assert col in str(stmt.compile(dialect=dialect)).split("UPDATE", 1)[1]
+
+
+def test_upsert_stmt_unsupported_dialect():
+    with pytest.raises(ValueError):
+        download_log_stmt("oracle")
+
+
+def test_download_log_bulk_upsert_keeps_newer(tmp_db):
+    def row(status, ts):
+        return dict(symbol="AAAUSDT", interval="1h", date="2024-01-01",
+                    status=status.value, last_timestamp=ts)
+
+    with tmp_db.connect() as conn:
+        DownloadLog.bulk_upsert(conn, [row(DLogStatus.success, 200)])
+        # last_timestamp更小的记录不覆盖
+        DownloadLog.bulk_upsert(conn, [row(DLogStatus.success, 100)])
+        assert tuple(DownloadLog.find_info(conn, "AAAUSDT", "1h", "2024-01-01")) == (1, 200)
+        DownloadLog.bulk_upsert(conn, [row(DLogStatus.fail, 100)])
+        assert tuple(DownloadLog.find_info(conn, "AAAUSDT", "1h", "2024-01-01")) == (2, 100)
+
+
+def test_pool_map_consumes_items_lazily():
+    consumed = 0
+
+    def items():
+        nonlocal consumed
+        for i in range(1000):
+            consumed += 1
+            yield -i
+
+    results = _pool_map(abs, items(), processes=1, chunksize=10)
+    assert next(results) == 0
+    # 最多提交2个chunk
+    assert consumed <= 20
+    assert list(results) == list(range(1, 1000))